@@ -1,22 +1,28 @@
 # app/api/v1/auth.py
 from fastapi import APIRouter, Depends, HTTPException, status, Body,  Security
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr, Field
 from typing import Annotated
 from jose import JWTError, jwt
 from datetime import timedelta, datetime, timezone
 import logging
-from sqlalchemy import or_, func
+from sqlalchemy import or_, select
+from sqlalchemy.orm.attributes import set_committed_value
 from fastapi.security import HTTPAuthorizationCredentials
 from app.core.security import (
-    verify_password,
-    get_password_hash,
     create_access_token,
+    get_current_user,
+    get_token_claims,
     require_auth,
-    security
+    security,
+    verify_token
 )
-from app.models.base import get_db
-from app.models.models import User, Tenant
+from app.core.hashing import PasswordHasherBusyError, password_hasher
+from app.models.base import get_db_session
+from app.models.models import User, Tenant, normalize_key
+from app.services.last_login import last_login_buffer
+from app.services.principals import Principal, principal_cache
+from app.services.revocation import revoke_token, revoke_user_sessions
 from app.schemas.auth import (
     UserCreate,
     UserLogin,
@@ -31,6 +37,38 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Troppe richieste di autenticazione in corso, riprova tra poco",
+        headers={"Retry-After": "1"}
+    )
+
+async def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifica nel pool di processi; 503 immediato se il pool è saturo"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusyError as e:
+        logger.warning("Password verification rejected: %s", e)
+        raise _hashing_busy()
+
+async def _verify_and_update_password(plain_password: str, hashed_password: str):
+    """Come _verify_password, più il nuovo hash se quello salvato non rispetta la politica"""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHasherBusyError as e:
+        logger.warning("Password verification rejected: %s", e)
+        raise _hashing_busy()
+
+async def _hash_password(password: str) -> str:
+    """Hash nel pool di processi; 503 immediato se il pool è saturo"""
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusyError as e:
+        logger.warning("Password hashing rejected: %s", e)
+        raise _hashing_busy()
+
+
 @router.get("/debug-token")
 async def debug_token(
     credentials: HTTPAuthorizationCredentials = Security(security),
@@ -41,7 +79,7 @@ async def debug_token(
     """
     try:
         token = credentials.credentials
-        logger.debug(f"Token ricevuto: {token[:20]}...")
+        logger.debug("Token ricevuto: %s...", token[:20])
         
         # Decodifica il token senza verificarlo
         unverified_payload = jwt.decode(
@@ -62,25 +100,17 @@ async def debug_token(
         
         # Decodifica con verifica
         try:
-            verified_payload = jwt.decode(
-                token,
-                key=settings.SECRET_KEY,
-                algorithms=[settings.ALGORITHM]
-            )
+            verified_payload = verify_token(token)
             verification_status = "OK"
         except Exception as e:
             verification_status = f"FAILED: {str(e)}"
             
-        # Log completo per debug
-        logger.debug(f"""
-        Debug Token Info:
-        - Token Preview: {token[:20]}...
-        - Environment: {settings.ENVIRONMENT}
-        - Algorithm: {settings.ALGORITHM}
-        - Secret Key Length: {len(settings.SECRET_KEY)}
-        - Unverified Payload: {unverified_payload}
-        - Verification Status: {verification_status}
-        """)
+        kid = jwt.get_unverified_header(token).get("kid")
+        # Log completo per debug: formattato solo se il livello DEBUG è attivo
+        logger.debug(
+            "Debug Token Info: preview=%s... environment=%s algorithm=%s kid=%s payload=%s verification=%s",
+            token[:20], settings.ENVIRONMENT, settings.ALGORITHM, kid, unverified_payload, verification_status
+        )
             
         return {
             "token_preview": token[:20],
@@ -88,7 +118,7 @@ async def debug_token(
             "verification_status": verification_status,
             "current_environment": settings.ENVIRONMENT,
             "algorithm": settings.ALGORITHM,
-            "secret_key_length": len(settings.SECRET_KEY),
+            "kid": kid,
             "expiry_info": {
                 "expiry_time": exp_datetime.isoformat() if exp_datetime else None,
                 "current_time": current_time.isoformat(),
@@ -110,34 +140,34 @@ async def debug_token(
 @router.post("/register", response_model=LoginResponse, status_code=status.HTTP_201_CREATED)
 async def register(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db_session),
     user_in: UserCreate = Body(...)
 ) -> LoginResponse:
     try:
-        logger.info(f"Starting user registration process for email: {user_in.email}")
+        logger.info("Starting user registration process for email: %s", user_in.email)
         
         # Verifica esistenza utente
         logger.debug("Checking for existing user")
-        existing_user = db.query(User).filter(
+        existing_user = await db.scalar(select(User).where(
             or_(
-                func.lower(User.email) == func.lower(user_in.email),
-                func.lower(User.username) == func.lower(user_in.username)
+                User.email_norm == normalize_key(user_in.email),
+                User.username_norm == normalize_key(user_in.username)
             )
-        ).first()
+        ).limit(1))
         
         if existing_user:
-            logger.warning(f"Registration attempt with existing email/username: {user_in.email}")
+            logger.warning("Registration attempt with existing email/username: %s", user_in.email)
             raise HTTPException(
                 status_code=400,
                 detail="Email o username già registrati"
             )
 
         # Crea il tenant se specificato
-        logger.debug(f"Creating or retrieving tenant: {user_in.tenant_name}")
+        logger.debug("Creating or retrieving tenant: %s", user_in.tenant_name)
         tenant_name = user_in.tenant_name or "default"
-        tenant = db.query(Tenant).filter(func.lower(Tenant.name) == func.lower(tenant_name)).first()
+        tenant = await db.scalar(select(Tenant).where(Tenant.name_norm == normalize_key(tenant_name)).limit(1))
         if not tenant:
-            logger.debug(f"Creating new tenant: {tenant_name}")
+            logger.debug("Creating new tenant: %s", tenant_name)
             current_time = datetime.now(timezone.utc)
             tenant = Tenant(
                 name=tenant_name,
@@ -146,16 +176,16 @@ async def register(
                 updated_at=current_time
             )
             db.add(tenant)
-            db.commit()
-            db.refresh(tenant)
+            await db.commit()
+            await db.refresh(tenant)
 
         # Crea il nuovo utente
-        logger.debug(f"Creating new user with username: {user_in.username}")
+        logger.debug("Creating new user with username: %s", user_in.username)
         current_time = datetime.now(timezone.utc)
         db_user = User(
             email=user_in.email.lower(),
             username=user_in.username,
-            hashed_password=get_password_hash(user_in.password),
+            hashed_password=await _hash_password(user_in.password),
             tenant_id=tenant.id,
             is_active=True,
             created_at=current_time,
@@ -163,8 +193,8 @@ async def register(
         )
         
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         
         # Crea il token
         logger.debug("Creating access token")
@@ -173,7 +203,7 @@ async def register(
             expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         )
 
-        logger.info(f"User registration successful for: {user_in.email}")
+        logger.info("User registration successful for: %s", user_in.email)
         return LoginResponse(
             access_token=access_token,
             token_type="bearer",
@@ -185,7 +215,7 @@ async def register(
         raise
     except Exception as e:
         logger.error(f"Registration error: {str(e)}", exc_info=True)
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Errore durante la registrazione: {str(e)}" if settings.IS_DEVELOPMENT else "Errore durante la registrazione"
@@ -195,34 +225,45 @@ async def register(
 @router.post("/login", response_model=LoginResponse)
 async def login(
     user_in: UserLogin,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db_session),
 ) -> LoginResponse:
     """
     Autentica un utente e restituisce il token JWT.
     """
     try:
-        # Cerca l'utente per username (case-insensitive)
-        user = db.query(User).filter(
-            func.lower(User.username) == func.lower(user_in.username)
-        ).first()
+        # Cerca l'utente per username (case-insensitive, seek su ix_users_username_norm)
+        user = await db.scalar(select(User).where(
+            User.username_norm == normalize_key(user_in.username)
+        ).limit(1))
         
-        if not user or not verify_password(user_in.password, user.hashed_password):
-            logger.warning(f"Failed login attempt for username: {user_in.username}")
+        valid, new_hash = (
+            await _verify_and_update_password(user_in.password, user.hashed_password) if user else (False, None)
+        )
+        if not valid:
+            logger.warning("Failed login attempt for username: %s", user_in.username)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Username o password non corretti"
             )
         
         if not user.is_active:
-            logger.warning(f"Login attempt for inactive user: {user_in.username}")
+            logger.warning("Login attempt for inactive user: %s", user_in.username)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Utente disattivato"
             )
 
-        # Aggiorna last_login
-        user.update_last_login()
-        db.commit()
+        # last_login passa dal buffer write-behind: il login non attende la scrittura.
+        # Il valore nella risposta è quello nuovo, senza segnare l'utente come modificato
+        login_time = datetime.now(timezone.utc)
+        last_login_buffer.record(user.id, login_time)
+        principal_cache.record_login(user.id, login_time)
+        set_committed_value(user, "last_login", login_time)
+        if new_hash:
+            # Politica di hash cambiata: l'hash aggiornato si salva subito
+            user.hashed_password = new_hash
+            await db.commit()
+            logger.info("Password hash upgraded for user: %s", user_in.username)
 
         # Crea il token di accesso
         access_token = create_access_token(
@@ -230,7 +271,7 @@ async def login(
             expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         )
 
-        logger.info(f"Successful login for user: {user_in.username}")
+        logger.info("Successful login for user: %s", user_in.username)
         return LoginResponse(
             access_token=access_token,
             token_type="bearer",
@@ -240,17 +281,62 @@ async def login(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Login error: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail="Errore durante il login"
         )
 
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    *,
+    db: AsyncSession = Depends(get_db_session),
+    claims: dict = Depends(get_token_claims)
+) -> None:
+    """
+    Revoca il token della richiesta. Gli altri worker smettono di
+    accettarlo entro REVOCATION_SYNC_SECONDS.
+    """
+    try:
+        if claims.get("jti"):
+            await db.run_sync(revoke_token, claims)
+        else:
+            # Token emessi prima dell'introduzione del jti: si revocano tutte le sessioni
+            await db.run_sync(revoke_user_sessions, int(claims["sub"]))
+        logger.info("User %s logged out", claims['sub'])
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Logout error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Errore durante il logout"
+        )
+
+@router.post("/logout-all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(
+    *,
+    db: AsyncSession = Depends(get_db_session),
+    current_user_id: int = Depends(require_auth)
+) -> None:
+    """
+    Revoca tutte le sessioni dell'utente corrente, compresa questa.
+    """
+    try:
+        await db.run_sync(revoke_user_sessions, current_user_id)
+        logger.info("All sessions revoked for user %s", current_user_id)
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Logout-all error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Errore durante la revoca delle sessioni"
+        )
+
 @router.post("/password-reset", status_code=status.HTTP_202_ACCEPTED)
 async def request_password_reset(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db_session),
     email_in: PasswordReset
 ) -> dict:
     """
@@ -259,11 +345,11 @@ async def request_password_reset(
     """
     try:
         # Cerca utente (case-insensitive)
-        user = db.query(User).filter(
-            func.lower(User.email) == func.lower(email_in.email)
-        ).first()
+        user = await db.scalar(select(User).where(
+            User.email_norm == normalize_key(email_in.email)
+        ).limit(1))
         
-        logger.info(f"Password reset requested for email: {email_in.email}")
+        logger.info("Password reset requested for email: %s", email_in.email)
         
         if settings.IS_DEVELOPMENT:
             return {
@@ -283,7 +369,7 @@ async def request_password_reset(
 @router.put("/password", status_code=status.HTTP_200_OK)
 async def change_password(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db_session),
     password_data: PasswordUpdate = Body(...),
     current_user_id: int = Depends(require_auth)
 ) -> dict:
@@ -291,10 +377,10 @@ async def change_password(
     Cambia la password dell'utente corrente.
     """
     try:
-        logger.debug(f"Attempting password change for user_id: {current_user_id}")
+        logger.debug("Attempting password change for user_id: %s", current_user_id)
         
         # Recupera l'utente dal database
-        current_user = db.query(User).filter(User.id == current_user_id).first()
+        current_user = await db.get(User, current_user_id)
         if not current_user:
             logger.error(f"User not found for id: {current_user_id}")
             raise HTTPException(
@@ -303,30 +389,31 @@ async def change_password(
             )
 
         # Verifica la password corrente
-        if not verify_password(password_data.current_password, current_user.hashed_password):
-            logger.warning(f"Invalid current password in change attempt for user: {current_user.username}")
+        if not await _verify_password(password_data.current_password, current_user.hashed_password):
+            logger.warning("Invalid current password in change attempt for user: %s", current_user.username)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Password corrente non valida"
             )
 
         # Aggiorna la password
+        hashed_password = await _hash_password(password_data.new_password)
         try:
-            current_user.hashed_password = get_password_hash(password_data.new_password)
+            current_user.hashed_password = hashed_password
             current_user.updated_at = datetime.now(timezone.utc)
-            db.commit()
-            logger.info(f"Password successfully changed for user: {current_user.username}")
+            await db.commit()
+            logger.info("Password successfully changed for user: %s", current_user.username)
             return {"message": "Password aggiornata con successo"}
         except Exception as db_error:
             logger.error(f"Database error during password update: {str(db_error)}")
-            db.rollback()
+            await db.rollback()
             raise
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Password change error: {str(e)}", exc_info=True)
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=str(e) if settings.IS_DEVELOPMENT else "Errore durante il cambio password"
@@ -335,37 +422,29 @@ async def change_password(
 @router.get("/me", response_model=LoginResponse)
 async def read_current_user(
     *,
-    db: Session = Depends(get_db),
-    current_user_id: int = Depends(require_auth)  # Questo restituisce solo l'ID
+    current_user: Principal = Depends(get_current_user)
 ) -> LoginResponse:
     """
     Restituisce i dati dell'utente corrente e rinnova il token.
+    I dati arrivano dal cache dei principal, senza sessione DB.
     """
     try:
-        # Recupera l'utente dal database usando l'ID
-        current_user = db.query(User).filter(User.id == current_user_id).first()
-        if not current_user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Utente non trovato"
-            )
-
         # Crea un nuovo token
         access_token = create_access_token(
             data={"sub": current_user.id},
             expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         )
 
-        logger.info(f"Current user data retrieved for: {current_user.username}")
+        logger.info("Current user data retrieved for: %s", current_user.username)
         return LoginResponse(
             access_token=access_token,
             token_type="bearer",
             expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-            user=current_user
+            user=current_user._asdict()
         )
     except Exception as e:
         logger.error(f"Error retrieving current user data: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail="Errore nel recupero dei dati utente"
-        )
\ No newline at end of file
+        )
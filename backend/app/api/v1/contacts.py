@@ -1,82 +1,259 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Path, Body, status
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from sqlalchemy import or_, func, text
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Path, Body, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, List, Optional, Tuple
+from pydantic import TypeAdapter
+from sqlalchemy import func, select, delete
 import logging
 from datetime import datetime, timezone
 from app.core.security import require_auth
-from app.models.base import get_db
+from app.core.etag import CACHE_HEADERS, contact_etag, etag_matches, list_etag
+from app.core.pagination import (
+    CURSOR_NEXT,
+    CURSOR_PREV,
+    InvalidCursorError,
+    cursor_pages,
+    decode_cursor,
+    keyset_filter
+)
+from app.models.base import detached_session, get_db_session
 from app.models.models import Contact, User
 from app.schemas.contacts import (
     ContactCreate, 
     ContactUpdate, 
     ContactResponse,
     ContactSearch,
-    ContactListResponse
+    ContactSuggestion,
+    ContactListResponse,
+    ContactChangesResponse,
+    BulkResponse,
+    ImportJobResponse
 )
 from app.core.config import settings
+from app.services.search_index import contact_index
+from app.services.suggest import suggest_index
+from app.services.contacts_bulk import validate_operations, apply_operations
+from app.services.export import EXPORT_FORMATS, export_columns, stream_contacts
+from app.services.counters import adjust_counters, get_counters
+from app.services.sync import (
+    InvalidSyncTokenError,
+    SyncTokenExpiredError,
+    get_changes,
+    record_deletions
+)
+from app.services.contacts_import import ImportTooLargeError, import_jobs, run_import, spool_upload
+from app.services.response_cache import CachedResponse, response_cache
 
 # Configurazione logger
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+_contact_list_adapter = TypeAdapter(List[ContactResponse])
+
+# Ordinamento stabile della rubrica: l'id rende la chiave univoca per il keyset
+CONTACT_SORT_KEY = (Contact.last_name, Contact.first_name, Contact.id)
+CONTACT_SORT_TYPES = (str, str, int)  # Tipi attesi nel cursore, nell'ordine di CONTACT_SORT_KEY
+
+def _contact_sort_values(contact: Contact) -> tuple:
+    """Valori della chiave di ordinamento di un contatto, nell'ordine di CONTACT_SORT_KEY"""
+    return (contact.last_name, contact.first_name, contact.id)
+
+async def _index_contact(contact: Contact) -> None:
+    """Propaga una create/update agli indici in memoria e alla cache delle risposte"""
+    contact_index.upsert(contact)
+    suggest_index.upsert(contact)
+    await response_cache.invalidate_async(contact.owner_id)
+
+async def _unindex_contact(owner_id: int, contact_id: int) -> None:
+    """Propaga una delete agli indici in memoria e alla cache delle risposte"""
+    contact_index.remove(owner_id, contact_id)
+    suggest_index.remove(owner_id, contact_id)
+    await response_cache.invalidate_async(owner_id)
+
+async def _apply_search(query, db: AsyncSession, owner_id: int, search: str):
+    """
+    Applica la ricerca: con l'indice a trigrammi diventa un lookup per chiave
+    primaria sugli id candidati, altrimenti ricade sul LIKE.
+    """
+    ids = await db.run_sync(contact_index.search, owner_id, search)
+    if ids is None:
+        return query.where(Contact.search_filter(search))
+    return query.where(Contact.id.in_(ids))
+
+async def _count_contacts(
+    db: AsyncSession,
+    query,
+    counters: Tuple[int, int],
+    favorite: Optional[bool],
+    search: Optional[str]
+) -> Tuple[int, bool]:
+    """
+    Totale della lista e se è esatto. Senza ricerca viene dai contatori
+    (totale e preferiti); con una ricerca è un COUNT limitato a
+    COUNT_SEARCH_CAP righe, oltre il quale si restituisce la soglia.
+    """
+    if not search:
+        total, favorites = counters
+        if favorite is None:
+            return total, True
+        return (favorites if favorite else total - favorites), True
+
+    cap = settings.COUNT_SEARCH_CAP
+    capped = query.with_only_columns(Contact.id).order_by(None).limit(cap + 1).subquery()
+    count = await db.scalar(select(func.count()).select_from(capped))
+    return min(count, cap), count <= cap
+
+async def _get_contacts_by_cursor(
+    db: AsyncSession,
+    query,
+    cursor: Optional[str],
+    size: int,
+    total: Optional[int],
+    total_exact: bool
+) -> ContactListResponse:
+    """Paginazione keyset: legge size + 1 righe dopo (o prima di) la chiave del cursore."""
+    direction = CURSOR_NEXT
+
+    if cursor:
+        values, direction = decode_cursor(cursor, CONTACT_SORT_TYPES)
+        query = query.where(keyset_filter(CONTACT_SORT_KEY, values, direction))
+
+    if direction == CURSOR_PREV:
+        order_by = [column.desc() for column in CONTACT_SORT_KEY]
+    else:
+        order_by = list(CONTACT_SORT_KEY)
+
+    rows = (await db.scalars(query.order_by(*order_by).limit(size + 1))).all()
+    contacts, next_cursor, prev_cursor = cursor_pages(
+        rows, size, _contact_sort_values, direction, has_cursor=bool(cursor)
+    )
+
+    return ContactListResponse(
+        items=contacts,
+        total=total,
+        size=size,
+        total_exact=total_exact,
+        pages=(total + size - 1) // size if total is not None else None,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor
+    )
+
+async def _contacts_list_etag(db: AsyncSession, owner_id: int, count: int, request: Request) -> str:
+    """ETag della lista: il conteggio viene dai contatori, max(updated_at) da un seek sull'indice"""
+    max_updated_at = await db.scalar(
+        select(func.max(Contact.updated_at)).where(Contact.owner_id == owner_id)
+    )
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return list_etag(owner_id, max_updated_at, count, params)
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **CACHE_HEADERS})
+
+def _cached_json(cached: CachedResponse, request: Request) -> Response:
+    """Risposta servita dalla cache, senza toccare il database"""
+    if cached.etag and etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return _not_modified(cached.etag)
+    headers = {"X-Cache": "HIT", **CACHE_HEADERS}
+    if cached.etag:
+        headers["ETag"] = cached.etag
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+async def _store_json(cache_key: Optional[str], body: bytes, etag: Optional[str] = None) -> Response:
+    """Serializza una volta sola: gli stessi byte vanno in cache e nella risposta"""
+    await response_cache.store_async(cache_key, body, etag)
+    headers = {"X-Cache": "MISS", **CACHE_HEADERS}
+    if etag:
+        headers["ETag"] = etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _check_if_match(request: Request, contact_id: int, updated_at) -> None:
+    """412 se If-Match è presente e non corrisponde alla versione corrente"""
+    if_match = request.headers.get("if-match")
+    if if_match and not etag_matches(if_match, contact_etag(contact_id, updated_at), weak=False):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Il contatto è stato modificato da un'altra richiesta"
+        )
+
 @router.get("", response_model=ContactListResponse)
 async def get_contacts(
+    request: Request,
     page: int = Query(1, ge=1, description="Numero pagina"),
     size: int = Query(10, ge=1, le=settings.MAX_PAGE_SIZE, description="Elementi per pagina"),
     search: Optional[str] = Query(None, min_length=1, max_length=100),
     favorite: Optional[bool] = Query(None),
+    paginate: str = Query("page", pattern="^(page|cursor)$", description="Modalità di paginazione"),
+    cursor: Optional[str] = Query(None, max_length=512, description="Cursore opaco restituito da una pagina precedente"),
+    include_total: bool = Query(False, description="Calcola il totale anche in modalità cursore"),
     current_user_id: int = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db_session)
 ) -> ContactListResponse:
-    """Recupera la lista dei contatti con paginazione e filtri."""
+    """
+    Recupera la lista dei contatti con paginazione e filtri.
+    In modalità cursore (paginate=cursor o cursor valorizzato) usa il seek
+    sull'indice (owner_id, last_name, first_name) invece di OFFSET e non
+    esegue il COUNT a meno che non venga richiesto con include_total.
+    Con If-None-Match uguale all'ETag corrente risponde 304 senza leggere i contatti.
+    Le pagine già calcolate vengono servite dalla cache delle risposte.
+    """
+    cache_key, cached = await response_cache.lookup_async(current_user_id, "list", (
+        ("page", page), ("size", size), ("search", search), ("favorite", favorite),
+        ("paginate", paginate), ("cursor", cursor), ("include_total", include_total)
+    ))
+    if cached is not None:
+        return _cached_json(cached, request)
+
     try:
+        # L'ETag viene calcolato prima della lettura: una scrittura concorrente
+        # può solo renderlo più vecchio del corpo, mai il contrario
+        counters = await db.run_sync(get_counters, current_user_id)
+        etag = await _contacts_list_etag(db, current_user_id, counters[0], request)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return _not_modified(etag)
+
         # Base query
-        query = db.query(Contact).filter(Contact.owner_id == current_user_id)
+        query = select(Contact).where(Contact.owner_id == current_user_id)
 
         # Filtro preferiti
         if favorite is not None:
-            query = query.filter(Contact.favorite == favorite)
+            query = query.where(Contact.favorite == favorite)
 
         # Ricerca
         if search:
-            search_lower = search.lower()
-            if settings.IS_DEVELOPMENT:
-                query = query.filter(
-                    or_(
-                        Contact.first_name.ilike(f"%{search}%"),
-                        Contact.last_name.ilike(f"%{search}%"),
-                        Contact.email.ilike(f"%{search}%"),
-                        Contact.phone.ilike(f"%{search}%")
-                    )
-                )
-            else:
-                query = query.filter(
-                    or_(
-                        func.lower(Contact.first_name).like(f"%{search_lower}%"),
-                        func.lower(Contact.last_name).like(f"%{search_lower}%"),
-                        func.lower(Contact.email).like(f"%{search_lower}%"),
-                        func.lower(Contact.phone).like(f"%{search_lower}%")
-                    )
-                )
+            query = await _apply_search(query, db, current_user_id, search)
 
-        # Conteggio totale
-        total = query.count()
-        
-        # Paginazione
-        contacts = query.order_by(Contact.last_name, Contact.first_name)\
-                      .offset((page - 1) * size)\
-                      .limit(size)\
-                      .all()
-
-        return ContactListResponse(
-            items=contacts,
-            total=total,
-            page=page,
-            size=size,
-            pages=(total + size - 1) // size
-        )
+        if cursor is not None or paginate == "cursor":
+            total, total_exact = (
+                await _count_contacts(db, query, counters, favorite, search) if include_total else (None, True)
+            )
+            result = await _get_contacts_by_cursor(db, query, cursor, size, total, total_exact)
+        else:
+            # Conteggio totale
+            total, total_exact = await _count_contacts(db, query, counters, favorite, search)
+
+            # Paginazione
+            contacts = (await db.scalars(
+                query.order_by(*CONTACT_SORT_KEY)
+                     .offset((page - 1) * size)
+                     .limit(size)
+            )).all()
+
+            result = ContactListResponse(
+                items=contacts,
+                total=total,
+                total_exact=total_exact,
+                page=page,
+                size=size,
+                pages=(total + size - 1) // size
+            )
+
+        return await _store_json(cache_key, result.model_dump_json().encode("utf-8"), etag)
 
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error fetching contacts: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -84,11 +261,104 @@ async def get_contacts(
             detail="Errore nel recupero dei contatti"
         )
 
+@router.get("/suggest", response_model=List[ContactSuggestion])
+async def suggest_contacts(
+    q: str = Query(..., min_length=1, max_length=100, description="Prefisso da completare"),
+    limit: int = Query(8, ge=1, le=settings.SUGGEST_MAX_RESULTS),
+    current_user_id: int = Depends(require_auth),
+    db: AsyncSession = Depends(get_db_session)
+) -> List[ContactSuggestion]:
+    """
+    Completamento per prefisso su nome, cognome, nome completo ed email.
+    Servito da un indice in memoria per proprietario: dopo il primo
+    caricamento non esegue query.
+    """
+    try:
+        return await db.run_sync(suggest_index.suggest, current_user_id, q, limit)
+    except Exception as e:
+        logger.error(f"Error suggesting contacts: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Errore nel completamento dei contatti"
+        )
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_contacts(
+    format: str = Query("csv", pattern="^(csv|vcf|ndjson)$", description="Formato dell'export"),
+    gzip: bool = Query(False, description="Comprime al volo (Content-Encoding: gzip)"),
+    search: Optional[str] = Query(None, min_length=1, max_length=100),
+    favorite: Optional[bool] = Query(None),
+    current_user_id: int = Depends(require_auth),
+    db: AsyncSession = Depends(get_db_session)
+) -> StreamingResponse:
+    """
+    Esporta i contatti in streaming con gli stessi filtri della lista.
+    Le righe vengono lette e serializzate a blocchi mentre la risposta
+    viene inviata, quindi la memoria resta costante.
+    """
+    try:
+        query = select(*export_columns()).where(Contact.owner_id == current_user_id)
+        if favorite is not None:
+            query = query.where(Contact.favorite == favorite)
+        if search:
+            query = await _apply_search(query, db, current_user_id, search)
+        query = query.order_by(*CONTACT_SORT_KEY)
+    except Exception as e:
+        logger.error(f"Error preparing contacts export: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Errore nell'esportazione dei contatti"
+        )
+
+    _, media_type, extension = EXPORT_FORMATS[format]
+    headers = {"Content-Disposition": f'attachment; filename="contacts.{extension}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+
+    logger.info("Exporting contacts for user %s as %s", current_user_id, format)
+    return StreamingResponse(
+        stream_contacts(detached_session(db), query, format, compress=gzip),
+        media_type=media_type,
+        headers=headers
+    )
+
+@router.get("/changes", response_model=ContactChangesResponse)
+async def get_contact_changes(
+    since: Optional[str] = Query(None, max_length=512, description="Token restituito dalla sincronizzazione precedente"),
+    limit: int = Query(settings.SYNC_PAGE_SIZE, ge=1, le=settings.SYNC_MAX_PAGE_SIZE),
+    current_user_id: int = Depends(require_auth),
+    db: AsyncSession = Depends(get_db_session)
+) -> ContactChangesResponse:
+    """
+    Sincronizzazione incrementale: contatti creati/modificati e id eliminati
+    dopo il token `since`. Senza token restituisce l'intera rubrica.
+    Un token troppo vecchio (tombstone già compattate) restituisce 410:
+    il client deve ripartire da una sincronizzazione completa.
+    """
+    try:
+        return await db.run_sync(get_changes, current_user_id, since, limit)
+    except InvalidSyncTokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except SyncTokenExpiredError as e:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error fetching contact changes: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Errore nella sincronizzazione dei contatti"
+        )
+
 @router.post("", response_model=ContactResponse, status_code=status.HTTP_201_CREATED)
 async def create_contact(
     contact_in: ContactCreate,
     current_user_id: int = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db_session)
 ) -> ContactResponse:
     """Crea un nuovo contatto."""
     try:
@@ -101,32 +371,163 @@ async def create_contact(
         )
         
         db.add(contact)
-        db.commit()
-        db.refresh(contact)
+        await db.run_sync(adjust_counters, current_user_id, total=1, favorites=int(bool(contact.favorite)))
+        await db.commit()
+        await db.refresh(contact)
+        await _index_contact(contact)
         
-        logger.info(f"Contact created successfully: {contact.id}")
+        logger.info("Contact created successfully: %s", contact.id)
         return contact
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating contact: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Errore nella creazione del contatto"
         )
 
+@router.post("/bulk", response_model=BulkResponse)
+async def bulk_contacts(
+    operations: List[Any] = Body(..., description="Lista di operazioni create/update/delete"),
+    current_user_id: int = Depends(require_auth),
+    db: AsyncSession = Depends(get_db_session)
+) -> BulkResponse:
+    """
+    Esegue molte create/update/delete in una sola richiesta e transazione.
+    Gli elementi non validi, non trovati o rifiutati dal database vengono
+    riportati singolarmente senza bloccare gli altri; solo un errore del
+    database non legato a una riga annulla l'intero lotto.
+    """
+    if len(operations) > settings.BULK_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Massimo {settings.BULK_MAX_OPERATIONS} operazioni per richiesta"
+        )
+
+    try:
+        results = await db.run_sync(apply_operations, current_user_id, validate_operations(operations))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error in bulk contacts operation: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Errore nell'esecuzione delle operazioni massive"
+        )
+
+    # Più economico ricostruire gli indici in memoria che aggiornarli riga per riga
+    contact_index.invalidate(current_user_id)
+    suggest_index.invalidate(current_user_id)
+    await response_cache.invalidate_async(current_user_id)
+
+    counts = {201: 0, 200: 0, 204: 0}
+    for result in results:
+        if result.status in counts:
+            counts[result.status] += 1
+    logger.info("Bulk contacts for user %s: %d operations", current_user_id, len(results))
+    return BulkResponse(
+        results=results,
+        created=counts[201],
+        updated=counts[200],
+        deleted=counts[204],
+        failed=len(results) - sum(counts.values())
+    )
+
+async def _upload_chunks(upload, chunk_size: int = 1024 * 1024):
+    while chunk := await upload.read(chunk_size):
+        yield chunk
+
+@router.post("/import", response_model=ImportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def import_contacts(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    format: str = Query("csv", pattern="^(csv|vcf|ndjson)$", description="Formato del file"),
+    current_user_id: int = Depends(require_auth),
+    db: AsyncSession = Depends(get_db_session)
+) -> ImportJobResponse:
+    """
+    Importa contatti da CSV, vCard o NDJSON (stesse colonne dell'export).
+    Accetta un upload multipart (campo "file") oppure il file come corpo
+    della richiesta. Risponde subito con 202: validazione e inserimento
+    proseguono in background, l'avanzamento si legge da GET /imports/{id}.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Campo 'file' mancante"
+                )
+            spool = await spool_upload(_upload_chunks(upload))
+        else:
+            spool = await spool_upload(request.stream())
+    except HTTPException:
+        raise
+    except ImportTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error receiving contacts import: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Errore nella ricezione del file"
+        )
+
+    job = import_jobs.create(current_user_id, format)
+    # Il job riusa la sessione della richiesta e la chiude al termine
+    background_tasks.add_task(run_import, job, detached_session(db), spool)
+    response.headers["Location"] = f"{settings.API_V1_STR}/contacts/imports/{job.id}"
+    logger.info("Contacts import %s queued for user %s (%s)", job.id, current_user_id, format)
+    return job
+
+@router.get("/imports/{job_id}", response_model=ImportJobResponse)
+async def get_import(
+    job_id: str = Path(..., min_length=1, max_length=64),
+    current_user_id: int = Depends(require_auth)
+) -> ImportJobResponse:
+    """Stato e avanzamento di un import."""
+    job = import_jobs.get(job_id, current_user_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import non trovato"
+        )
+    return job
+
 @router.get("/{contact_id}", response_model=ContactResponse)
 async def get_contact(
+    request: Request,
     contact_id: int = Path(..., gt=0),
     current_user_id: int = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db_session)
 ) -> ContactResponse:
-    """Recupera un contatto specifico."""
+    """Recupera un contatto specifico (304 se If-None-Match corrisponde)."""
+    cache_key, cached = await response_cache.lookup_async(current_user_id, "contact", (("id", contact_id),))
+    if cached is not None:
+        return _cached_json(cached, request)
+
     try:
-        contact = db.query(Contact).filter(
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            # Basta updated_at per sapere se la copia del client è ancora valida
+            updated_at = await db.scalar(select(Contact.updated_at).where(
+                Contact.id == contact_id,
+                Contact.owner_id == current_user_id
+            ))
+            etag = contact_etag(contact_id, updated_at)
+            if updated_at is not None and etag_matches(if_none_match, etag):
+                return _not_modified(etag)
+
+        contact = await db.scalar(select(Contact).where(
             Contact.id == contact_id,
             Contact.owner_id == current_user_id
-        ).first()
+        ))
         
         if not contact:
             raise HTTPException(
@@ -134,7 +535,8 @@ async def get_contact(
                 detail="Contatto non trovato"
             )
         
-        return contact
+        body = ContactResponse.model_validate(contact).model_dump_json().encode("utf-8")
+        return await _store_json(cache_key, body, contact_etag(contact.id, contact.updated_at))
     except HTTPException:
         raise
     except Exception as e:
@@ -146,39 +548,55 @@ async def get_contact(
 
 @router.put("/{contact_id}", response_model=ContactResponse)
 async def update_contact(
+    request: Request,
+    response: Response,
     contact_id: int = Path(..., gt=0),
     contact_in: ContactUpdate = Body(...),
     current_user_id: int = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db_session)
 ) -> ContactResponse:
-    """Aggiorna un contatto esistente."""
+    """
+    Aggiorna un contatto esistente.
+    Con If-Match l'aggiornamento avviene solo se il contatto non è cambiato
+    dall'ultima lettura (412 altrimenti): la riga resta bloccata fino al commit.
+    """
     try:
-        contact = db.query(Contact).filter(
+        query = select(Contact).where(
             Contact.id == contact_id,
             Contact.owner_id == current_user_id
-        ).first()
+        )
+        if request.headers.get("if-match"):
+            query = query.with_for_update()
+        contact = await db.scalar(query)
         
         if not contact:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 detail="Contatto non trovato"
             )
+        _check_if_match(request, contact.id, contact.updated_at)
         
+        was_favorite = bool(contact.favorite)
         update_data = contact_in.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(contact, field, value)
         
         contact.updated_at = datetime.now(timezone.utc)
-        db.commit()
-        db.refresh(contact)
+        await db.run_sync(
+            adjust_counters, current_user_id, favorites=int(bool(contact.favorite)) - int(was_favorite)
+        )
+        await db.commit()
+        await db.refresh(contact)
+        await _index_contact(contact)
         
-        logger.info(f"Contact updated: {contact_id}")
+        response.headers["ETag"] = contact_etag(contact.id, contact.updated_at)
+        logger.info("Contact updated: %s", contact_id)
         return contact
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error updating contact {contact_id}: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -187,29 +605,49 @@ async def update_contact(
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_contact(
+    request: Request,
     contact_id: int = Path(..., gt=0),
     current_user_id: int = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db_session)
 ):
-    """Elimina un contatto."""
+    """Elimina un contatto (solo se If-Match, quando presente, corrisponde)."""
     try:
-        result = db.query(Contact).filter(
-            Contact.id == contact_id,
-            Contact.owner_id == current_user_id
-        ).delete()
+        if request.headers.get("if-match"):
+            updated_at = await db.scalar(
+                select(Contact.updated_at)
+                .where(Contact.id == contact_id, Contact.owner_id == current_user_id)
+                .with_for_update()
+            )
+            if updated_at is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Contatto non trovato"
+                )
+            _check_if_match(request, contact_id, updated_at)
+
+        # RETURNING: il flag preferito serve ai contatori senza un'altra SELECT
+        deleted = (await db.execute(
+            delete(Contact)
+            .where(Contact.id == contact_id, Contact.owner_id == current_user_id)
+            .returning(Contact.favorite),
+            execution_options={"synchronize_session": False}
+        )).scalars().all()
         
-        if not result:
+        if not deleted:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 detail="Contatto non trovato"
             )
         
-        db.commit()
-        logger.info(f"Contact deleted: {contact_id}")
+        await db.run_sync(record_deletions, current_user_id, [contact_id])
+        await db.run_sync(adjust_counters, current_user_id, total=-1, favorites=-int(bool(deleted[0])))
+        await db.commit()
+        await _unindex_contact(current_user_id, contact_id)
+        logger.info("Contact deleted: %s", contact_id)
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error deleting contact {contact_id}: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -220,36 +658,29 @@ async def delete_contact(
 async def search_contacts(
     search_params: ContactSearch = Body(...),
     current_user_id: int = Depends(require_auth),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db_session)
 ) -> List[ContactResponse]:
     """Ricerca avanzata dei contatti."""
+    cache_key, cached = await response_cache.lookup_async(current_user_id, "search", (
+        ("query", search_params.query), ("favorite_only", search_params.favorite_only)
+    ))
+    if cached is not None:
+        return Response(content=cached.body, media_type="application/json", headers={"X-Cache": "HIT"})
+
     try:
-        query = db.query(Contact).filter(Contact.owner_id == current_user_id)
+        query = select(Contact).where(Contact.owner_id == current_user_id)
         
         if search_params.favorite_only:
-            query = query.filter(Contact.favorite == True)
+            query = query.where(Contact.favorite == True)
         
-        search = search_params.query.lower()
-        if settings.IS_DEVELOPMENT:
-            query = query.filter(
-                or_(
-                    Contact.first_name.ilike(f"%{search}%"),
-                    Contact.last_name.ilike(f"%{search}%"),
-                    Contact.email.ilike(f"%{search}%"),
-                    Contact.phone.ilike(f"%{search}%")
-                )
-            )
-        else:
-            query = query.filter(
-                or_(
-                    func.lower(Contact.first_name).like(f"%{search}%"),
-                    func.lower(Contact.last_name).like(f"%{search}%"),
-                    func.lower(Contact.email).like(f"%{search}%"),
-                    func.lower(Contact.phone).like(f"%{search}%")
-                )
-            )
+        query = await _apply_search(query, db, current_user_id, search_params.query)
         
-        return query.order_by(Contact.last_name, Contact.first_name).all()
+        contacts = (await db.scalars(query.order_by(Contact.last_name, Contact.first_name))).all()
+        body = _contact_list_adapter.dump_json(
+            _contact_list_adapter.validate_python(contacts, from_attributes=True)
+        )
+        await response_cache.store_async(cache_key, body)
+        return Response(content=body, media_type="application/json", headers={"X-Cache": "MISS"})
     except Exception as e:
         logger.error(f"Error searching contacts: {str(e)}", exc_info=True)
         raise HTTPException(
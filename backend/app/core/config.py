@@ -1,10 +1,7 @@
 # app/core/config.py
-import os
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 from typing import Optional
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
 
 class Settings(BaseSettings):
     # App Configuration
@@ -17,8 +14,32 @@ class Settings(BaseSettings):
 
     # Authentication
     SECRET_KEY: str
-    ALGORITHM: str = "HS256"
+    ALGORITHM: str = "HS256"  # HS256/384/512 o EdDSA/ES256 (chiavi private PEM in jwt-signing-keys, pubbliche nel JWKS)
+    JWT_BACKEND: str = "native"  # native (chiavi pre-caricate, app/core/jwt_codec.py) o jose (python-jose, solo HMAC)
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Segreti (app/core/secret_provider.py): letti all'avvio e ricaricati in background
+    SECRETS_BACKEND: str = "auto"  # auto (Key Vault in production, env altrimenti), keyvault o env
+    SECRETS_FILE: Optional[str] = None  # JSON nome -> valore per il backend env (es. jwt-signing-keys)
+    SECRETS_REFRESH_SECONDS: int = 300
+    AZURE_KEY_VAULT_ENDPOINT: Optional[str] = None
+    JWT_CACHE_MAX_ENTRIES: int = 10000  # Token verificati tenuti in memoria fino alla scadenza
+    # Utente e tenant autenticati in memoria: niente sessione DB per la sola autenticazione
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60  # Ritardo massimo con cui una disattivazione fatta da un altro worker ha effetto
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = 10000
+    # Revoca dei token (logout): filtro di Bloom e insieme esatto in memoria, allineati dalla tabella token_revocations
+    REVOCATION_SYNC_SECONDS: int = 5  # Ritardo massimo con cui una revoca arriva agli altri worker
+    REVOCATION_BLOOM_CAPACITY: int = 100000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    # last_login scritto in batch da un task di background (app/services/last_login.py)
+    LAST_LOGIN_FLUSH_SECONDS: int = 10
+    LAST_LOGIN_FLUSH_MAX_ENTRIES: int = 500  # Flush anticipato oltre questa soglia
+    LAST_LOGIN_DELIVERY: str = "at-least-once"  # at-least-once (batch falliti riprovati) o at-most-once (scartati)
+    PASSWORD_HASH_WORKERS: int = -1  # Processi per bcrypt: -1 uno per core, 0 nessun processo (thread/inline)
+    PASSWORD_HASH_MAX_PENDING: int = 32  # Hash in corso oltre i quali login/register rispondono 503
+    PASSWORD_HASH_SCHEMES: str = "bcrypt"  # Es. "argon2,bcrypt": il primo per i nuovi hash, gli altri aggiornati al login
+    PASSWORD_HASH_TARGET_MS: int = 250  # Durata obiettivo di una verifica, calibrata all'avvio (0 = costi fissi)
+    PASSWORD_BCRYPT_ROUNDS: int = 12  # Costo bcrypt senza calibrazione
+    PASSWORD_ARGON2_MEMORY_KIB: int = 19456  # Memoria argon2id per hash (minimo OWASP)
 
     # Database Configuration
     DATABASE_TYPE: str = "azure_sql"  # "postgresql" in dev, "azure_sql" in prod
@@ -32,21 +53,84 @@ class Settings(BaseSettings):
     SQL_SERVER_NAME: Optional[str] = None
     SQL_SERVER_HOSTNAME: Optional[str] = None
 
-    # Rate Limiting - Ottimizzato per F1
-    RATE_LIMIT_PER_MINUTE: int = 20
+    # Rate Limiting - Ottimizzato per F1 (token bucket, capacità = limite al minuto)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_PER_MINUTE: int = 20  # Per utente (sub del JWT)
+    RATE_LIMIT_IP_PER_MINUTE: int = 120  # Per IP: più utenti possono condividere un NAT
+    RATE_LIMIT_LOGIN_PER_MINUTE: int = 10  # Per IP, solo /auth/login
+    RATE_LIMIT_REGISTER_PER_MINUTE: int = 5  # Per IP, solo /auth/register
+    RATE_LIMIT_BACKEND: str = "memory"  # memory (per processo) o redis (condiviso, richiede REDIS_URL)
+    RATE_LIMIT_TRUST_FORWARDED: bool = False  # IP da X-Forwarded-For (dietro il front end di App Service)
 
     # Performance - Ottimizzato per F1
     ITEMS_PER_PAGE: int = 10
     MAX_PAGE_SIZE: int = 50
     DB_POOL_SIZE: int = 5
     DB_MAX_OVERFLOW: int = 10
+    DB_ASYNC_ENABLED: bool = False  # Router su AsyncSession (asyncpg / aioodbc) invece della Session sincrona
+    DB_THREADPOOL_ENABLED: bool = False  # Query sincrone e hash delle password in un pool di 2 × (DB_POOL_SIZE + DB_MAX_OVERFLOW) thread
+
+    # Strumentazione delle query (app/core/query_stats.py)
+    DB_QUERY_STATS_ENABLED: Optional[bool] = None  # Header X-DB-Queries, X-DB-Time e Server-Timing; default: solo in development
+    DB_SLOW_QUERY_MS: float = 200  # Log delle query più lente (SQL normalizzato); 0 disabilita
+    DB_SLOW_QUERY_EXPLAIN: Optional[bool] = None  # Con PostgreSQL aggiunge al log il piano (EXPLAIN) delle SELECT lente; default: solo in development
+    DB_N_PLUS_ONE_THRESHOLD: int = 10  # Statement identici ripetuti in una richiesta segnalati come N+1; 0 disabilita
+
+    # Indice di ricerca in memoria (trigrammi per proprietario)
+    SEARCH_INDEX_ENABLED: bool = True
+    SEARCH_INDEX_MEMORY_MB: int = 64  # Budget LRU condiviso da tutti i proprietari
+    SEARCH_INDEX_MAX_IDS: int = 900  # Oltre questa soglia si torna al LIKE (limite parametri SQL)
+    SEARCH_INDEX_TTL_SECONDS: int = 300  # Ricostruzione periodica: con più worker le scritture altrui non arrivano
+
+    # Autocompletamento (GET /contacts/suggest)
+    SUGGEST_MAX_RESULTS: int = 20
+    SUGGEST_MAX_OWNERS: int = 1000
+    SUGGEST_IDLE_SECONDS: int = 600  # Proprietari inattivi da più tempo vengono scaricati
+
+    # Operazioni massive (POST /contacts/bulk)
+    BULK_MAX_OPERATIONS: int = 5000
+    BULK_CHUNK_SIZE: int = 500  # Righe per executemany / IN (...), sotto il limite di 2100 parametri di SQL Server
+
+    # Export in streaming
+    EXPORT_BATCH_SIZE: int = 1000  # Righe lette dal cursore per ogni blocco
+
+    # Import in background (POST /contacts/import)
+    IMPORT_MAX_MB: int = 100  # Dimensione massima del file caricato
+    IMPORT_BATCH_SIZE: int = 1000  # Record validati e inseriti per transazione
+    IMPORT_SPOOL_MEMORY_MB: int = 4  # Oltre questa soglia il file viene parcheggiato su disco
+    IMPORT_JOB_RETENTION_SECONDS: int = 3600  # Per quanto resta consultabile un job concluso
+
+    # Sincronizzazione incrementale (GET /contacts/changes)
+    SYNC_PAGE_SIZE: int = 500
+    SYNC_MAX_PAGE_SIZE: int = 2000
+    SYNC_CLOCK_SKEW_SECONDS: int = 5  # Finestra rinviata a ogni sync per le transazioni ancora in corso
+    SYNC_TOMBSTONE_RETENTION_DAYS: int = 30  # Token più vecchi richiedono una risincronizzazione completa
+    SYNC_COMPACT_INTERVAL_SECONDS: int = 3600  # Compattazione delle tombstone in background; 0 la disabilita
+
+    # Contatori per proprietario (totale della lista senza COUNT)
+    COUNT_SEARCH_CAP: int = 1000  # Con una ricerca il totale è esatto solo fino a questa soglia
+    COUNTERS_RECONCILE_INTERVAL_SECONDS: int = 3600  # 0 disabilita la riconciliazione periodica
+
+    # Cache delle risposte di lista, dettaglio e ricerca dei contatti
+    RESPONSE_CACHE_BACKEND: str = "memory"  # memory (per processo), redis (condivisa tra worker) o none
+    RESPONSE_CACHE_TTL_SECONDS: int = 30  # Limite alla durata di una risposta non invalidata
+    RESPONSE_CACHE_MAX_ENTRIES: int = 10000
+    REDIS_URL: Optional[str] = None  # es. rediss://:password@nome.redis.cache.windows.net:6380/0
 
     # Azure Settings
     AZURE_APP_SERVICE_NAME: Optional[str] = None
     AZURE_REGION: Optional[str] = None
 
+    # Logging (app/core/logging_config.py)
+    LOG_LEVEL: Optional[str] = None  # Default: DEBUG in development, INFO altrimenti
+    LOG_FORMAT: str = "text"  # text o json (una riga JSON per record, con i campi di extra=)
+    LOG_QUEUE_ENABLED: bool = True  # Formattazione e scrittura nel thread di un QueueListener
+    LOG_SAMPLING: str = ""  # Es. "app.api.v1.contacts=10": un record INFO/DEBUG ogni 10 per logger
+
     # Monitoring
     ALERT_EMAIL: Optional[str] = None
+    METRICS_ENABLED: bool = False  # Raccolta delle metriche e GET /metrics in formato Prometheus
+    METRICS_TOKEN: Optional[str] = None  # Se impostato, /metrics richiede "Authorization: Bearer <token>"
 
     @property
     def DATABASE_URL(self) -> str:
@@ -65,18 +149,22 @@ class Settings(BaseSettings):
                 f"&TrustServerCertificate=yes&encrypt=yes"
             )
 
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        """Stessa connessione di DATABASE_URL con il driver asincrono"""
+        url = self.DATABASE_URL
+        if url.startswith("postgresql://"):
+            return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        return url.replace("mssql+pyodbc://", "mssql+aioodbc://", 1)
+
     @property
     def get_secret_key(self) -> str:
         """
-        Recupera SECRET_KEY da Azure Key Vault in produzione,
-        usa valore locale in development
+        Chiave di firma corrente: da Azure Key Vault in produzione, locale
+        in development. Letta dalla copia in memoria del secret provider.
         """
-        if self.ENVIRONMENT == "production":
-            credential = DefaultAzureCredential()
-            vault_url = os.getenv("AZURE_KEY_VAULT_ENDPOINT")
-            client = SecretClient(vault_url=vault_url, credential=credential)
-            return client.get_secret("jwt-secret-key").value
-        return self.SECRET_KEY
+        from app.core.secret_provider import secret_provider
+        return secret_provider.signing_keys().current_key
 
     @property
     def IS_DEVELOPMENT(self) -> bool:
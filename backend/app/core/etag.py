@@ -0,0 +1,51 @@
+# app/core/etag.py
+import hashlib
+from datetime import datetime
+from typing import Any, Optional
+
+# Header aggiunti alle risposte con ETag: il browser conserva la risposta
+# ma la rivalida sempre (If-None-Match), e la cache è per utente
+CACHE_HEADERS = {
+    "Cache-Control": "private, no-cache",
+    "Vary": "Authorization",
+}
+
+
+def make_etag(*parts: Any) -> str:
+    """ETag forte: hash delle parti che identificano la versione della risorsa"""
+    raw = "|".join(p.isoformat() if isinstance(p, datetime) else str(p) for p in parts)
+    return '"' + hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest() + '"'
+
+
+def contact_etag(contact_id: int, updated_at: Optional[datetime]) -> str:
+    return make_etag("contact", contact_id, updated_at)
+
+
+def list_etag(owner_id: int, max_updated_at: Optional[datetime], count: int, params: str) -> str:
+    """
+    Versione della rubrica di un proprietario: ogni create/update porta
+    avanti max(updated_at), ogni delete cambia il conteggio. `params`
+    distingue pagine e filtri diversi della stessa rubrica.
+    """
+    return make_etag("contacts", owner_id, max_updated_at, count, params)
+
+
+def etag_matches(header: Optional[str], etag: str, weak: bool = True) -> bool:
+    """
+    Confronta un header If-None-Match / If-Match con l'ETag corrente.
+    If-None-Match usa il confronto debole (W/ ignorato), If-Match quello
+    forte (RFC 9110 §13.1).
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,109 @@
+# app/core/executor.py
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """
+    Thread pool dedicato al lavoro bloccante degli handler async (query
+    SQLAlchemy sincrone, hash delle password). Separato dal threadpool di
+    Starlette, così la saturazione del database non ferma le dipendenze
+    sincrone né le altre richieste. Misura coda e tempo di attesa.
+
+    Le sessioni che tengono già una connessione tra un await e l'altro
+    usano una corsia riservata (reserved_workers, uno per connessione del
+    pool): se tutti i thread principali sono fermi nel checkout, la query
+    successiva di chi ha la connessione non resta in coda dietro di loro
+    e la connessione viene restituita (niente deadlock fino al pool_timeout).
+    """
+
+    def __init__(self, max_workers: int, reserved_workers: int = 0, window: int = 1000):
+        self.max_workers = max_workers
+        self.reserved_workers = reserved_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+        self._reserved = ThreadPoolExecutor(
+            max_workers=reserved_workers, thread_name_prefix="blocking-conn"
+        ) if reserved_workers else None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._waits = deque(maxlen=window)  # Attese recenti in ms
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Esegue fn nel pool; il contesto (contextvars) della richiesta viene copiato"""
+        return await self._submit(self._pool, fn, args, kwargs)
+
+    async def run_holding_connection(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Come run, per chi ha già una connessione: non aspetta i thread fermi nel checkout"""
+        return await self._submit(self._reserved or self._pool, fn, args, kwargs)
+
+    async def _submit(self, pool: ThreadPoolExecutor, fn: Callable[..., T], args, kwargs) -> T:
+        context = contextvars.copy_context()
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._waits.append((started - submitted) * 1000)
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(pool, task)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            waits = sorted(self._waits)
+            queued, active = self._queued, self._active
+            max_queued, completed = self._max_queued, self._completed
+        return {
+            "workers": self.max_workers,
+            "reserved_workers": self.reserved_workers,
+            "active": active,
+            "queued": queued,
+            "max_queued": max_queued,
+            "completed": completed,
+            "wait_ms_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_ms_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_ms_max": waits[-1] if waits else 0.0,
+            # Tutti i thread occupati e lavoro in attesa: il pool è il collo di bottiglia
+            "saturated": active >= self.max_workers + self.reserved_workers and queued > 0,
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._reserved is not None:
+            self._reserved.shutdown(wait=False, cancel_futures=True)
+
+
+# Un thread per connessione, più uno riservato per connessione a chi l'ha già ottenuta
+blocking_executor = BlockingExecutor(
+    max_workers=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+    reserved_workers=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+)
+
+
+async def run_blocking(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Lavoro CPU-bound o bloccante: nel pool con DB_THREADPOOL_ENABLED, altrimenti inline"""
+    if settings.DB_THREADPOOL_ENABLED:
+        return await blocking_executor.run(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
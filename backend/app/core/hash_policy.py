@@ -0,0 +1,148 @@
+# app/core/hash_policy.py
+import logging
+import math
+import statistics
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from passlib.hash import argon2, bcrypt
+
+from app.core.config import settings
+from app.core.security import pwd_context
+
+logger = logging.getLogger(__name__)
+
+# Costi minimi (OWASP): la calibrazione non scende mai sotto
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+ARGON2_MIN_TIME_COST = 2
+ARGON2_MAX_TIME_COST = 20
+
+HANDLERS = {"bcrypt": bcrypt, "argon2": argon2}
+
+
+class HashPolicy(NamedTuple):
+    """Schemi accettati (il primo è quello dei nuovi hash) e costi"""
+    schemes: List[str]
+    bcrypt_rounds: int
+    argon2_time_cost: int
+    argon2_memory_kib: int
+
+    def context_options(self) -> Dict[str, object]:
+        """
+        Opzioni di CryptContext. Con deprecated="auto" gli hash degli schemi
+        successivi al primo vanno aggiornati; min_rounds fa lo stesso per
+        gli hash con un costo inferiore a quello calibrato. Niente
+        max_rounds: gli hash più costosi restano validi, altrimenti un host
+        più lento (o calibrato diversamente) li riscriverebbe a ogni login.
+        """
+        options: Dict[str, object] = {"schemes": self.schemes, "deprecated": "auto"}
+        if "bcrypt" in self.schemes:
+            options.update(
+                bcrypt__default_rounds=self.bcrypt_rounds,
+                bcrypt__min_rounds=self.bcrypt_rounds,
+            )
+        if "argon2" in self.schemes:
+            options.update(
+                argon2__default_rounds=self.argon2_time_cost,
+                argon2__min_rounds=self.argon2_time_cost,
+                argon2__memory_cost=self.argon2_memory_kib,
+                argon2__parallelism=1,
+            )
+        return options
+
+
+def available_schemes(names: List[str]) -> List[str]:
+    """Schemi richiesti il cui backend è installato (argon2 richiede argon2-cffi)"""
+    schemes = []
+    for name in names:
+        handler = HANDLERS.get(name)
+        if handler is None:
+            logger.warning(f"Unknown password hash scheme ignored: {name}")
+        elif not handler.has_backend():
+            logger.warning(f"Password hash scheme {name} has no backend installed, skipping it")
+        else:
+            schemes.append(name)
+    if not schemes:
+        raise ValueError("Nessuno schema di hash delle password disponibile")
+    return schemes
+
+
+def time_verify(scheme: str, cost: int, memory_kib: int = 0, repeat: int = 3) -> float:
+    """Mediana in ms di una verifica con lo schema e il costo indicati"""
+    if scheme == "bcrypt":
+        handler = bcrypt.using(rounds=cost)
+    else:
+        handler = argon2.using(rounds=cost, memory_cost=memory_kib, parallelism=1)
+    hashed = handler.hash("calibrazione")
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handler.verify("calibrazione", hashed)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def calibrate_bcrypt(target_ms: float, floor: int = BCRYPT_MIN_ROUNDS) -> int:
+    """
+    bcrypt raddoppia il tempo a ogni round: basta una misura al costo minimo.
+    Il risultato non scende sotto floor (il costo configurato).
+    """
+    base = time_verify("bcrypt", BCRYPT_MIN_ROUNDS)
+    extra = math.floor(math.log2(target_ms / base)) if target_ms > base else 0
+    return max(floor, min(BCRYPT_MAX_ROUNDS, BCRYPT_MIN_ROUNDS + extra))
+
+
+def calibrate_argon2(target_ms: float, memory_kib: int) -> int:
+    """argon2 cresce linearmente con time_cost a memoria fissa"""
+    per_pass = time_verify("argon2", ARGON2_MIN_TIME_COST, memory_kib) / ARGON2_MIN_TIME_COST
+    return max(ARGON2_MIN_TIME_COST, min(ARGON2_MAX_TIME_COST, int(target_ms // per_pass)))
+
+
+def build_policy(target_ms: Optional[float] = None) -> HashPolicy:
+    """
+    Politica dalla configurazione. Con PASSWORD_HASH_TARGET_MS > 0 il costo
+    di ogni schema viene scelto in modo che una verifica su questo host
+    duri al più il tempo obiettivo (mai sotto i minimi né, per bcrypt,
+    sotto PASSWORD_BCRYPT_ROUNDS).
+    """
+    target_ms = settings.PASSWORD_HASH_TARGET_MS if target_ms is None else target_ms
+    schemes = available_schemes([s.strip() for s in settings.PASSWORD_HASH_SCHEMES.split(",") if s.strip()])
+    memory_kib = settings.PASSWORD_ARGON2_MEMORY_KIB
+    bcrypt_rounds, argon2_time_cost = settings.PASSWORD_BCRYPT_ROUNDS, ARGON2_MIN_TIME_COST
+    if target_ms > 0:
+        if "bcrypt" in schemes:
+            bcrypt_rounds = calibrate_bcrypt(target_ms, floor=settings.PASSWORD_BCRYPT_ROUNDS)
+        if "argon2" in schemes:
+            argon2_time_cost = calibrate_argon2(target_ms, memory_kib)
+    return HashPolicy(schemes, bcrypt_rounds, argon2_time_cost, memory_kib)
+
+
+def apply_policy(policy: HashPolicy) -> None:
+    """
+    Aggiorna pwd_context sul posto: chi l'ha importato vede la nuova politica.
+    Usato anche come initializer dei processi del pool di hash.
+    """
+    pwd_context.update(**policy.context_options())
+
+
+_active_policy: Optional[HashPolicy] = None
+
+
+def active_policy() -> Optional[HashPolicy]:
+    return _active_policy
+
+
+def configure_hash_policy() -> HashPolicy:
+    """Calibra e applica la politica una sola volta per processo (avvio dell'app)"""
+    global _active_policy
+    if _active_policy is None:
+        start = time.perf_counter()
+        _active_policy = build_policy()
+        apply_policy(_active_policy)
+        logger.info(
+            f"Password hash policy: schemes={_active_policy.schemes} "
+            f"bcrypt_rounds={_active_policy.bcrypt_rounds} argon2_time_cost={_active_policy.argon2_time_cost} "
+            f"(calibrated in {time.perf_counter() - start:.2f}s)"
+        )
+    return _active_policy
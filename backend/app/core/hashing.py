@@ -0,0 +1,94 @@
+# app/core/hashing.py
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.executor import run_blocking
+from app.core.hash_policy import active_policy, apply_policy
+from app.core.security import get_password_hash, verify_and_update_password, verify_password
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherBusyError(Exception):
+    """Troppe operazioni di hash in corso: la richiesta va rifiutata subito"""
+
+
+class PasswordHasher:
+    """
+    Hash e verifica delle password (bcrypt, CPU-bound) fuori dall'event loop.
+    Con workers > 0 girano in un pool di processi e scalano sui core; con
+    workers = 0 passano da run_blocking. Le operazioni in corso sono limitate
+    a max_pending: oltre la soglia si risponde subito invece di accodare
+    richieste che scadrebbero comunque lato client.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Creato al primo uso, nel processo del worker uvicorn; i processi
+        # ricevono la politica di hash già calibrata invece di ricalibrarla
+        if self._pool is None:
+            policy = active_policy()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=apply_policy if policy else None,
+                initargs=(policy,) if policy else ()
+            )
+        return self._pool
+
+    async def _submit(self, fn: Callable, *args):
+        # Un solo event loop per processo: il contatore non richiede lock
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusyError(f"{self._pending} operazioni di hash già in corso")
+        self._pending += 1
+        try:
+            if not self.workers:
+                return await run_blocking(fn, *args)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+            except BrokenProcessPool:
+                # Un processo è terminato in modo anomalo: il pool va ricreato
+                logger.error("Password hashing process pool broken, recreating it")
+                self._pool = None
+                return await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(verify_password, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._submit(verify_and_update_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(get_password_hash, password)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS if settings.PASSWORD_HASH_WORKERS >= 0 else (os.cpu_count() or 1),
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING
+)
@@ -0,0 +1,199 @@
+# app/core/jwt_codec.py
+import base64
+import hashlib
+import hmac
+import json
+import time
+from calendar import timegm
+from datetime import datetime
+from typing import Dict, List
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from app.core.secret_provider import SigningKeys
+
+HMAC_ALGORITHMS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+ASYMMETRIC_ALGORITHMS = {"EdDSA", "ES256"}
+TIME_CLAIMS = ("exp", "iat", "nbf")
+
+
+def b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def b64decode(segment: bytes) -> bytes:
+    return base64.urlsafe_b64decode(segment + b"=" * (-len(segment) % 4))
+
+
+def _dumps(data: dict) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+class TokenCodec:
+    """
+    Codifica e verifica JWT con chiavi già pronte: header serializzato e
+    chiavi (bytes HMAC, oggetti cryptography) preparati una volta per mazzo
+    di chiavi invece che a ogni chiamata. Le sottoclassi forniscono solo
+    firma, verifica e chiavi pubbliche.
+    """
+
+    def __init__(self, algorithm: str, signing_keys: SigningKeys):
+        self.algorithm = algorithm
+        self.current = signing_keys.current
+        self._headers = {
+            kid: b64encode(_dumps({"alg": algorithm, "typ": "JWT", "kid": kid}))
+            for kid in signing_keys.keys
+        }
+
+    def _sign(self, kid: str, signing_input: bytes) -> bytes:
+        raise NotImplementedError
+
+    def _verify(self, kid: str, signing_input: bytes, signature: bytes) -> bool:
+        raise NotImplementedError
+
+    def public_jwks(self) -> List[dict]:
+        return []
+
+    def encode(self, claims: dict) -> str:
+        payload = {
+            k: timegm(v.utctimetuple()) if k in TIME_CLAIMS and isinstance(v, datetime) else v
+            for k, v in claims.items()
+        }
+        signing_input = self._headers[self.current] + b"." + b64encode(_dumps(payload))
+        return (signing_input + b"." + b64encode(self._sign(self.current, signing_input))).decode("ascii")
+
+    def decode(self, token: str, verify_exp: bool = True) -> dict:
+        """Claim verificate; solleva JWTError (ExpiredSignatureError se scaduto)"""
+        try:
+            raw = token.encode("ascii")
+            signing_input, _, signature = raw.rpartition(b".")
+            header_segment, _, payload_segment = signing_input.partition(b".")
+            header = json.loads(b64decode(header_segment))
+            kid = header.get("kid", self.current)
+            # Algoritmo fissato dalla configurazione, mai quello dichiarato dal token
+            if header.get("alg") != self.algorithm or kid not in self._headers:
+                raise JWTError(f"Unknown signing key or algorithm: {kid}, {header.get('alg')}")
+            if not self._verify(kid, signing_input, b64decode(signature)):
+                raise JWTError("Signature verification failed")
+            claims = json.loads(b64decode(payload_segment))
+        except (ValueError, TypeError, AttributeError, UnicodeError) as e:
+            raise JWTError(f"Malformed token: {str(e)}")
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload")
+        if verify_exp and "exp" in claims:
+            if claims["exp"] <= time.time():
+                raise ExpiredSignatureError("Signature has expired")
+        return claims
+
+    def jwks(self) -> Dict[str, List[dict]]:
+        """JWK Set delle chiavi pubbliche (vuoto per HMAC: il segreto non si pubblica)"""
+        return {"keys": self.public_jwks()}
+
+
+class HMACCodec(TokenCodec):
+    """HS256/384/512 con hmac della libreria standard"""
+
+    def __init__(self, algorithm: str, signing_keys: SigningKeys):
+        super().__init__(algorithm, signing_keys)
+        self._digest = HMAC_ALGORITHMS[algorithm]
+        self._keys = {kid: key.encode("utf-8") for kid, key in signing_keys.keys.items()}
+
+    def _sign(self, kid: str, signing_input: bytes) -> bytes:
+        return hmac.new(self._keys[kid], signing_input, self._digest).digest()
+
+    def _verify(self, kid: str, signing_input: bytes, signature: bytes) -> bool:
+        return hmac.compare_digest(self._sign(kid, signing_input), signature)
+
+
+class AsymmetricCodec(TokenCodec):
+    """
+    EdDSA (Ed25519) ed ES256 (P-256): nel mazzo di chiavi ci sono le chiavi
+    private in PEM; altri servizi verificano con le pubbliche dal JWKS.
+    """
+
+    def __init__(self, algorithm: str, signing_keys: SigningKeys):
+        super().__init__(algorithm, signing_keys)
+        self._private = {
+            kid: serialization.load_pem_private_key(pem.encode("utf-8"), password=None)
+            for kid, pem in signing_keys.keys.items()
+        }
+        expected = ed25519.Ed25519PrivateKey if algorithm == "EdDSA" else ec.EllipticCurvePrivateKey
+        for kid, key in self._private.items():
+            if not isinstance(key, expected) or (algorithm == "ES256" and key.curve.name != "secp256r1"):
+                raise ValueError(f"La chiave {kid} non è adatta a {algorithm}")
+        self._public = {kid: key.public_key() for kid, key in self._private.items()}
+
+    def _sign(self, kid: str, signing_input: bytes) -> bytes:
+        key = self._private[kid]
+        if self.algorithm == "EdDSA":
+            return key.sign(signing_input)
+        # JWS usa r || s a 32 byte, cryptography la codifica DER
+        r, s = decode_dss_signature(key.sign(signing_input, ec.ECDSA(hashes.SHA256())))
+        return r.to_bytes(32, "big") + s.to_bytes(32, "big")
+
+    def _verify(self, kid: str, signing_input: bytes, signature: bytes) -> bool:
+        key = self._public[kid]
+        try:
+            if self.algorithm == "EdDSA":
+                key.verify(signature, signing_input)
+            else:
+                if len(signature) != 64:
+                    return False
+                der = encode_dss_signature(int.from_bytes(signature[:32], "big"), int.from_bytes(signature[32:], "big"))
+                key.verify(der, signing_input, ec.ECDSA(hashes.SHA256()))
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_jwks(self) -> List[dict]:
+        keys = []
+        for kid, key in self._public.items():
+            if self.algorithm == "EdDSA":
+                x = key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+                jwk = {"kty": "OKP", "crv": "Ed25519", "x": b64encode(x).decode("ascii")}
+            else:
+                numbers = key.public_numbers()
+                jwk = {
+                    "kty": "EC",
+                    "crv": "P-256",
+                    "x": b64encode(numbers.x.to_bytes(32, "big")).decode("ascii"),
+                    "y": b64encode(numbers.y.to_bytes(32, "big")).decode("ascii"),
+                }
+            keys.append({**jwk, "kid": kid, "alg": self.algorithm, "use": "sig"})
+        return keys
+
+
+class JoseCodec(TokenCodec):
+    """python-jose come prima dell'introduzione dei codec (solo HMAC): riferimento per i benchmark"""
+
+    def __init__(self, algorithm: str, signing_keys: SigningKeys):
+        if algorithm not in HMAC_ALGORITHMS:
+            raise ValueError(f"python-jose non supporta {algorithm}")
+        super().__init__(algorithm, signing_keys)
+        self._keys = signing_keys.keys
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self._keys[self.current], algorithm=self.algorithm,
+                          headers={"kid": self.current})
+
+    def decode(self, token: str, verify_exp: bool = True) -> dict:
+        key = self._keys.get(jwt.get_unverified_header(token).get("kid", self.current))
+        if key is None:
+            raise JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=[self.algorithm], options={"verify_exp": verify_exp})
+
+
+def create_codec(backend: str, algorithm: str, signing_keys: SigningKeys) -> TokenCodec:
+    """Codec per JWT_BACKEND (native o jose) e ALGORITHM"""
+    if backend == "jose":
+        return JoseCodec(algorithm, signing_keys)
+    if algorithm in HMAC_ALGORITHMS:
+        return HMACCodec(algorithm, signing_keys)
+    if algorithm in ASYMMETRIC_ALGORITHMS:
+        return AsymmetricCodec(algorithm, signing_keys)
+    raise ValueError(f"Algoritmo JWT non supportato: {algorithm}")
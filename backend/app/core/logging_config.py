@@ -0,0 +1,117 @@
+# app/core/logging_config.py
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributi standard di LogRecord: tutto il resto arriva da extra= ed è un campo strutturato
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record, con i campi passati in extra= (es. extra={"owner_id": 1})"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Tiene un record ogni `every` per un logger ad alto volume. Warning ed
+    errori passano sempre. Il contatore è un itertools.count: niente lock.
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or next(self._counter) % self.every == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare formatta il record sul thread chiamante: qui si
+    congela solo il messaggio (gli argomenti potrebbero cambiare), la
+    formattazione e la scrittura restano al thread del QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_sampling(spec: str) -> Dict[str, int]:
+    """LOG_SAMPLING: "logger=N,logger=N" (un record ogni N sotto WARNING)"""
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, every = item.partition("=")
+        rules[name.strip()] = int(every)
+    return rules
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configured = False
+
+
+def configure_logging() -> None:
+    """
+    Handler del root logger: una coda in memoria verso un QueueListener che
+    formatta (testo o JSON, LOG_FORMAT) e scrive su stdout dal suo thread.
+    Le richieste pagano solo la creazione del record e un put sulla coda.
+    """
+    global _listener, _configured
+    if _configured:
+        return
+    _configured = True
+    level = logging.DEBUG if settings.IS_DEVELOPMENT else logging.INFO
+    if settings.LOG_LEVEL:
+        level = logging.getLevelName(settings.LOG_LEVEL.upper())
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if settings.LOG_QUEUE_ENABLED:
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        root.handlers = [DeferredQueueHandler(log_queue)]
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        # I record ancora in coda vengono scritti all'uscita del processo
+        atexit.register(shutdown_logging)
+    else:
+        root.handlers = [stream]
+
+    for name, every in parse_sampling(settings.LOG_SAMPLING).items():
+        logging.getLogger(name).addFilter(SamplingFilter(every))
+
+
+def shutdown_logging() -> None:
+    """Ferma il QueueListener dopo aver scritto i record in coda"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
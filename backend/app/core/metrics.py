@@ -0,0 +1,198 @@
+# app/core/metrics.py
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+# Secondi: dalle risposte in cache (<5 ms) agli export e agli hash più lenti
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricFamily(NamedTuple):
+    """Metrica letta al momento dello scrape (gauge e contatori tenuti da altri componenti)"""
+    name: str
+    type: str  # gauge o counter
+    help: str
+    samples: List[Tuple[Dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    """
+    Serie per thread: ogni thread scrive solo nella propria shard, quindi
+    l'incremento non prende lock né si contende la cache line con gli
+    altri. Il lock serve solo a registrare la shard di un thread nuovo
+    (una volta per thread) e allo scrape, che somma le shard.
+
+    Le shard sono indicizzate per ident del thread: allo scrape quelle dei
+    thread terminati (anyio e l'executor ritirano i worker inattivi) vengono
+    sommate in _retired e rimosse, così il loro numero resta quello dei
+    thread vivi senza perdere le osservazioni.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: Dict[int, Dict[tuple, list]] = {}
+        self._retired: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[tuple, list]:
+        shard = getattr(self._local, "series", None)
+        if shard is None:
+            shard = self._local.series = {}
+            # current_thread() registra anche i thread non creati da threading
+            ident = threading.current_thread().ident
+            with self._lock:
+                # Ident riusato da un thread terminato e non ancora potato
+                stale = self._shards.pop(ident, None)
+                if stale is not None:
+                    self._fold(self._retired, stale)
+                self._shards[ident] = shard
+        return shard
+
+    @staticmethod
+    def _fold(into: Dict[tuple, list], shard: Dict[tuple, list]) -> None:
+        # Copia della shard: il thread proprietario può aggiungere serie intanto
+        for key, values in list(shard.items()):
+            total = into.get(key)
+            if total is None:
+                into[key] = list(values)
+                continue
+            for i, value in enumerate(values):
+                total[i] += value
+
+    def _prune(self) -> None:
+        """Da chiamare con il lock: sposta in _retired le shard dei thread terminati"""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._shards if ident not in alive]:
+            self._fold(self._retired, self._shards.pop(ident))
+
+    def shard_count(self) -> int:
+        with self._lock:
+            self._prune()
+            return len(self._shards)
+
+    def _merged(self, width: int) -> Dict[tuple, list]:
+        with self._lock:
+            self._prune()
+            shards = list(self._shards.values())
+            merged = {key: list(values) for key, values in self._retired.items()}
+        for shard in shards:
+            self._fold(merged, shard)
+        return merged
+
+    def clear(self) -> None:
+        with self._lock:
+            for shard in self._shards.values():
+                shard.clear()
+            self._retired.clear()
+
+
+class Histogram(_Sharded):
+    """
+    Istogramma Prometheus: per serie i conteggi dei bucket (non cumulativi,
+    resi cumulativi allo scrape), la somma e il numero di osservazioni.
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._width = len(self.buckets) + 3  # bucket, +Inf, somma, conteggio
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0] * self._width
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        return self._merged(self._width).get(labels, [0] * self._width)[-1]
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, values in sorted(self._merged(self._width).items()):
+            cumulative = 0
+            for bound, hits in zip(bounds, values):
+                cumulative += hits
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {values[-1]}"
+
+
+class MetricsRegistry:
+    """
+    Metriche dell'applicazione in formato di esposizione testuale
+    Prometheus (0.0.4). Gli istogrammi sono aggiornati dalle richieste;
+    i collector sono funzioni chiamate solo allo scrape per
+    leggere lo stato degli altri componenti (pool, cache, executor).
+    """
+
+    def __init__(self, prefix: str = "rubrica"):
+        self.prefix = prefix
+        self._metrics: List[_Sharded] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[MetricFamily]]) -> Callable[[], Iterable[MetricFamily]]:
+        """Registra un collector (utilizzabile come decoratore)"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for family in collect():
+                name = f"{self.prefix}_{family.name}"
+                lines.append(f"# HELP {name} {family.help}")
+                lines.append(f"# TYPE {name} {family.type}")
+                for labels, value in family.samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        for metric in self._metrics:
+            metric.clear()
+
+
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Durata delle richieste HTTP per metodo, template della route e stato (il _count è il numero di richieste)",
+    ("method", "route", "status")
+)
+db_pool_wait = metrics.histogram(
+    "db_pool_wait_seconds",
+    "Attesa per ottenere una connessione dal pool (inclusa l'apertura delle connessioni di overflow)",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
@@ -0,0 +1,102 @@
+# app/core/pagination.py
+import base64
+import json
+from typing import Any, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+
+# Direzioni supportate dal cursore
+CURSOR_NEXT = "next"
+CURSOR_PREV = "prev"
+
+
+class InvalidCursorError(ValueError):
+    """Sollevata quando il cursore ricevuto dal client non è decodificabile"""
+
+
+def encode_cursor(values: Sequence[Any], direction: str = CURSOR_NEXT) -> str:
+    """
+    Codifica la chiave di ordinamento dell'ultimo elemento in un cursore opaco.
+    Il client non deve interpretarlo: è solo base64url di un piccolo JSON.
+    """
+    payload = json.dumps({"k": list(values), "d": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _matches(value: Any, expected: type) -> bool:
+    # bool è una sottoclasse di int, ma true non è un id
+    return isinstance(value, expected) and not (isinstance(value, bool) and expected is not bool)
+
+
+def decode_cursor(cursor: str, key_types: Sequence[type]) -> Tuple[Tuple[Any, ...], str]:
+    """
+    Decodifica un cursore prodotto da encode_cursor. La chiave deve avere
+    un valore del tipo atteso per ogni colonna: un cursore manomesso non
+    deve arrivare al confronto SQL.
+    :return: (valori della chiave, direzione)
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        keys = payload["k"]
+        direction = payload.get("d", CURSOR_NEXT)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise InvalidCursorError(f"Cursore non valido: {str(e)}")
+
+    if (
+        not isinstance(keys, list)
+        or len(keys) != len(key_types)
+        or not all(_matches(value, expected) for value, expected in zip(keys, key_types))
+        or direction not in (CURSOR_NEXT, CURSOR_PREV)
+    ):
+        raise InvalidCursorError("Cursore non valido")
+    return tuple(keys), direction
+
+
+def _keyset_predicate(columns: Sequence[Any], values: Sequence[Any], direction: str):
+    column, value = columns[0], values[0]
+    strict = column > value if direction == CURSOR_NEXT else column < value
+    if len(columns) == 1:
+        return strict
+    return or_(strict, and_(column == value, _keyset_predicate(columns[1:], values[1:], direction)))
+
+
+def keyset_filter(columns: Sequence[Any], values: Sequence[Any], direction: str = CURSOR_NEXT):
+    """
+    Costruisce il predicato di seek (c1, c2, ..., cn) > (v1, v2, ..., vn)
+    espanso in OR/AND annidati: SQL Server non supporta il confronto
+    tra row value, quindi non usiamo tuple_().
+    Il vincolo ridondante c1 >= v1 in testa permette all'ottimizzatore
+    di fare un range seek sull'indice invece di valutare l'OR riga per riga.
+    """
+    column, value = columns[0], values[0]
+    bound = column >= value if direction == CURSOR_NEXT else column <= value
+    return and_(bound, _keyset_predicate(columns, values, direction))
+
+
+def cursor_pages(
+    rows: list,
+    size: int,
+    key_of,
+    direction: str,
+    has_cursor: bool
+) -> Tuple[list, Optional[str], Optional[str]]:
+    """
+    Riduce a `size` elementi una pagina letta con limit(size + 1)
+    e calcola i cursori verso la pagina successiva e precedente.
+    Le pagine lette all'indietro arrivano in ordine inverso e vengono raddrizzate.
+    """
+    has_more = len(rows) > size
+    rows = rows[:size]
+
+    if direction == CURSOR_PREV:
+        rows.reverse()
+        has_next = has_cursor
+        has_prev = has_more
+    else:
+        has_next = has_more
+        has_prev = has_cursor
+
+    next_cursor = encode_cursor(key_of(rows[-1]), CURSOR_NEXT) if rows and has_next else None
+    prev_cursor = encode_cursor(key_of(rows[0]), CURSOR_PREV) if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,141 @@
+# app/core/query_stats.py
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\([^)]*\)s|%s|\$\d+|(?<!:):\w+|\?")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """SQL senza valori: letterali e segnaposto diventano ?, le liste IN (?, ?, ...) un solo (?...)"""
+    sql = _STRING.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _development_default(flag: Optional[bool]) -> bool:
+    # Header e SAVEPOINT/EXPLAIN in più: di default solo in development, come X-Process-Time
+    return settings.IS_DEVELOPMENT if flag is None else flag
+
+
+def query_stats_enabled() -> bool:
+    return _development_default(settings.DB_QUERY_STATS_ENABLED)
+
+
+class QueryStats:
+    """
+    Statement eseguiti durante una richiesta: numero, tempo totale e
+    ripetizioni per testo SQL. Gli statement di una richiesta girano uno
+    alla volta (event loop o un thread del pool), quindi niente lock.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.statements: Dict[str, int] = {}
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.total_seconds += elapsed
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statement identici eseguiti almeno threshold volte: tipico N+1 (una query per riga)"""
+        return [(sql, n) for sql, n in self.statements.items() if n >= threshold]
+
+    def headers(self) -> Dict[str, str]:
+        total_ms = self.total_seconds * 1000
+        return {
+            "X-DB-Queries": str(self.count),
+            "X-DB-Time": f"{total_ms:.2f}",
+            "Server-Timing": f'db;dur={total_ms:.2f};desc="{self.count} queries"',
+        }
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def begin_request() -> QueryStats:
+    """
+    Nuove statistiche per la richiesta corrente. Il contextvar arriva ai
+    thread del pool bloccante e del threadpool (che copiano il contesto) e
+    l'oggetto è condiviso, quindi gli statement eseguiti lì vengono contati.
+    """
+    stats = QueryStats()
+    _current.set(stats)
+    return stats
+
+
+def report_repeated(stats: QueryStats, method: str, path: str) -> None:
+    threshold = settings.DB_N_PLUS_ONE_THRESHOLD
+    if threshold <= 0:
+        return
+    for statement, count in stats.repeated(threshold):
+        logger.warning("Possible N+1 on %s %s: %d identical statements: %s",
+                       method, path, count, normalize_sql(statement))
+
+
+def _explain(conn, statement: str, parameters) -> Optional[str]:
+    """
+    Piano della query lenta (solo PostgreSQL con psycopg2, solo SELECT).
+    EXPLAIN senza ANALYZE non riesegue la query; il savepoint evita che un
+    errore dell'EXPLAIN annulli la transazione della richiesta.
+    """
+    if conn.dialect.name != "postgresql" or conn.dialect.driver != "psycopg2":
+        return None
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT query_stats_explain")
+        try:
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.execute("RELEASE SAVEPOINT query_stats_explain")
+            return plan
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+            logger.debug("EXPLAIN failed: %s", e)
+            return None
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if query_stats_enabled():
+        conn.info["query_stats_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_stats_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if settings.DB_SLOW_QUERY_MS > 0 and elapsed * 1000 >= settings.DB_SLOW_QUERY_MS:
+        explain = not executemany and _development_default(settings.DB_SLOW_QUERY_EXPLAIN)
+        plan = _explain(conn, statement, parameters) if explain else None
+        logger.warning(
+            "Slow query (%.1f ms): %s%s", elapsed * 1000, normalize_sql(statement),
+            f"\n{plan}" if plan else "",
+            extra={"db_time_ms": round(elapsed * 1000, 2)}
+        )
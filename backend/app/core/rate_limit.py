@@ -0,0 +1,286 @@
+# app/core/rate_limit.py
+import hashlib
+import json
+import logging
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from jose import JWTError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.security import verify_token
+from app.services.response_cache import RedisCacheBackend, RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class BucketState(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # Secondi prima del prossimo token (0 se consentita)
+    reset: float  # Secondi prima che il secchio torni pieno
+
+
+class MemoryBucketBackend:
+    """
+    Token bucket in memoria, per processo. Un secchio assente equivale a
+    uno pieno: quelli rimasti inattivi abbastanza da riempirsi vengono
+    rimossi una volta al minuto, così la memoria segue i client attivi.
+    """
+
+    blocking = False
+
+    def __init__(self, sweep_interval: float = 60.0):
+        self._buckets: Dict[str, List[float]] = {}  # chiave -> [token, ultimo aggiornamento, secondi per riempirsi]
+        self._sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    def consume(self, key: str, capacity: int, rate: float) -> BucketState:
+        # Gira solo sull'event loop: nessuna attesa tra lettura e scrittura, niente lock
+        now = time.monotonic()
+        if now - self._last_sweep > self._sweep_interval:
+            self._sweep(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(capacity)
+            bucket = self._buckets[key] = [tokens, now, capacity / rate]
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        bucket[0], bucket[1] = tokens, now
+        return BucketState(
+            allowed,
+            int(tokens),
+            0.0 if allowed else (1 - tokens) / rate,
+            (capacity - tokens) / rate
+        )
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        for key in [k for k, (_, last, refill) in self._buckets.items() if now - last >= refill]:
+            del self._buckets[key]
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+# Token bucket atomico lato Redis: stato in un hash con scadenza pari al tempo di riempimento
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = capacity
+else
+  tokens = math.min(capacity, tokens + (now - tonumber(state[2])) * rate)
+end
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketBackend:
+    """
+    Secchi condivisi tra worker e istanze su Redis (stesso client RESP
+    della cache delle risposte). Se Redis non risponde la richiesta passa:
+    il limitatore protegge il servizio, non deve diventarne un guasto.
+    Il client fa I/O bloccante: il middleware lo chiama dal threadpool.
+    """
+
+    blocking = True
+
+    def __init__(self, client: RedisCacheBackend, prefix: str = "rubrica:rl"):
+        self.client = client
+        self.prefix = prefix
+        self._sha = hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode("utf-8")).hexdigest()
+
+    def consume(self, key: str, capacity: int, rate: float) -> BucketState:
+        args = (1, f"{self.prefix}:{key}", capacity, rate)
+        try:
+            try:
+                allowed, tokens = self.client.command("EVALSHA", self._sha, *args)
+            except RedisError as e:
+                if not str(e).startswith("NOSCRIPT"):
+                    raise
+                allowed, tokens = self.client.command("EVAL", TOKEN_BUCKET_SCRIPT, *args)
+        except Exception as e:
+            logger.error(f"Rate limit backend error, allowing request: {str(e)}")
+            return BucketState(True, capacity, 0.0, 0.0)
+        tokens = float(tokens)
+        return BucketState(
+            bool(allowed),
+            int(tokens),
+            0.0 if allowed else (1 - tokens) / rate,
+            (capacity - tokens) / rate
+        )
+
+    def clear(self) -> None:
+        self.client.clear(f"{self.prefix}:")
+
+
+class RateLimiter:
+    """
+    Regole del limitatore:
+    - login e register: un budget per IP ciascuno, separato dal resto
+    - altre richieste: un budget per IP e, con un JWT valido, uno per utente
+    Ogni secchio ha capacità pari al limite al minuto e si riempie in un minuto.
+    """
+
+    def __init__(self, backend, user_per_minute: int, ip_per_minute: int,
+                 login_per_minute: int, register_per_minute: int, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.rejected = 0
+        prefix = settings.API_V1_STR
+        self.auth_rules = {
+            f"{prefix}/auth/login": ("login", login_per_minute),
+            f"{prefix}/auth/register": ("register", register_per_minute),
+        }
+        self.user_per_minute = user_per_minute
+        self.ip_per_minute = ip_per_minute
+
+    def check(self, path: str, client_ip: str, subject: Optional[str]) -> Tuple[BucketState, int]:
+        """Consuma un token da ogni secchio della richiesta; restituisce il più restrittivo e il suo limite"""
+        rule = self.auth_rules.get(path)
+        if rule is not None:
+            checks = [(f"{rule[0]}:{client_ip}", rule[1])]
+        else:
+            checks = [(f"ip:{client_ip}", self.ip_per_minute)]
+            if subject is not None:
+                checks.append((f"user:{subject}", self.user_per_minute))
+
+        result, result_limit = None, 0
+        for key, limit in checks:
+            state = self.backend.consume(key, limit, limit / 60)
+            if result is None or (not state.allowed, -state.remaining) > (not result.allowed, -result.remaining):
+                result, result_limit = state, limit
+        if not result.allowed:
+            self.rejected += 1
+        return result, result_limit
+
+    async def check_async(self, path: str, client_ip: str, subject: Optional[str]) -> Tuple[BucketState, int]:
+        """check dall'event loop: i backend di rete girano nel threadpool, quello in memoria resta sul loop"""
+        if self.backend.blocking:
+            return await run_in_threadpool(self.check, path, client_ip, subject)
+        return self.check(path, client_ip, subject)
+
+    def reset(self) -> None:
+        self.backend.clear()
+
+
+def token_subject(authorization: bytes) -> Optional[str]:
+    """
+    `sub` di un JWT valido, dalla stessa verifica (e dallo stesso cache)
+    della dipendenza di autenticazione: un token contraffatto non consuma
+    il budget di un altro utente.
+    """
+    if not authorization.lower().startswith(b"bearer "):
+        return None
+    try:
+        return str(verify_token(authorization[7:].strip().decode("ascii"))["sub"])
+    except (JWTError, UnicodeError):
+        return None
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI puro (niente BaseHTTPMiddleware: nessun task né buffer
+    per richiesta). Aggiunge X-RateLimit-Limit/Remaining/Reset alle
+    risposte e risponde 429 con Retry-After quando un secchio è vuoto.
+    """
+
+    EXEMPT_PATHS = {"/", "/health", "/.well-known/jwks.json", "/metrics"}
+
+    def __init__(self, app, limiter: RateLimiter, trust_forwarded: bool = False):
+        self.app = app
+        self.limiter = limiter
+        self.trust_forwarded = trust_forwarded
+
+    def _client_ip(self, scope, forwarded: Optional[bytes]) -> str:
+        if forwarded and self.trust_forwarded:
+            # Il proxy fidato (front end di App Service) aggiunge in coda l'indirizzo del client
+            return forwarded.rsplit(b",", 1)[-1].strip().decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.limiter.enabled
+                or scope["method"] == "OPTIONS" or scope["path"] in self.EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        authorization = forwarded = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value
+            elif name == b"x-forwarded-for":
+                forwarded = value
+
+        state, limit = await self.limiter.check_async(
+            scope["path"],
+            self._client_ip(scope, forwarded),
+            token_subject(authorization) if authorization else None
+        )
+        headers = [
+            (b"x-ratelimit-limit", str(limit).encode()),
+            (b"x-ratelimit-remaining", str(state.remaining).encode()),
+            (b"x-ratelimit-reset", str(math.ceil(state.reset)).encode()),
+        ]
+
+        if not state.allowed:
+            retry_after = max(1, math.ceil(state.retry_after))
+            body = json.dumps(
+                {"detail": f"Troppe richieste, riprova tra {retry_after} secondi"}
+            ).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"retry-after", str(retry_after).encode()),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+def create_rate_limiter() -> RateLimiter:
+    """Backend scelto da RATE_LIMIT_BACKEND: memory (per processo) o redis (condiviso)"""
+    if settings.RATE_LIMIT_BACKEND.lower() == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("RATE_LIMIT_BACKEND=redis richiede REDIS_URL")
+        backend = RedisBucketBackend(RedisCacheBackend(settings.REDIS_URL))
+    else:
+        backend = MemoryBucketBackend()
+    return RateLimiter(
+        backend,
+        user_per_minute=settings.RATE_LIMIT_PER_MINUTE,
+        ip_per_minute=settings.RATE_LIMIT_IP_PER_MINUTE,
+        login_per_minute=settings.RATE_LIMIT_LOGIN_PER_MINUTE,
+        register_per_minute=settings.RATE_LIMIT_REGISTER_PER_MINUTE,
+        enabled=settings.RATE_LIMIT_ENABLED
+    )
+
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,193 @@
+# app/core/secret_provider.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Segreto singolo storico e mazzo di chiavi per la rotazione
+JWT_SECRET_NAME = "jwt-secret-key"
+JWT_KEYRING_NAME = "jwt-signing-keys"
+
+
+class SigningKeys(NamedTuple):
+    """
+    Chiavi di firma attive: i nuovi token usano `current`, la verifica
+    accetta ogni `kid` presente. Per una rotazione senza interruzioni si
+    aggiunge la nuova chiave, la si rende corrente e si rimuove la vecchia
+    solo dopo ACCESS_TOKEN_EXPIRE_MINUTES.
+    """
+    current: str
+    keys: Dict[str, str]
+
+    @property
+    def current_key(self) -> str:
+        return self.keys[self.current]
+
+    def get(self, kid: Optional[str]) -> Optional[str]:
+        # Token emessi prima dell'introduzione del kid: chiave corrente
+        return self.keys.get(kid) if kid is not None else self.current_key
+
+
+def derive_kid(key: str) -> str:
+    """kid stabile per una chiave senza nome (jwt-secret-key o SECRET_KEY)"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+def parse_signing_keys(keyring: Optional[str], secret: Optional[str]) -> SigningKeys:
+    """
+    jwt-signing-keys è un JSON {"current": "<kid>", "keys": {"<kid>": "<chiave>"}};
+    in sua assenza si usa la sola jwt-secret-key.
+    """
+    if keyring:
+        data = json.loads(keyring)
+        keys = {str(kid): str(key) for kid, key in data["keys"].items()}
+        if data["current"] not in keys:
+            raise ValueError(f"Chiave corrente {data['current']} assente da {JWT_KEYRING_NAME}")
+        return SigningKeys(data["current"], keys)
+    if not secret:
+        raise ValueError(f"Né {JWT_KEYRING_NAME} né {JWT_SECRET_NAME} sono configurati")
+    kid = derive_kid(secret)
+    return SigningKeys(kid, {kid: secret})
+
+
+class EnvSecretBackend:
+    """
+    Segreti locali (development e test): prima il file JSON SECRETS_FILE,
+    poi le variabili d'ambiente con il nome in maiuscolo (jwt-secret-key ->
+    JWT_SECRET_KEY). jwt-secret-key ricade infine su SECRET_KEY.
+    """
+
+    name = "env"
+
+    def __init__(self, secrets_file: Optional[str] = None):
+        self.secrets_file = secrets_file
+
+    def fetch(self, name: str) -> Optional[str]:
+        if self.secrets_file and os.path.exists(self.secrets_file):
+            with open(self.secrets_file, encoding="utf-8") as f:
+                value = json.load(f).get(name)
+            if value is not None:
+                return value if isinstance(value, str) else json.dumps(value)
+        value = os.getenv(name.upper().replace("-", "_"))
+        if value is None and name == JWT_SECRET_NAME:
+            return settings.SECRET_KEY
+        return value
+
+
+class KeyVaultSecretBackend:
+    """Azure Key Vault: credenziale e client creati una volta sola"""
+
+    name = "keyvault"
+
+    def __init__(self, vault_url: str):
+        from azure.core.exceptions import ResourceNotFoundError
+        from azure.identity import DefaultAzureCredential
+        from azure.keyvault.secrets import SecretClient
+
+        self._not_found = ResourceNotFoundError
+        self._client = SecretClient(vault_url=vault_url, credential=DefaultAzureCredential())
+
+    def fetch(self, name: str) -> Optional[str]:
+        try:
+            return self._client.get_secret(name).value
+        except self._not_found:
+            return None
+
+
+class SecretProvider:
+    """
+    Segreti letti una volta all'avvio e ricaricati da un task di background
+    ogni `ttl` secondi. get() legge solo la copia in memoria: nessun accesso
+    di rete sul percorso delle richieste. Se un aggiornamento fallisce
+    restano in uso i valori precedenti.
+    """
+
+    def __init__(self, backend, names: List[str], ttl: int):
+        self.backend = backend
+        self.names = names
+        self.ttl = ttl
+        self.loaded_at: Optional[float] = None
+        self.refresh_errors = 0
+        self._values: Dict[str, Optional[str]] = {}
+        self._signing_keys: Optional[SigningKeys] = None
+        self._listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Legge tutti i segreti dal backend (bloccante: avvio o threadpool)"""
+        values = {name: self.backend.fetch(name) for name in self.names}
+        signing_keys = parse_signing_keys(values.get(JWT_KEYRING_NAME), values.get(JWT_SECRET_NAME))
+        with self._lock:
+            changed = self._signing_keys is not None and signing_keys != self._signing_keys
+            self._values = values
+            self._signing_keys = signing_keys
+            self.loaded_at = time.time()
+        logger.info(
+            f"Secrets loaded from {self.backend.name} backend: "
+            f"signing keys {sorted(signing_keys.keys)}, current {signing_keys.current}"
+        )
+        if changed:
+            for listener in self._listeners:
+                listener()
+
+    def _ensure_loaded(self) -> None:
+        # Fuori dall'applicazione (script, test) il caricamento avviene al primo uso
+        if self.loaded_at is None:
+            self.load()
+
+    def get(self, name: str) -> Optional[str]:
+        self._ensure_loaded()
+        return self._values.get(name)
+
+    def signing_keys(self) -> SigningKeys:
+        self._ensure_loaded()
+        return self._signing_keys
+
+    def on_signing_keys_change(self, listener: Callable[[], None]) -> None:
+        """Richiamato dopo un aggiornamento che cambia le chiavi di firma"""
+        self._listeners.append(listener)
+
+    async def refresh_periodically(self) -> None:
+        """Task di background avviato con l'applicazione"""
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await run_in_threadpool(self.load)
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.error(f"Error refreshing secrets, keeping cached values: {str(e)}", exc_info=True)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.backend.name,
+            "age_seconds": round(time.time() - self.loaded_at) if self.loaded_at else None,
+            "signing_keys": len(self._signing_keys.keys) if self._signing_keys else 0,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+def create_secret_provider() -> SecretProvider:
+    """Backend scelto da SECRETS_BACKEND: auto (Key Vault in produzione), keyvault o env"""
+    backend_name = settings.SECRETS_BACKEND.lower()
+    if backend_name == "auto":
+        backend_name = "keyvault" if settings.IS_PRODUCTION else "env"
+    if backend_name == "keyvault":
+        if not settings.AZURE_KEY_VAULT_ENDPOINT:
+            raise ValueError("SECRETS_BACKEND=keyvault richiede AZURE_KEY_VAULT_ENDPOINT")
+        backend = KeyVaultSecretBackend(settings.AZURE_KEY_VAULT_ENDPOINT)
+    else:
+        backend = EnvSecretBackend(settings.SECRETS_FILE)
+    return SecretProvider(backend, [JWT_SECRET_NAME, JWT_KEYRING_NAME], ttl=settings.SECRETS_REFRESH_SECONDS)
+
+
+secret_provider = create_secret_provider()
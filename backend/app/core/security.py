@@ -1,21 +1,27 @@
 # In app/core/security.py
 
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Union, Dict
-from jose import JWTError, jwt
+from typing import Optional, Union, Dict, Tuple
+from collections import OrderedDict
+from jose import JWTError
 from passlib.context import CryptContext
-from fastapi import Security, HTTPException, status, Request
+from fastapi import Depends, Security, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.core.config import settings
-from app.models.base import get_db
-from sqlalchemy.orm import Session
+from app.core.jwt_codec import TokenCodec, create_codec
+from app.core.secret_provider import SigningKeys, secret_provider
+from app.services.principals import Principal, principal_cache
+from app.services.revocation import revocation_list
+import hashlib
 import logging
-import json
+import threading
+import time
+import uuid
 
 # Configurazione logging
 logger = logging.getLogger(__name__)
 
-# Password hashing
+# Password hashing: schemi e costi vengono calibrati all'avvio (app/core/hash_policy.py)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Security bearer token con debug
@@ -23,7 +29,8 @@ class DebugHTTPBearer(HTTPBearer):
     async def __call__(self, request: Request) -> HTTPAuthorizationCredentials:
         try:
             credentials = await super().__call__(request)
-            logger.debug(f"Authorization header: {request.headers.get('Authorization')}")
+            # Mai il token nei log: solo il percorso della richiesta autenticata
+            logger.debug("Bearer credentials received for %s", request.url.path)
             return credentials
         except Exception as e:
             logger.error(f"Authorization error: {str(e)}")
@@ -44,10 +51,32 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         logger.error(f"Password verification error: {str(e)}")
         return False
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica la password e, se l'hash salvato non rispetta più la politica
+    (schema deprecato o costo diverso), restituisce anche il nuovo hash
+    """
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except Exception as e:
+        logger.error(f"Password verification error: {str(e)}")
+        return False, None
+
 def get_password_hash(password: str) -> str:
     """Genera l'hash della password"""
     return pwd_context.hash(password)
 
+_codec: Optional[Tuple[SigningKeys, TokenCodec]] = None
+
+
+def token_codec() -> TokenCodec:
+    """Codec delle chiavi correnti, ricostruito solo quando il secret provider le cambia"""
+    global _codec
+    signing_keys = secret_provider.signing_keys()
+    if _codec is None or _codec[0] is not signing_keys:
+        _codec = (signing_keys, create_codec(settings.JWT_BACKEND, settings.ALGORITHM, signing_keys))
+    return _codec[1]
+
 def create_access_token(data: Dict[str, any], expires_delta: Optional[timedelta] = None) -> str:
     """
     Crea un JWT token
@@ -70,16 +99,15 @@ def create_access_token(data: Dict[str, any], expires_delta: Optional[timedelta]
         )
         to_encode.update({
             "exp": expire,
-            "iat": now,
+            # Troncato al millisecondo (mai successivo all'emissione): la revoca di
+            # tutte le sessioni confronta iat con l'istante della revoca
+            "iat": int(now.timestamp() * 1000) / 1000,
+            "jti": uuid.uuid4().hex,
             "env": settings.ENVIRONMENT
         })
         
-        token = jwt.encode(
-            to_encode,
-            settings.SECRET_KEY,
-            algorithm=settings.ALGORITHM
-        )
-        logger.debug(f"Created token: {token[:20]}... for user: {data.get('sub')}")
+        token = token_codec().encode(to_encode)
+        logger.debug("Created token: %s... for user: %s", token[:20], data.get('sub'))
         return token
     except Exception as e:
         logger.error(f"Token creation error: {str(e)}")
@@ -88,125 +116,137 @@ def create_access_token(data: Dict[str, any], expires_delta: Optional[timedelta]
             detail="Errore nella creazione del token"
         )
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Security(security),
-    db: Session = Security(get_db)
-) -> Optional[int]:
+class TokenCache:
     """
-    Verifica il token JWT e restituisce l'utente corrente
+    LRU dei token già verificati, indicizzati per digest (il token non
+    resta in memoria). Le claim restano valide fino a `exp`: lo stesso
+    token si ripresenta centinaia di volte nei suoi 30 minuti e viene
+    verificato una volta sola. Le revoche si controllano a ogni richiesta
+    anche sui token in cache (app/services/revocation.py).
     """
-    try:
-        token = credentials.credentials
-        logger.debug(f"Received token: {token}")
-        
-        try:
-            payload = jwt.decode(
-                token,
-                settings.SECRET_KEY,
-                algorithms=[settings.ALGORITHM]
-            )
-            logger.debug(f"Successfully decoded token. Payload: {json.dumps(payload, indent=2)}")
-        except Exception as decode_error:
-            logger.error(f"Token decode error: {str(decode_error)}")
-            raise
 
-        # Token expiration check
-        exp = payload.get("exp")
-        if exp:
-            exp_datetime = datetime.fromtimestamp(exp, tz=timezone.utc)
-            current_time = datetime.now(timezone.utc)
-            logger.debug(f"Token expiration: {exp_datetime}")
-            logger.debug(f"Current time: {current_time}")
-            logger.debug(f"Time until expiration: {exp_datetime - current_time}")
-            
-        # Environment check
-        token_env = payload.get("env")
-        current_env = settings.ENVIRONMENT
-        logger.debug(f"Token environment: {token_env}")
-        logger.debug(f"Current environment: {current_env}")
-
-        if token_env != current_env:
-            logger.error(f"Environment mismatch: Token env '{token_env}' != Current env '{current_env}'")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=f"Token environment mismatch: {token_env} != {current_env}",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-            
-        # Converti l'ID utente da stringa a intero
-        try:
-            user_id = int(user_id)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID format",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-            
-        logger.debug(f"User ID from token: {user_id}")
-        
-        return user_id
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        # require_auth gira sull'event loop, ma il cache può essere usato anche dai thread
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(digest)
+            if item is None:
+                self.misses += 1
+                return None
+            claims, exp = item
+            if exp <= time.time():
+                del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return claims
+
+    def put(self, digest: bytes, claims: dict) -> None:
+        exp = claims.get("exp")
+        if exp is None:
+            return
+        with self._lock:
+            self._entries[digest] = (claims, float(exp))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(max_entries=settings.JWT_CACHE_MAX_ENTRIES)
+# Una chiave rimossa dalla rotazione invalida subito i token già verificati con essa
+secret_provider.on_signing_keys_change(token_cache.clear)
+
+
+def verify_token(token: str) -> dict:
+    """
+    Claim di un token valido: firma, scadenza e ambiente verificati alla
+    prima presentazione, poi lette dal cache. Le revoche si controllano
+    sempre, in memoria. Solleva JWTError.
+    """
+    digest = token_cache.digest(token)
+    claims = token_cache.get(digest)
+    if claims is None:
+        claims = _decode_token(token)
+        token_cache.put(digest, claims)
+    if revocation_list.is_revoked(claims):
+        raise JWTError("Token revocato")
+    return claims
+
 
+def _decode_token(token: str) -> dict:
+    claims = token_codec().decode(token)
+    token_env = claims.get("env")
+    if token_env != settings.ENVIRONMENT:
+        raise JWTError(f"Token environment mismatch: {token_env} != {settings.ENVIRONMENT}")
+    if claims.get("sub") is None:
+        raise JWTError("Token missing user ID")
+    return claims
+
+
+async def get_token_claims(
+    credentials: HTTPAuthorizationCredentials = Security(security)
+) -> dict:
+    """
+    Dipendenza condivisa di autenticazione: async, quindi niente passaggio
+    dal threadpool per una verifica che, in cache, costa microsecondi.
+    """
+    try:
+        return verify_token(credentials.credentials)
     except JWTError as e:
         logger.error(f"JWT decode error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Token decode error: {str(e)}",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    except Exception as e:
-        logger.error(f"Authentication error: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=str(e) if settings.IS_DEVELOPMENT else "Token non valido",
+            detail="Token non valido",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def require_auth(
-    credentials: HTTPAuthorizationCredentials = Security(security)
-) -> int:
-    """
-    Middleware per richiedere autenticazione
-    """
+
+def _user_id(claims: dict) -> int:
     try:
-        logger.debug(f"Checking auth token: {credentials.credentials[:20]}...")
-        token = credentials.credentials
-        payload = jwt.decode(
-            token,
-            settings.SECRET_KEY,
-            algorithms=[settings.ALGORITHM]
-        )
-        user_id = payload.get("sub")
-        if user_id is None:
-            logger.error("Token missing user ID")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token non valido",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return int(user_id)
-    except JWTError as e:
-        logger.error(f"JWT decode error: {str(e)}")
+        return int(claims["sub"])
+    except (KeyError, TypeError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token non valido",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except Exception as e:
-        logger.error(f"Auth error: {str(e)}")
+
+
+async def get_current_user(claims: dict = Depends(get_token_claims)) -> Principal:
+    """
+    Verifica il token JWT e restituisce l'utente corrente dal cache dei
+    principal: la sessione si apre solo quando l'istantanea manca o è scaduta
+    """
+    principal = await principal_cache.resolve(_user_id(claims))
+    if principal is None or not principal.enabled:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Errore di autenticazione: {str(e)}" if settings.IS_DEVELOPMENT else "Errore di autenticazione",
+            detail="Utente non trovato o disattivato",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    return principal
+
+
+async def require_auth(principal: Principal = Depends(get_current_user)) -> int:
+    """
+    Middleware per richiedere autenticazione
+    """
+    return principal.id
 
 # Solo per test in development
 def create_test_token(user_id: int) -> str:
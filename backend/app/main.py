@@ -1,20 +1,64 @@
 import time, os
-import logging
+import asyncio
+import hmac
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.exc import SQLAlchemyError
 from app.core.config import settings
+from app.core.logging_config import configure_logging
 from app.api.v1 import auth, contacts
+from app.services.counters import reconcile_periodically
+from app.services.last_login import last_login_buffer
+from app.services.revocation import revocation_list
+from app.services.sync import compact_periodically
+from app.models.base import cleanup_async_db, engine, pool_status
+from app.core.executor import blocking_executor
+from app.core.hashing import password_hasher
+from app.core.metrics import MetricFamily, http_request_duration, metrics
+from app.core.query_stats import begin_request, query_stats_enabled, report_repeated
+from app.core.hash_policy import configure_hash_policy
+from app.core.rate_limit import RateLimitMiddleware, rate_limiter
+from app.core.secret_provider import secret_provider
+from app.core.security import token_cache, token_codec
+from app.services.principals import principal_cache
+from app.services.response_cache import response_cache
+from starlette.concurrency import run_in_threadpool
 
-# Configurazione logging
-logging.basicConfig(
-    level=logging.DEBUG if settings.IS_DEVELOPMENT else logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configurazione logging: coda in memoria, scrittura su stdout da un thread dedicato
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Avvia i job periodici dell'applicazione e li ferma allo spegnimento"""
+    # Calibra il costo degli hash prima di servire richieste (una volta per processo)
+    await run_in_threadpool(configure_hash_policy)
+    # Segreti letti qui e poi solo in background: le richieste usano la copia in memoria
+    await run_in_threadpool(secret_provider.load)
+    # Revoche ancora valide, poi solo quelle nuove in background
+    await run_in_threadpool(revocation_list.sync)
+    tasks = [
+        asyncio.create_task(secret_provider.refresh_periodically()),
+        asyncio.create_task(last_login_buffer.flush_periodically()),
+        asyncio.create_task(revocation_list.sync_periodically(settings.REVOCATION_SYNC_SECONDS)),
+    ]
+    if settings.SYNC_COMPACT_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(compact_periodically(settings.SYNC_COMPACT_INTERVAL_SECONDS)))
+    if settings.COUNTERS_RECONCILE_INTERVAL_SECONDS > 0:
+        tasks.append(asyncio.create_task(reconcile_periodically(settings.COUNTERS_RECONCILE_INTERVAL_SECONDS)))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Ultimi last_login rimasti nel buffer
+    await run_in_threadpool(last_login_buffer.flush)
+    await cleanup_async_db()
+    blocking_executor.shutdown()
+    password_hasher.shutdown()
 
 # Creazione app FastAPI con metadati migliorati
 app = FastAPI(
+    lifespan=lifespan,
     title=settings.APP_NAME,
     version="1.0.0",
     description="API Backend per la Rubrica Contatti",
@@ -29,28 +73,55 @@ origins = (
     else [settings.FRONTEND_URL, f"https://{settings.AZURE_APP_SERVICE_NAME}-frontend.azurewebsites.net"]
 )
 
+# Limitatore di richieste: aggiunto prima di CORS, così anche le risposte 429
+# hanno gli header CORS e il frontend può leggerle
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    trust_forwarded=settings.RATE_LIMIT_TRUST_FORWARDED
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[  # Letti dal client per If-Match, per seguire gli import, per il rate limit e i tempi del DB
+        "ETag", "Location", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"
+    ] + (["X-DB-Queries", "X-DB-Time", "Server-Timing"] if query_stats_enabled() else []),
 )
 
+def _observe_request(request: Request, status_code: int, duration: float) -> None:
+    # Template della route (es. /api/v1/contacts/{contact_id}), non il path: cardinalità limitata
+    route = request.scope.get("route")
+    http_request_duration.observe(
+        duration, request.method, getattr(route, "path", "unmatched"), str(status_code)
+    )
+
 # Middleware per logging e performance monitoring ottimizzato per F1
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
+    # Statement SQL della richiesta, contati dagli eventi dell'engine
+    query_stats = begin_request() if query_stats_enabled() else None
     try:
         response = await call_next(request)
+        process_time = time.perf_counter() - start_time
+        if settings.METRICS_ENABLED:
+            _observe_request(request, response.status_code, process_time)
+        if query_stats is not None:
+            response.headers.update(query_stats.headers())
+            report_repeated(query_stats, request.method, request.url.path)
         # Aggiungi il tempo di processo all'header solo in development
         if settings.ENVIRONMENT == "development":
-            process_time = time.time() - start_time
             response.headers["X-Process-Time"] = str(process_time)
         return response
     except Exception as e:
         # Log dell'errore (limitato in produzione)
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
+        if settings.METRICS_ENABLED:
+            _observe_request(request, 500, process_time)
         error_detail = str(e) if settings.ENVIRONMENT == "development" else "Internal Server Error"
         return JSONResponse(
             status_code=500,
@@ -84,10 +155,60 @@ def read_root():
 # Health check endpoint ottimizzato
 @app.get("/health")
 def health_check():
-    return {
+    health = {
         "status": "healthy",
         "timestamp": int(time.time())  # Usiamo int invece di float per ridurre i dati
     }
+    if settings.DB_THREADPOOL_ENABLED:
+        # Coda e attese del pool bloccante: "saturated" indica richieste ferme in attesa di un thread
+        health["executor"] = blocking_executor.stats()
+    return health
+
+# Chiavi pubbliche per verificare i token da altri servizi (vuoto con algoritmi HMAC)
+@app.get("/.well-known/jwks.json", include_in_schema=False)
+def jwks():
+    return JSONResponse(token_codec().jwks(), headers={"Cache-Control": "public, max-age=300"})
+
+@metrics.collector
+def _component_metrics():
+    """Stato di pool, cache e pool di hash, letto solo allo scrape"""
+    pool = pool_status(engine)
+    if pool:
+        yield MetricFamily("db_pool_size", "gauge", "Connessioni permanenti del pool", [({}, pool["size"])])
+        yield MetricFamily("db_pool_checked_out", "gauge", "Connessioni in uso", [({}, pool["checked_out"])])
+        yield MetricFamily("db_pool_overflow", "gauge", "Connessioni aperte oltre pool_size", [({}, pool["overflow"])])
+    if settings.DB_THREADPOOL_ENABLED:
+        executor = blocking_executor.stats()
+        yield MetricFamily("executor_active", "gauge", "Thread del pool bloccante occupati", [({}, executor["active"])])
+        yield MetricFamily("executor_queued", "gauge", "Lavori in attesa di un thread", [({}, executor["queued"])])
+    caches = {
+        "response": response_cache.stats(),
+        "token": {"hits": token_cache.hits, "misses": token_cache.misses},
+        "principal": principal_cache.stats(),
+    }
+    yield MetricFamily("cache_hits_total", "counter", "Letture servite dalla cache",
+                       [({"cache": name}, stats["hits"]) for name, stats in caches.items()])
+    yield MetricFamily("cache_misses_total", "counter", "Letture non trovate in cache",
+                       [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    yield MetricFamily("cache_hit_ratio", "gauge", "Hit / (hit + miss) dall'avvio", [
+        ({"cache": name}, stats["hits"] / (stats["hits"] + stats["misses"]) if stats["hits"] + stats["misses"] else 0.0)
+        for name, stats in caches.items()
+    ])
+    hasher = password_hasher.stats()
+    yield MetricFamily("password_hash_pending", "gauge", "Hash e verifiche bcrypt in corso o in coda", [({}, hasher["pending"])])
+    yield MetricFamily("password_hash_rejected_total", "counter", "Operazioni di hash rifiutate per coda piena",
+                       [({}, hasher["rejected"])])
+
+# Metriche in formato Prometheus: abilitate da METRICS_ENABLED, eventualmente protette da METRICS_TOKEN
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    if not settings.METRICS_ENABLED:
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    if settings.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+    ):
+        return JSONResponse(status_code=401, content={"detail": "Token non valido"})
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Test database connection - solo in development
 @app.get("/db-test", include_in_schema=False)
@@ -120,6 +241,7 @@ async def test_config():
     try:
         return {
             "key_vault_connected": settings.get_secret_key is not None,
+            "secrets": secret_provider.stats(),
             "database_type": settings.DATABASE_TYPE,
             "cors_origins": settings.CORS_ORIGINS,
             "environment": settings.ENVIRONMENT,
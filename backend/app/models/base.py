@@ -1,9 +1,14 @@
-from typing import Generator, Any
+from typing import AsyncGenerator, Generator, Any
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, MetaData, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import create_engine, MetaData, event, text
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import SQLAlchemyError
 from app.core.config import settings
+from app.core.executor import blocking_executor
+from app.core.metrics import db_pool_wait
 import logging
 import pyodbc
 from contextlib import contextmanager
@@ -23,55 +28,85 @@ convention = {
 
 metadata = MetaData(naming_convention=convention)
 
-def get_engine():
-    """
-    Crea e configura l'engine SQLAlchemy in base all'ambiente
-    """
+def _engine_args() -> dict:
+    """Argomenti comuni all'engine sincrono e a quello asincrono"""
     if settings.IS_DEVELOPMENT:
         # Configurazione PostgreSQL per development
-        engine_args = {
+        return {
             "pool_pre_ping": True,
             "pool_size": settings.DB_POOL_SIZE,
             "max_overflow": settings.DB_MAX_OVERFLOW,
             "pool_recycle": 1800,
             "pool_timeout": 30
         }
-    else:
-        # Configurazione Azure SQL per production
-        engine_args = {
-            "pool_pre_ping": True,
-            "pool_size": settings.DB_POOL_SIZE,
-            "max_overflow": settings.DB_MAX_OVERFLOW,
-            "pool_recycle": 1800,
-            "pool_timeout": 30,
-            "connect_args": {
-                "timeout": 30,
-                "driver": "ODBC Driver 18 for SQL Server",
-                "TrustServerCertificate": "yes",
-                "encrypt": "yes",
-                "connection_timeout": 30
-            }
+    # Configurazione Azure SQL per production
+    return {
+        "pool_pre_ping": True,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": 1800,
+        "pool_timeout": 30,
+        "connect_args": {
+            "timeout": 30,
+            "driver": "ODBC Driver 18 for SQL Server",
+            "TrustServerCertificate": "yes",
+            "encrypt": "yes",
+            "connection_timeout": 30
         }
-    
-    engine = create_engine(settings.DATABASE_URL, **engine_args)
-    
-    if not settings.IS_DEVELOPMENT:
-        # Eventi per ottimizzare Azure SQL Free Tier
+    }
+
+def _configure_azure_sql(engine, fast_executemany: bool = True) -> None:
+    """Eventi per ottimizzare Azure SQL Free Tier"""
+    if fast_executemany:
         @event.listens_for(engine, 'before_cursor_execute')
         def receive_before_cursor_execute(conn, cursor, statement, params, context, executemany):
-            if not executemany:
+            if executemany:
+                # Invia tutti i parametri in un unico round trip invece di uno per riga
                 cursor.fast_executemany = True
+            else:
                 cursor.arraysize = 1000
 
-        @event.listens_for(engine, 'connect')
-        def receive_connect(dbapi_connection, connection_record):
-            cursor = dbapi_connection.cursor()
-            cursor.execute("SET QUERY_GOVERNOR_COST_LIMIT 5000")  # Limita query costose
-            cursor.execute("SET LOCK_TIMEOUT 5000")  # 5 secondi timeout
-            cursor.close()
+    @event.listens_for(engine, 'connect')
+    def receive_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET QUERY_GOVERNOR_COST_LIMIT 5000")  # Limita query costose
+        cursor.execute("SET LOCK_TIMEOUT 5000")  # 5 secondi timeout
+        cursor.close()
+
+class TimedQueuePool(QueuePool):
+    """QueuePool che misura l'attesa di ogni checkout (metrica db_pool_wait_seconds)"""
+
+    def _do_get(self):
+        if not settings.METRICS_ENABLED:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - start)
+
+def get_engine():
+    """
+    Crea e configura l'engine SQLAlchemy in base all'ambiente
+    """
+    engine = create_engine(settings.DATABASE_URL, poolclass=TimedQueuePool, **_engine_args())
+    
+    if not settings.IS_DEVELOPMENT:
+        _configure_azure_sql(engine)
     
     return engine
 
+def get_async_engine():
+    """
+    Engine asincrono (asyncpg in development, aioodbc su Azure SQL).
+    I driver vengono importati solo con DB_ASYNC_ENABLED.
+    """
+    engine = create_async_engine(settings.ASYNC_DATABASE_URL, **_engine_args())
+    if not settings.IS_DEVELOPMENT:
+        # Il cursore di aioodbc è un adattatore: fast_executemany non arriverebbe a pyodbc
+        _configure_azure_sql(engine.sync_engine, fast_executemany=False)
+    return engine
+
 # Creazione engine
 engine = get_engine()
 
@@ -83,6 +118,14 @@ SessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+# Engine e session factory asincroni, solo se abilitati
+async_engine = get_async_engine() if settings.DB_ASYNC_ENABLED else None
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False  # Dopo il commit gli attributi non vanno ricaricati (niente lazy load in async)
+)
+
 @as_declarative(metadata=metadata)
 class Base:
     """
@@ -153,6 +196,111 @@ def get_db() -> Generator:
             logger.error(f"Database connection error: {str(e)}")
             raise
 
+@event.listens_for(Session, "after_begin")
+def _connection_acquired(session, transaction, connection):
+    # La connessione resta alla sessione fino a commit/rollback/close
+    session.info["holds_connection"] = True
+
+@event.listens_for(Session, "after_transaction_end")
+def _connection_released(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("holds_connection", None)
+
+class SyncSessionAdapter:
+    """
+    Session sincrona con l'interfaccia awaitable di AsyncSession: i router
+    hanno un solo codice per tutte le modalità. Senza executor le chiamate
+    restano bloccanti sull'event loop; con un executor girano nel suo pool
+    e i risultati vengono letti per intero prima di tornare all'event loop.
+    """
+
+    def __init__(self, session: Session, executor=None):
+        self.sync_session = session
+        self.executor = executor
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.executor is None:
+            return fn(*args, **kwargs)
+        if self.sync_session.info.get("holds_connection"):
+            return await self.executor.run_holding_connection(fn, *args, **kwargs)
+        return await self.executor.run(fn, *args, **kwargs)
+
+    def _execute_buffered(self, statement, params=None, **kwargs):
+        # Con pyodbc il fetch è lazy: va fatto nel thread del pool, non sull'event loop
+        return self.sync_session.execute(statement, params, **kwargs).freeze()
+
+    async def execute(self, statement, params=None, **kwargs):
+        if self.executor is None:
+            return self.sync_session.execute(statement, params, **kwargs)
+        return (await self._call(self._execute_buffered, statement, params, **kwargs))()
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await self._call(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return (await self.execute(statement, params, **kwargs)).scalars()
+
+    async def get(self, entity, ident, **kwargs):
+        return await self._call(self.sync_session.get, entity, ident, **kwargs)
+
+    def add(self, instance) -> None:
+        self.sync_session.add(instance)
+
+    async def flush(self) -> None:
+        await self._call(self.sync_session.flush)
+
+    async def commit(self) -> None:
+        await self._call(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await self._call(self.sync_session.rollback)
+
+    async def refresh(self, instance) -> None:
+        await self._call(self.sync_session.refresh, instance)
+
+    async def close(self) -> None:
+        await self._call(self.sync_session.close)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await self._call(fn, self.sync_session, *args, **kwargs)
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Sessione asincrona della richiesta"""
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error(f"Database connection error: {str(e)}")
+            raise
+
+def _get_sync_db_session(db: Session = Depends(get_db)) -> SyncSessionAdapter:
+    return SyncSessionAdapter(db)
+
+def _get_threadpool_db_session(db: Session = Depends(get_db)) -> SyncSessionAdapter:
+    return SyncSessionAdapter(db, executor=blocking_executor)
+
+# Dipendenza dei router, secondo la modalità configurata:
+# - DB_ASYNC_ENABLED: AsyncSession su driver asincrono
+# - DB_THREADPOOL_ENABLED: Session sincrona eseguita nel pool dedicato
+# - altrimenti Session sincrona sull'event loop
+# Il codice ORM dei servizi (sincrono) passa da `await db.run_sync(fn, ...)`.
+if settings.DB_ASYNC_ENABLED:
+    get_db_session = get_async_db
+elif settings.DB_THREADPOOL_ENABLED:
+    get_db_session = _get_threadpool_db_session
+else:
+    get_db_session = _get_sync_db_session
+
+def detached_session(db) -> Session:
+    """
+    Session sincrona per il lavoro che prosegue dopo la risposta (export in
+    streaming, import in background) e che la chiude al termine. Quel lavoro
+    gira nel threadpool: con AsyncSession se ne apre una nuova sull'engine sincrono.
+    """
+    if isinstance(db, SyncSessionAdapter):
+        return db.sync_session
+    return SessionLocal()
+
 def init_db() -> None:
     """Inizializza il database creando tutte le tabelle."""
     try:
@@ -163,6 +311,11 @@ def init_db() -> None:
         logger.error(f"Database initialization error: {str(e)}")
         raise
 
+async def cleanup_async_db() -> None:
+    """Chiude le connessioni dell'engine asincrono, se attivo."""
+    if async_engine is not None:
+        await async_engine.dispose()
+
 def cleanup_db() -> None:
     """Pulisce le risorse del database."""
     try:
@@ -173,6 +326,19 @@ def cleanup_db() -> None:
         logger.error(f"Database cleanup error: {str(e)}")
         raise
 
+def pool_status(bind) -> dict:
+    """Connessioni del pool: in uso, libere e di overflow (vuoto per i pool senza coda, es. SQLite nei test)"""
+    pool = bind.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        # Negativo finché il pool non ha aperto tutte le pool_size connessioni
+        "overflow": max(0, pool.overflow()),
+    }
+
 def get_db_metrics() -> dict:
     """
     Restituisce metriche del database per monitoring
@@ -180,10 +346,10 @@ def get_db_metrics() -> dict:
     try:
         with engine.connect() as conn:
             if settings.IS_DEVELOPMENT:
-                result = conn.execute("SELECT version();").scalar()
+                result = conn.execute(text("SELECT version();")).scalar()
                 version = str(result)
             else:
-                result = conn.execute("SELECT @@VERSION;").scalar()
+                result = conn.execute(text("SELECT @@VERSION;")).scalar()
                 version = str(result)
 
         return {
@@ -192,6 +358,7 @@ def get_db_metrics() -> dict:
             "pool_size": settings.DB_POOL_SIZE,
             "max_overflow": settings.DB_MAX_OVERFLOW,
             "pool_timeout": settings.SQL_CONNECTION_TIMEOUT,
+            "pool": pool_status(engine),
             "environment": settings.ENVIRONMENT
         }
     except SQLAlchemyError as e:
@@ -1,10 +1,20 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Text, Index, UniqueConstraint, func
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Text, Index, UniqueConstraint, event, func
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
 from .base import Base
 from typing import List
 from app.core.config import settings
 
+
+def normalize_key(value: str) -> str:
+    """
+    Forma delle colonne *_norm: i confronti case-insensitive diventano
+    uguaglianze che usano l'indice, invece di lower(colonna) = lower(:valore)
+    che costringe a una scansione
+    """
+    return value.lower()
+
+
 class Tenant(Base):
     """
     Modello per i tenant (organizzazioni).
@@ -14,6 +24,7 @@ class Tenant(Base):
     
     id = Column(Integer, primary_key=True)
     name = Column(String(100), unique=True, nullable=False)
+    name_norm = Column(String(100), nullable=False)  # normalize_key(name), impostato da validate_name
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
     active = Column(Boolean, default=True, nullable=False)
@@ -24,9 +35,15 @@ class Tenant(Base):
     # Indici ottimizzati per SQL Server
     __table_args__ = (
         Index('ix_tenants_name', 'name'),
+        Index('ix_tenants_name_norm', 'name_norm', unique=True),
         Index('ix_tenants_active', 'active'),
     )
 
+    @validates('name')
+    def validate_name(self, key: str, value: str) -> str:
+        self.name_norm = normalize_key(value)
+        return value
+
 class User(Base):
     """
     Modello per gli utenti.
@@ -37,6 +54,8 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     email = Column(String(255), nullable=False)
     username = Column(String(50), nullable=False)
+    email_norm = Column(String(255), nullable=False)  # normalize_key(email), impostato da validate_identity
+    username_norm = Column(String(50), nullable=False)  # normalize_key(username)
     hashed_password = Column(String(255), nullable=False)
     tenant_id = Column(Integer, ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
@@ -52,9 +71,17 @@ class User(Base):
     __table_args__ = (
         Index('ix_users_email', 'email', unique=True),
         Index('ix_users_username', 'username', unique=True),
+        # Seek del login, della registrazione e del reset password
+        Index('ix_users_email_norm', 'email_norm', unique=True),
+        Index('ix_users_username_norm', 'username_norm', unique=True),
         Index('ix_users_tenant', 'tenant_id'),
         Index('ix_users_active', 'is_active'),
     )
+
+    @validates('email', 'username')
+    def validate_identity(self, key: str, value: str) -> str:
+        setattr(self, f"{key}_norm", normalize_key(value))
+        return value
     
     def update_last_login(self) -> None:
         """Aggiorna il timestamp dell'ultimo login"""
@@ -94,8 +121,9 @@ class Contact(Base):
     __table_args__ = (
         Index('ix_contacts_owner', 'owner_id'),
         Index('ix_contacts_email', 'email'),
-        Index('ix_contacts_names', 'last_name', 'first_name'),
+        Index('ix_contacts_owner_names', 'owner_id', 'last_name', 'first_name'),  # Seek della paginazione a cursore
         Index('ix_contacts_favorite', 'favorite'),
+        Index('ix_contacts_owner_updated', 'owner_id', 'updated_at'),  # Sync incrementale ed ETag della lista
     )
     
     @property
@@ -121,36 +149,116 @@ class Contact(Base):
         return data
 
     @classmethod
-    def search(cls, owner_id: int, query: str) -> List["Contact"]:
+    def search_filter(cls, query: str):
         """
-        Metodo di ricerca ottimizzato per SQL Server
+        Filtro LIKE sui campi di ricerca, ottimizzato per SQL Server
+        (che usa LIKE invece di ILIKE)
         """
         from sqlalchemy import or_
+
+        like_pattern = f"%{query}%"
+        if settings.IS_DEVELOPMENT:
+            # PostgreSQL (development)
+            return or_(
+                cls.first_name.ilike(like_pattern),
+                cls.last_name.ilike(like_pattern),
+                cls.email.ilike(like_pattern),
+                cls.phone.ilike(like_pattern)
+            )
+        # SQL Server (production)
+        like_pattern = like_pattern.lower()
+        return or_(
+            func.lower(cls.first_name).like(like_pattern),
+            func.lower(cls.last_name).like(like_pattern),
+            func.lower(cls.email).like(like_pattern),
+            func.lower(cls.phone).like(like_pattern)
+        )
+
+    @classmethod
+    def search(cls, owner_id: int, query: str) -> List["Contact"]:
+        """
+        Metodo di ricerca: usa l'indice a trigrammi in memoria quando può,
+        altrimenti il filtro LIKE
+        """
         from .base import SessionLocal
-        
-        # SQL Server usa LIKE invece di ILIKE
-        like_pattern = f"%{query}%" if settings.IS_DEVELOPMENT else f"%{query}%"
+        from app.services.search_index import contact_index
         
         with SessionLocal() as db:
             base_query = db.query(cls).filter(cls.owner_id == owner_id)
             
-            if settings.IS_DEVELOPMENT:
-                # PostgreSQL (development)
-                search_filter = or_(
-                    cls.first_name.ilike(like_pattern),
-                    cls.last_name.ilike(like_pattern),
-                    cls.email.ilike(like_pattern),
-                    cls.phone.ilike(like_pattern)
-                )
+            ids = contact_index.search(db, owner_id, query)
+            if ids is None:
+                search_filter = cls.search_filter(query)
             else:
-                # SQL Server (production)
-                search_filter = or_(
-                    func.lower(cls.first_name).like(func.lower(like_pattern)),
-                    func.lower(cls.last_name).like(func.lower(like_pattern)),
-                    func.lower(cls.email).like(func.lower(like_pattern)),
-                    func.lower(cls.phone).like(func.lower(like_pattern))
-                )
+                search_filter = cls.id.in_(ids)
             
             return base_query.filter(search_filter)\
                            .order_by(cls.last_name, cls.first_name)\
-                           .all()
\ No newline at end of file
+                           .all()
+
+class ContactTombstone(Base):
+    """
+    Traccia delle eliminazioni per la sincronizzazione incrementale:
+    il contatto non esiste più, ma i client devono sapere di rimuoverlo.
+    Le righe più vecchie di SYNC_TOMBSTONE_RETENTION_DAYS vengono compattate.
+    """
+    __tablename__ = "contact_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    contact_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_contact_tombstones_owner_deleted', 'owner_id', 'deleted_at'),
+        Index('ix_contact_tombstones_deleted', 'deleted_at'),  # Compattazione
+    )
+
+class ContactCounter(Base):
+    """
+    Contatori dei contatti per proprietario, aggiornati nella stessa
+    transazione delle scritture: la lista legge il totale senza COUNT(*).
+    I totali per tenant sono la somma delle righe con lo stesso tenant_id
+    (una riga unica per tenant serializzerebbe le scritture di tutti i suoi utenti).
+    """
+    __tablename__ = "contact_counters"
+
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # Senza CASCADE: la riga se ne va già con l'utente (tenants -> users), e
+    # SQL Server rifiuta due percorsi di cascata dalla stessa tabella (errore 1785)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+    favorites = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index('ix_contact_counters_tenant', 'tenant_id'),
+    )
+
+@event.listens_for(User, "after_insert")
+def _create_contact_counter(mapper, connection, target):
+    # Riga dei contatori nella transazione che crea l'utente: le scritture la trovano
+    # sempre e la lettura non deve mai crearla (gli utenti esistenti li crea la migrazione)
+    connection.execute(
+        ContactCounter.__table__.insert().values(
+            owner_id=target.id, tenant_id=target.tenant_id, total=0, favorites=0
+        )
+    )
+
+class TokenRevocation(Base):
+    """
+    Revoche dei token, lette da ogni worker per allinearsi (app/services/revocation.py).
+    Con jti: un singolo token (logout). Senza jti: tutti i token dell'utente
+    emessi prima di revoked_at. Le righe servono solo fino a expires_at.
+    """
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(64), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    revoked_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_token_revocations_expires', 'expires_at'),  # Pulizia delle righe scadute
+    )
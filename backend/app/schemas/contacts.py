@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
-from typing import Optional, List
+from typing import Annotated, Optional, List, Literal, Union
 from datetime import datetime
 
 class ContactBase(BaseModel):
@@ -72,12 +72,22 @@ class ContactSearch(BaseModel):
         }
     }
 
+class ContactSuggestion(BaseModel):
+    id: int
+    full_name: str
+    email: Optional[str] = None
+    field: str  # Campo che ha prodotto il completamento
+
 class ContactListResponse(BaseModel):
     items: List[ContactResponse]
-    total: int
-    page: int
+    # In modalità cursore total/pages sono presenti solo con include_total=true
+    total: Optional[int] = None
+    total_exact: bool = True  # False: ricerca con più di COUNT_SEARCH_CAP risultati, total è la soglia
+    page: Optional[int] = None
     size: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
     model_config = {
         "json_schema_extra": {
@@ -101,4 +111,75 @@ class ContactListResponse(BaseModel):
                 "pages": 1
             }
         }
-    }
\ No newline at end of file
+    }
+
+class ContactChangesResponse(BaseModel):
+    upserts: List[ContactResponse]
+    deleted: List[int]  # Id da rimuovere dalla copia locale
+    next_token: str  # Da passare come `since` alla prossima sincronizzazione
+    has_more: bool  # True: richiamare subito con next_token
+
+# Operazioni massive
+class BulkCreate(BaseModel):
+    op: Literal["create"]
+    data: ContactCreate
+
+class BulkUpdate(BaseModel):
+    op: Literal["update"]
+    id: int = Field(..., gt=0)
+    data: ContactUpdate
+
+class BulkDelete(BaseModel):
+    op: Literal["delete"]
+    id: int = Field(..., gt=0)
+
+BulkOperation = Annotated[Union[BulkCreate, BulkUpdate, BulkDelete], Field(discriminator="op")]
+
+class BulkItemResult(BaseModel):
+    index: int
+    op: Optional[str] = None
+    status: int  # Codice HTTP che avrebbe restituito l'endpoint singolo
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkResponse(BaseModel):
+    results: List[BulkItemResult]
+    created: int
+    updated: int
+    deleted: int
+    failed: int
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "results": [
+                    {"index": 0, "op": "create", "status": 201, "id": 42, "error": None},
+                    {"index": 1, "op": "delete", "status": 404, "id": 7, "error": "Contatto non trovato"}
+                ],
+                "created": 1,
+                "updated": 0,
+                "deleted": 0,
+                "failed": 1
+            }
+        }
+    }
+
+# Import in background
+class ImportRowError(BaseModel):
+    row: int  # Numero del record nel file (riga per CSV/NDJSON, scheda per vCard)
+    error: str
+
+class ImportJobResponse(BaseModel):
+    id: str
+    status: Literal["pending", "running", "completed", "failed"]
+    format: str
+    processed: int
+    inserted: int
+    failed: int
+    errors: List[ImportRowError]
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    model_config = {
+        "from_attributes": True
+    }
@@ -0,0 +1,192 @@
+# app/services/contacts_bulk.py
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.core.config import settings
+from app.models.base import chunks
+from app.models.models import Contact
+from app.schemas.contacts import BulkCreate, BulkDelete, BulkOperation, BulkUpdate, BulkItemResult
+from app.services.counters import adjust_counters
+from app.services.sync import record_deletions
+
+logger = logging.getLogger(__name__)
+
+# Adapter costruiti una sola volta: la validazione dell'intero lotto è un'unica chiamata
+operations_adapter = TypeAdapter(List[BulkOperation])
+operation_adapter = TypeAdapter(BulkOperation)
+
+
+def _format_errors(error: ValidationError, skip: int = 0) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'][skip:]) or 'body'}: {err['msg']}"
+        for err in error.errors()
+    )
+
+
+def validate_operations(raw: List[Any]) -> Dict[int, Any]:
+    """
+    Valida il lotto con un solo passaggio del TypeAdapter. Solo se qualcosa
+    fallisce si rivalidano gli elementi uno per uno per isolare gli errori.
+    :return: {indice: operazione valida oppure BulkItemResult di errore}
+    """
+    try:
+        return dict(enumerate(operations_adapter.validate_python(raw)))
+    except ValidationError:
+        pass
+
+    validated: Dict[int, Any] = {}
+    for index, item in enumerate(raw):
+        try:
+            validated[index] = operation_adapter.validate_python(item)
+        except ValidationError as e:
+            op = item.get("op") if isinstance(item, dict) else None
+            validated[index] = BulkItemResult(
+                index=index, op=op if isinstance(op, str) else None, status=422, error=_format_errors(e, skip=1)
+            )
+    return validated
+
+
+# Errori di una singola riga: il blocco si riprova riga per riga invece di far fallire la richiesta
+_REJECTED = (IntegrityError, DataError, StaleDataError)
+
+
+def _rejected(index: int, op: Any, error: Exception) -> BulkItemResult:
+    """Esito di una riga rifiutata dal database; il testo del driver va solo nel log"""
+    logger.warning("Bulk %s at index %d rejected: %s", op.op, index, str(error.__cause__ or error).splitlines()[0])
+    if isinstance(error, StaleDataError):
+        status_code, message = 409, "Contatto modificato o eliminato nel frattempo"
+    elif isinstance(error, DataError):
+        status_code, message = 422, "Dati non validi"
+    else:
+        status_code, message = 409, "Conflitto con i dati esistenti"
+    return BulkItemResult(index=index, op=op.op, status=status_code, id=getattr(op, "id", None), error=message)
+
+
+def _apply_chunk(db: Session, chunk: List[Tuple[int, Any]], rows: List[dict],
+                 execute: Callable[[List[dict]], List[Any]],
+                 results: Dict[int, BulkItemResult]) -> List[Tuple[int, Any, Any]]:
+    """
+    Esegue un blocco in un SAVEPOINT. Se il database lo rifiuta (email
+    duplicata, riga eliminata nel frattempo, valore troppo lungo) lo si
+    riprova riga per riga, come l'import, e le righe colpevoli diventano
+    esiti di errore senza annullare le altre.
+    :return: (indice, operazione, risultato di execute) delle righe applicate
+    """
+    try:
+        with db.begin_nested():
+            outcome = execute(rows)
+        return [(i, op, value) for (i, op), value in zip(chunk, outcome)]
+    except _REJECTED as e:
+        logger.warning(f"Bulk chunk rejected ({type(e).__name__}), retrying row by row")
+
+    applied = []
+    for (i, op), row in zip(chunk, rows):
+        try:
+            with db.begin_nested():
+                outcome = execute([row])
+            applied.append((i, op, outcome[0]))
+        except _REJECTED as e:
+            results[i] = _rejected(i, op, e)
+    return applied
+
+
+def _existing(db: Session, owner_id: int, ids: List[int]) -> Dict[int, bool]:
+    """Id del proprietario tra quelli richiesti con il flag preferito, una SELECT per blocco"""
+    found: Dict[int, bool] = {}
+    for chunk in chunks(ids, settings.BULK_CHUNK_SIZE):
+        found.update(db.execute(
+            select(Contact.id, Contact.favorite).where(Contact.owner_id == owner_id, Contact.id.in_(chunk))
+        ).tuples().all())
+    return found
+
+
+def apply_operations(db: Session, owner_id: int, validated: Dict[int, Any]) -> List[BulkItemResult]:
+    """
+    Esegue create/update/delete di un lotto nella transazione di `db`
+    (il commit è a carico del chiamante). Le scritture sono raggruppate per
+    tipo e inviate a blocchi di BULK_CHUNK_SIZE: INSERT multi-riga con
+    RETURNING per le create, executemany per chiave primaria per le update,
+    DELETE ... IN (...) per le delete. Una riga rifiutata dal database
+    diventa un esito 409/422, non un errore dell'intera richiesta.
+    """
+    now = datetime.now(timezone.utc)
+    results: Dict[int, BulkItemResult] = {
+        i: op for i, op in validated.items() if isinstance(op, BulkItemResult)
+    }
+    creates = [(i, op) for i, op in validated.items() if isinstance(op, BulkCreate)]
+    updates = [(i, op) for i, op in validated.items() if isinstance(op, BulkUpdate)]
+    deletes = [(i, op) for i, op in validated.items() if isinstance(op, BulkDelete)]
+
+    # Un id può comparire una sola volta: l'ordine tra update e delete
+    # dello stesso contatto non è definito dentro un lotto
+    occurrences = defaultdict(list)
+    for i, op in updates + deletes:
+        occurrences[op.id].append(i)
+    duplicated = {i for indexes in occurrences.values() if len(indexes) > 1 for i in indexes[1:]}
+    for i in duplicated:
+        op = validated[i]
+        results[i] = BulkItemResult(index=i, op=op.op, status=409, id=op.id, error="Contatto ripetuto nella richiesta")
+    updates = [(i, op) for i, op in updates if i not in duplicated]
+    deletes = [(i, op) for i, op in deletes if i not in duplicated]
+
+    existing = _existing(db, owner_id, [op.id for _, op in updates + deletes])
+    for i, op in updates + deletes:
+        if op.id not in existing:
+            results[i] = BulkItemResult(index=i, op=op.op, status=404, id=op.id, error="Contatto non trovato")
+    updates = [(i, op) for i, op in updates if op.id in existing]
+    deletes = [(i, op) for i, op in deletes if op.id in existing]
+
+    def insert_rows(rows: List[dict]) -> List[int]:
+        return db.scalars(insert(Contact).returning(Contact.id, sort_by_parameter_order=True), rows).all()
+
+    def update_rows(rows: List[dict]) -> List[None]:
+        db.execute(update(Contact), rows)
+        return [None] * len(rows)
+
+    created, updated = [], []
+    for chunk in chunks(creates, settings.BULK_CHUNK_SIZE):
+        rows = [
+            {**op.data.model_dump(), "owner_id": owner_id, "created_at": now, "updated_at": now}
+            for _, op in chunk
+        ]
+        for i, op, contact_id in _apply_chunk(db, chunk, rows, insert_rows, results):
+            results[i] = BulkItemResult(index=i, op=op.op, status=201, id=contact_id)
+            created.append((i, op))
+
+    for chunk in chunks(updates, settings.BULK_CHUNK_SIZE):
+        rows = [
+            {"id": op.id, **op.data.model_dump(exclude_unset=True), "updated_at": now}
+            for _, op in chunk
+        ]
+        for i, op, _ in _apply_chunk(db, chunk, rows, update_rows, results):
+            results[i] = BulkItemResult(index=i, op=op.op, status=200, id=op.id)
+            updated.append((i, op))
+
+    for chunk in chunks(deletes, settings.BULK_CHUNK_SIZE):
+        db.execute(
+            delete(Contact).where(Contact.owner_id == owner_id, Contact.id.in_([op.id for _, op in chunk])),
+            execution_options={"synchronize_session": False}
+        )
+        record_deletions(db, owner_id, [op.id for _, op in chunk])
+        for i, op in chunk:
+            results[i] = BulkItemResult(index=i, op=op.op, status=204, id=op.id)
+
+    # Variazione dei contatori con un solo UPDATE per lotto
+    favorites = sum(bool(op.data.favorite) for _, op in created)
+    favorites += sum(
+        bool(op.data.favorite) - existing[op.id]
+        for _, op in updated
+        if "favorite" in op.data.model_fields_set and op.data.favorite is not None
+    )
+    favorites -= sum(existing[op.id] for _, op in deletes)
+    adjust_counters(db, owner_id, total=len(created) - len(deletes), favorites=favorites)
+
+    return [results[i] for i in sorted(results)]
@@ -0,0 +1,356 @@
+# app/services/contacts_import.py
+import csv
+import io
+import json
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from itertools import islice
+from typing import IO, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Contact
+from app.schemas.contacts import ContactCreate
+from app.services.counters import adjust_counters, favorites_of
+from app.services.response_cache import response_cache
+from app.services.search_index import contact_index
+from app.services.suggest import suggest_index
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FIELDS = ("first_name", "last_name", "email", "phone", "address", "notes", "favorite")
+
+# Numero massimo di errori per riga conservati nello stato del job
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportTooLargeError(ValueError):
+    """Sollevata quando il file caricato supera IMPORT_MAX_MB"""
+
+
+async def spool_upload(chunks: AsyncIterator[bytes]) -> IO[bytes]:
+    """
+    Copia il corpo della richiesta (o il file multipart) in un file
+    temporaneo a blocchi: il job in background lo legge dopo che la
+    richiesta è terminata. Resta in memoria fino a IMPORT_SPOOL_MEMORY_MB.
+    """
+    max_bytes = settings.IMPORT_MAX_MB * 1024 * 1024
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.IMPORT_SPOOL_MEMORY_MB * 1024 * 1024)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImportTooLargeError(f"File oltre {settings.IMPORT_MAX_MB} MB")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+# Parser incrementali: producono (numero record, dizionario dei campi)
+
+def _text(file: IO[bytes]) -> io.TextIOWrapper:
+    # utf-8-sig: gli export CSV di Excel iniziano con un BOM
+    return io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace", newline="")
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "si", "sì", "y")
+
+
+def parse_csv(file: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    reader = csv.DictReader(_text(file))
+    for number, row in enumerate(reader, start=1):
+        record = {k: (v if v != "" else None) for k, v in row.items() if k in IMPORT_FIELDS}
+        if record.get("favorite") is not None:
+            record["favorite"] = _parse_bool(record["favorite"])
+        yield number, record
+
+
+def parse_ndjson(file: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    for number, line in enumerate(_text(file), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield number, {"__error__": f"JSON non valido: {str(e)}"}
+            continue
+        if not isinstance(data, dict):
+            yield number, {"__error__": "Ogni riga deve essere un oggetto JSON"}
+            continue
+        yield number, {k: v for k, v in data.items() if k in IMPORT_FIELDS}
+
+
+def _vcard_unescape(value: str) -> str:
+    out = []
+    chars = iter(value)
+    for c in chars:
+        if c == "\\":
+            nxt = next(chars, "")
+            out.append("\n" if nxt in ("n", "N") else nxt)
+        else:
+            out.append(c)
+    return "".join(out)
+
+
+def _vcard_split(value: str, sep: str = ";") -> List[str]:
+    """Divide sui separatori non preceduti da backslash"""
+    parts, current, escaped = [], [], False
+    for c in value:
+        if escaped:
+            current.append("\\" + c)
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == sep:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(c)
+    parts.append("".join(current))
+    return [_vcard_unescape(p) for p in parts]
+
+
+def _vcard_lines(text: Iterator[str]) -> Iterator[str]:
+    """Righe logiche: ricompone le righe ripiegate (che iniziano con spazio o tab)"""
+    pending = None
+    for raw in text:
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending
+        pending = line
+    if pending is not None:
+        yield pending
+
+
+def parse_vcf(file: IO[bytes]) -> Iterator[Tuple[int, dict]]:
+    number = 0
+    card: Optional[dict] = None
+    for line in _vcard_lines(_text(file)):
+        name, _, value = line.partition(":")
+        key = name.split(";")[0].upper()
+        if key == "BEGIN" and value.upper() == "VCARD":
+            number += 1
+            card = {}
+        elif key == "END" and card is not None:
+            yield number, card
+            card = None
+        elif card is None:
+            continue
+        elif key == "N":
+            parts = _vcard_split(value) + ["", ""]
+            card["last_name"], card["first_name"] = parts[0] or None, parts[1] or None
+        elif key == "FN" and not card.get("first_name"):
+            first, _, last = _vcard_unescape(value).partition(" ")
+            card.setdefault("first_name", first or None)
+            card.setdefault("last_name", last or None)
+        elif key == "EMAIL" and "email" not in card:
+            card["email"] = _vcard_unescape(value)
+        elif key == "TEL" and "phone" not in card:
+            card["phone"] = _vcard_unescape(value)
+        elif key == "ADR" and "address" not in card:
+            parts = [p for p in _vcard_split(value) if p]
+            card["address"] = ", ".join(parts) or None
+        elif key == "NOTE":
+            card["notes"] = _vcard_unescape(value)
+        elif key == "CATEGORIES":
+            card["favorite"] = "favorite" in value.lower().split(",")
+
+
+IMPORT_PARSERS = {
+    "csv": parse_csv,
+    "ndjson": parse_ndjson,
+    "vcf": parse_vcf,
+}
+
+
+class ImportJob:
+    """Stato di un import in background, letto da GET /imports/{id}"""
+
+    def __init__(self, owner_id: int, fmt: str):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.format = fmt
+        self.status = "pending"
+        self.processed = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+
+    def add_error(self, row: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": error})
+
+
+class ImportJobRegistry:
+    """
+    Job di import del processo. Lo stato vive in memoria: con più worker
+    va interrogato il worker che ha ricevuto l'upload.
+    """
+
+    def __init__(self, retention_seconds: int):
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, ImportJob] = {}
+        self._lock = threading.Lock()
+
+    def _purge(self) -> None:
+        cutoff = datetime.now(timezone.utc).timestamp() - self.retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at.timestamp() < cutoff:
+                del self._jobs[job_id]
+
+    def create(self, owner_id: int, fmt: str) -> ImportJob:
+        job = ImportJob(owner_id, fmt)
+        with self._lock:
+            self._purge()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str, owner_id: int) -> Optional[ImportJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.owner_id == owner_id else None
+
+
+import_jobs = ImportJobRegistry(retention_seconds=settings.IMPORT_JOB_RETENTION_SECONDS)
+
+
+def _format_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'riga'}: {err['msg']}"
+        for err in error.errors()
+    )
+
+
+def _validate_batch(job: ImportJob, batch: List[Tuple[int, dict]]) -> List[Tuple[int, ContactCreate]]:
+    """
+    Valida un lotto riga per riga: il costo è dominato dalla validazione
+    delle email, e un TypeAdapter sull'intero lotto fallirebbe per una
+    sola riga costringendo a rivalidare tutte le altre.
+    """
+    valid = []
+    for number, record in batch:
+        if "__error__" in record:
+            job.add_error(number, record["__error__"])
+            continue
+        try:
+            valid.append((number, ContactCreate.model_validate(record)))
+        except ValidationError as e:
+            job.add_error(number, _format_error(e))
+    return valid
+
+
+def _row_error(error: Exception) -> str:
+    """Messaggio per il client: il testo del driver (SQL, vincoli) resta nel log"""
+    if isinstance(error, IntegrityError):
+        return "Riga in conflitto con i dati esistenti"
+    if isinstance(error, DataError):
+        return "Valori non validi per il database"
+    return "Riga non valida"
+
+
+def _stamp(rows: List[dict]) -> None:
+    now = datetime.now(timezone.utc)
+    for row in rows:
+        row["created_at"] = row["updated_at"] = now
+
+
+def _insert_batch(db: Session, job: ImportJob, valid: List[Tuple[int, ContactCreate]]) -> None:
+    """
+    executemany del lotto in una transazione. Se il database rifiuta il
+    lotto (es. email duplicata) lo si riprova riga per riga per isolare
+    le righe colpevoli senza perdere le altre.
+
+    I timestamp sono presi subito prima di ogni commit: la sync
+    incrementale si fida di updated_at solo fino a now -
+    SYNC_CLOCK_SKEW_SECONDS, e una riga confermata molto dopo il suo
+    updated_at finirebbe dietro token già consegnati ai client.
+    """
+    rows = [{**contact.model_dump(), "owner_id": job.owner_id} for _, contact in valid]
+    try:
+        _stamp(rows)
+        db.execute(insert(Contact), rows)
+        adjust_counters(db, job.owner_id, total=len(rows), favorites=favorites_of(rows))
+        db.commit()
+        job.inserted += len(rows)
+        return
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Import {job.id}: batch rejected ({str(e)}), retrying row by row")
+
+    for (number, _), row in zip(valid, rows):
+        try:
+            _stamp([row])
+            db.execute(insert(Contact), [row])
+            adjust_counters(db, job.owner_id, total=1, favorites=favorites_of([row]))
+            db.commit()
+            job.inserted += 1
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Import {job.id}: row {number} rejected: {str(e.__cause__ or e).splitlines()[0]}")
+            job.add_error(number, _row_error(e))
+
+
+def _invalidate_owner(owner_id: int) -> None:
+    # Gli indici in memoria verranno ricostruiti alla prossima ricerca
+    contact_index.invalidate(owner_id)
+    suggest_index.invalidate(owner_id)
+    response_cache.invalidate(owner_id)
+
+
+def run_import(job: ImportJob, db: Session, file: IO[bytes]) -> None:
+    """
+    Corpo del job in background: legge il file un lotto alla volta
+    (IMPORT_BATCH_SIZE record), valida e inserisce. La memoria dipende
+    dalla dimensione del lotto, non da quella del file. Cache e indici
+    sono invalidati dopo ogni lotto confermato: le letture durante
+    l'import vedono le righe già inserite.
+    """
+    start = time.perf_counter()
+    job.status = "running"
+    try:
+        file.seek(0)
+        records = IMPORT_PARSERS[job.format](file)
+        while batch := list(islice(records, settings.IMPORT_BATCH_SIZE)):
+            valid = _validate_batch(job, batch)
+            if valid:
+                inserted = job.inserted
+                _insert_batch(db, job, valid)
+                if job.inserted > inserted:
+                    _invalidate_owner(job.owner_id)
+            job.processed += len(batch)
+        job.status = "completed"
+        logger.info(
+            f"Import {job.id} completed: {job.inserted} inserted, {job.failed} failed "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+    except Exception as e:
+        db.rollback()
+        job.status = "failed"
+        job.add_error(job.processed, "Import interrotto")
+        logger.error(f"Import {job.id} failed: {str(e)}", exc_info=True)
+    finally:
+        job.finished_at = datetime.now(timezone.utc)
+        file.close()
+        db.close()
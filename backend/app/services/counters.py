@@ -0,0 +1,168 @@
+# app/services/counters.py
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.models.base import SessionLocal
+from app.models.models import Contact, ContactCounter, User
+from app.services.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _favorite_count():
+    return func.coalesce(func.sum(case((Contact.favorite == True, 1), else_=0)), 0)  # noqa: E712
+
+
+def adjust_counters(db: Session, owner_id: int, total: int = 0, favorites: int = 0) -> None:
+    """
+    Applica una variazione ai contatori nella transazione della scrittura.
+    L'UPDATE relativo blocca la riga del proprietario fino al commit, quindi
+    scritture concorrenti dello stesso proprietario non perdono incrementi.
+    La riga nasce con l'utente (listener after_insert di User e backfill
+    della migrazione); se mancasse, la crea la riconciliazione.
+    """
+    if not total and not favorites:
+        return
+    db.execute(
+        update(ContactCounter)
+        .where(ContactCounter.owner_id == owner_id)
+        .values(
+            total=ContactCounter.total + total,
+            favorites=ContactCounter.favorites + favorites,
+            updated_at=datetime.now(timezone.utc)
+        )
+    )
+
+
+def count_contacts(db: Session, owner_id: int) -> Tuple[int, int]:
+    """(totale, preferiti) calcolati dalla tabella contacts"""
+    total, favorites = db.query(func.count(Contact.id), _favorite_count())\
+                         .filter(Contact.owner_id == owner_id)\
+                         .one()
+    return int(total), int(favorites)
+
+
+def get_counters(db: Session, owner_id: int) -> Tuple[int, int]:
+    """
+    (totale, preferiti) del proprietario: una lettura per chiave primaria.
+    Senza riga (utente inserito fuori dall'ORM) si ripiega sul COUNT, senza
+    scrivere: la riga la crea la riconciliazione.
+    """
+    row = db.execute(
+        select(ContactCounter.total, ContactCounter.favorites).where(ContactCounter.owner_id == owner_id)
+    ).first()
+    if row is not None:
+        return row.total, row.favorites
+    return count_contacts(db, owner_id)
+
+
+def _create_counter(db: Session, owner_id: int) -> bool:
+    """Crea la riga mancante con un COUNT, nella propria transazione"""
+    tenant_id = db.scalar(select(User.tenant_id).where(User.id == owner_id))
+    if tenant_id is None:
+        db.commit()
+        return False
+    total, favorites = count_contacts(db, owner_id)
+    try:
+        db.add(ContactCounter(owner_id=owner_id, tenant_id=tenant_id, total=total, favorites=favorites))
+        db.commit()
+    except IntegrityError:
+        # Creata nel frattempo da un'altra riconciliazione
+        db.rollback()
+        return False
+    return True
+
+
+def get_tenant_counters(db: Session, tenant_id: int) -> Tuple[int, int]:
+    """(totale, preferiti) del tenant, somma dei contatori dei suoi utenti"""
+    total, favorites = db.query(
+        func.coalesce(func.sum(ContactCounter.total), 0),
+        func.coalesce(func.sum(ContactCounter.favorites), 0)
+    ).filter(ContactCounter.tenant_id == tenant_id).one()
+    return int(total), int(favorites)
+
+
+def _reconcile_owner(db: Session, owner_id: int) -> bool:
+    """
+    Ricalcola i contatori di un proprietario. La riga viene bloccata prima
+    del COUNT: una scrittura già in corso ha già incrementato (e si attende
+    il suo commit), una successiva incrementerà dopo il nostro valore.
+    """
+    counter = db.query(ContactCounter)\
+                .filter(ContactCounter.owner_id == owner_id)\
+                .with_for_update()\
+                .first()
+    if counter is None:
+        db.commit()
+        return False
+    total, favorites = count_contacts(db, owner_id)
+    changed = (counter.total, counter.favorites) != (total, favorites)
+    if changed:
+        logger.warning(
+            f"Contact counters drift for owner {owner_id}: "
+            f"{counter.total}/{counter.favorites} -> {total}/{favorites}"
+        )
+        counter.total, counter.favorites = total, favorites
+    db.commit()
+    if changed:
+        response_cache.invalidate(owner_id)
+    return changed
+
+
+def reconcile_counters(db: Session) -> int:
+    """
+    Confronta i contatori con un GROUP BY sull'intera tabella e corregge
+    solo i proprietari divergenti, ricontrollandoli sotto lock.
+    Crea le righe mancanti per i proprietari che hanno contatti.
+    :return: numero di proprietari corretti o creati
+    """
+    actual: Dict[int, Tuple[int, int]] = {
+        owner_id: (int(total), int(favorites))
+        for owner_id, total, favorites in db.query(Contact.owner_id, func.count(Contact.id), _favorite_count())
+                                            .group_by(Contact.owner_id)
+    }
+    stored: Dict[int, Tuple[int, int]] = {
+        owner_id: (total, favorites)
+        for owner_id, total, favorites in db.query(
+            ContactCounter.owner_id, ContactCounter.total, ContactCounter.favorites
+        )
+    }
+    # Chiude la transazione di lettura: ogni proprietario viene corretto nella propria
+    db.commit()
+
+    fixed = 0
+    for owner_id in stored.keys() | actual.keys():
+        if stored.get(owner_id) == actual.get(owner_id, (0, 0)):
+            continue
+        if owner_id in stored:
+            fixed += _reconcile_owner(db, owner_id)
+        else:
+            fixed += _create_counter(db, owner_id)
+    logger.info(f"Contact counters reconciled: {fixed} owners fixed out of {len(stored)}")
+    return fixed
+
+
+def _reconcile_with_new_session() -> int:
+    with SessionLocal() as db:
+        return reconcile_counters(db)
+
+
+async def reconcile_periodically(interval_seconds: int) -> None:
+    """Task di background avviato con l'applicazione"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_threadpool(_reconcile_with_new_session)
+        except Exception as e:
+            logger.error(f"Error reconciling contact counters: {str(e)}", exc_info=True)
+
+
+def favorites_of(rows: Iterable[dict]) -> int:
+    return sum(1 for row in rows if row.get("favorite"))
@@ -0,0 +1,151 @@
+# app/services/export.py
+import csv
+import io
+import json
+import logging
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Sequence
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Contact
+
+logger = logging.getLogger(__name__)
+
+# Colonne esportate, nell'ordine dell'header CSV
+EXPORT_COLUMNS = (
+    "id", "first_name", "last_name", "email", "phone", "address",
+    "notes", "favorite", "created_at", "updated_at"
+)
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_chunks(partitions: Iterable[Sequence]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in partitions:
+        writer.writerows([_iso(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Export vuoto: solo l'header
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(partitions: Iterable[Sequence]) -> Iterator[str]:
+    for rows in partitions:
+        yield "".join(
+            json.dumps({k: _iso(v) for k, v in zip(EXPORT_COLUMNS, row)}, ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+
+def _vcard_escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+             .replace(";", "\\;")
+             .replace(",", "\\,")
+             .replace("\r\n", "\\n")
+             .replace("\n", "\\n")
+    )
+
+
+def _vcard_line(line: str) -> str:
+    """Ripiegamento delle righe a 75 ottetti (RFC 6350 §3.2)"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Non spezzare un carattere UTF-8 multibyte
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _vcard(row: Sequence) -> str:
+    data = dict(zip(EXPORT_COLUMNS, row))
+    first = _vcard_escape(data["first_name"] or "")
+    last = _vcard_escape(data["last_name"] or "")
+    lines = [
+        "BEGIN:VCARD",
+        "VERSION:3.0",
+        f"N:{last};{first};;;",
+        f"FN:{first} {last}",
+    ]
+    if data["email"]:
+        lines.append(f"EMAIL;TYPE=INTERNET:{_vcard_escape(data['email'])}")
+    if data["phone"]:
+        lines.append(f"TEL;TYPE=VOICE:{_vcard_escape(data['phone'])}")
+    if data["address"]:
+        lines.append(f"ADR;TYPE=HOME:;;{_vcard_escape(data['address'])};;;;")
+    if data["notes"]:
+        lines.append(f"NOTE:{_vcard_escape(data['notes'])}")
+    if data["favorite"]:
+        lines.append("CATEGORIES:favorite")
+    if data["updated_at"]:
+        lines.append(f"REV:{data['updated_at'].strftime('%Y%m%dT%H%M%SZ')}")
+    lines.append("END:VCARD")
+    return "".join(_vcard_line(line) for line in lines)
+
+
+def _vcf_chunks(partitions: Iterable[Sequence]) -> Iterator[str]:
+    for rows in partitions:
+        yield "".join(_vcard(row) for row in rows)
+
+
+# Formato -> (serializzatore, media type, estensione)
+EXPORT_FORMATS: Dict[str, tuple] = {
+    "csv": (_csv_chunks, "text/csv; charset=utf-8", "csv"),
+    "ndjson": (_ndjson_chunks, "application/x-ndjson", "ndjson"),
+    "vcf": (_vcf_chunks, "text/vcard; charset=utf-8", "vcf"),
+}
+
+
+def _gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_contacts(db: Session, query, fmt: str, compress: bool = False) -> Iterator[bytes]:
+    """
+    Generatore dei byte dell'export. La select viene letta a blocchi di
+    EXPORT_BATCH_SIZE righe con yield_per (cursore lato server dove il
+    driver lo supporta), quindi la memoria non dipende dal numero di contatti.
+    La sessione viene chiusa a fine stream, anche se il client si disconnette.
+    """
+    serializer = EXPORT_FORMATS[fmt][0]
+
+    def encoded() -> Iterator[bytes]:
+        result = db.execute(query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        for text in serializer(result.partitions()):
+            yield text.encode("utf-8")
+
+    try:
+        yield from (_gzip(encoded()) if compress else encoded())
+    except Exception as e:
+        # Lo status 200 è già stato inviato: possiamo solo interrompere lo stream
+        logger.error(f"Error streaming contacts export: {str(e)}", exc_info=True)
+        raise
+    finally:
+        db.close()
+
+
+def export_columns():
+    """Colonne del modello nell'ordine di EXPORT_COLUMNS"""
+    return [getattr(Contact, column) for column in EXPORT_COLUMNS]
@@ -0,0 +1,122 @@
+# app/services/last_login.py
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.models.base import SessionLocal, chunks
+from app.models.models import User
+
+logger = logging.getLogger(__name__)
+
+AT_MOST_ONCE = "at-most-once"
+AT_LEAST_ONCE = "at-least-once"
+
+_UPDATE_LAST_LOGIN = (
+    update(User.__table__)
+    .where(User.__table__.c.id == bindparam("user_id"))
+    .values(last_login=bindparam("when"))
+)
+
+
+class LastLoginBuffer:
+    """
+    Buffer write-behind di users.last_login: il login registra l'orario in
+    memoria e un task di background scrive tutti gli orari accumulati con
+    un solo UPDATE batch ogni flush_interval secondi, o prima se il buffer
+    raggiunge max_entries. Per ogni utente resta solo l'orario più recente.
+
+    Semantica in caso di errore di scrittura:
+    - at-most-once: il batch viene scartato (nessun nuovo tentativo)
+    - at-least-once: il batch torna nel buffer e viene riscritto al flush
+      successivo (l'UPDATE è idempotente, riscriverlo non fa danni)
+    """
+
+    def __init__(self, flush_interval: float, max_entries: int, delivery: str = AT_LEAST_ONCE,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        if delivery not in (AT_MOST_ONCE, AT_LEAST_ONCE):
+            raise ValueError(f"Semantica di consegna non valida: {delivery}")
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.delivery = delivery
+        self.session_factory = session_factory
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self._pending: Dict[int, datetime] = {}
+        # record gira sull'event loop, flush nel threadpool
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def record(self, user_id: int, when: datetime) -> None:
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is None or when > previous:
+                self._pending[user_id] = when
+            full = len(self._pending) >= self.max_entries
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _requeue(self, batch: Dict[int, datetime]) -> None:
+        with self._lock:
+            for user_id, when in batch.items():
+                previous = self._pending.get(user_id)
+                if previous is None or when > previous:
+                    self._pending[user_id] = when
+
+    def flush(self) -> int:
+        """Scrive gli orari accumulati (bloccante); restituisce le righe scritte"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            with self.session_factory() as db:
+                # UPDATE ... WHERE id = ? in executemany, a blocchi sotto il limite di parametri.
+                # Core sulla tabella, non bulk ORM: l'ORM verifica il rowcount e un utente
+                # cancellato nel frattempo farebbe fallire (e riaccodare) l'intero batch
+                for rows in chunks(list(batch.items()), settings.BULK_CHUNK_SIZE):
+                    db.execute(_UPDATE_LAST_LOGIN, [{"user_id": user_id, "when": when} for user_id, when in rows])
+                db.commit()
+        except Exception as e:
+            self.failures += 1
+            if self.delivery == AT_LEAST_ONCE:
+                self._requeue(batch)
+                logger.error(f"Error flushing last_login for {len(batch)} users, will retry: {str(e)}")
+            else:
+                self.dropped += len(batch)
+                logger.error(f"Error flushing last_login, dropped {len(batch)} updates: {str(e)}")
+            return 0
+        self.flushed += len(batch)
+        return len(batch)
+
+    async def flush_periodically(self) -> None:
+        """Task di background avviato con l'applicazione"""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await run_in_threadpool(self.flush)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
+
+
+last_login_buffer = LastLoginBuffer(
+    flush_interval=settings.LAST_LOGIN_FLUSH_SECONDS,
+    max_entries=settings.LAST_LOGIN_FLUSH_MAX_ENTRIES,
+    delivery=settings.LAST_LOGIN_DELIVERY
+)
@@ -0,0 +1,159 @@
+# app/services/principals.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, NamedTuple, Optional
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.executor import run_blocking
+from app.models.base import SessionLocal
+from app.models.models import Tenant, User
+
+logger = logging.getLogger(__name__)
+
+
+class Principal(NamedTuple):
+    """Istantanea dell'utente autenticato e del suo tenant (campi di UserResponse)"""
+    id: int
+    email: str
+    username: str
+    tenant_id: int
+    is_active: bool
+    tenant_active: bool
+    created_at: datetime
+    last_login: Optional[datetime]
+
+    @property
+    def enabled(self) -> bool:
+        return self.is_active and self.tenant_active
+
+
+class PrincipalCache:
+    """
+    Principal per user_id con TTL: le dipendenze di autenticazione non
+    aprono una sessione (né prendono una connessione dal pool) finché
+    l'istantanea è valida. Le modifiche a password e stati attivi fatte da
+    questo processo la invalidano subito (listener after_flush qui sotto);
+    quelle degli altri worker arrivano entro il TTL.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (Principal, scadenza monotonic)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is None or item[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return item[0]
+
+    def put(self, principal: Principal) -> None:
+        with self._lock:
+            self._entries[principal.id] = (principal, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self, user_id: int) -> Optional[Principal]:
+        """Legge utente e tenant con una sola query (bloccante)"""
+        with self.session_factory() as db:
+            row = db.execute(
+                select(User.id, User.email, User.username, User.tenant_id, User.is_active,
+                       Tenant.active, User.created_at, User.last_login)
+                .join(Tenant, Tenant.id == User.tenant_id)
+                .where(User.id == user_id)
+            ).first()
+        if row is None:
+            return None
+        principal = Principal(*row)
+        self.put(principal)
+        return principal
+
+    async def resolve(self, user_id: int) -> Optional[Principal]:
+        principal = self.get(user_id)
+        if principal is None:
+            principal = await run_blocking(self.load, user_id)
+        return principal
+
+    def record_login(self, user_id: int, when: datetime) -> None:
+        """last_login arriva al database in differita: l'istantanea si aggiorna subito"""
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None:
+                self._entries[user_id] = (item[0]._replace(last_login=when), item[1])
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_tenant(self, tenant_id: int) -> None:
+        with self._lock:
+            for user_id in [uid for uid, (p, _) in self._entries.items() if p.tenant_id == tenant_id]:
+                del self._entries[user_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache(
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_MAX_ENTRIES
+)
+
+# Campi che cambiano l'esito dell'autenticazione o la risposta di /auth/me
+_USER_FIELDS = ("hashed_password", "is_active", "email", "username", "tenant_id")
+
+
+def _changed(obj, fields) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_principals(session: Session, flush_context) -> None:
+    # In after_flush dirty/deleted e la history degli attributi descrivono ancora ciò che è stato scritto;
+    # l'invalidazione aspetta il commit: prima, un'altra richiesta ricaricherebbe la riga ancora vecchia
+    users, tenants = session.info.setdefault("principal_invalidations", (set(), set()))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            users.add(obj.id)
+        elif isinstance(obj, Tenant):
+            tenants.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and _changed(obj, _USER_FIELDS):
+            users.add(obj.id)
+        elif isinstance(obj, Tenant) and _changed(obj, ("active",)):
+            tenants.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_principals(session: Session) -> None:
+    users, tenants = session.info.pop("principal_invalidations", ((), ()))
+    for user_id in users:
+        principal_cache.invalidate(user_id)
+    for tenant_id in tenants:
+        principal_cache.invalidate_tenant(tenant_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_principals(session: Session) -> None:
+    session.info.pop("principal_invalidations", None)
@@ -0,0 +1,318 @@
+# app/services/response_cache.py
+import hashlib
+import logging
+import queue
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    etag: Optional[str]
+    body: bytes
+
+
+class MemoryCacheBackend:
+    """
+    LRU in memoria con scadenza per voce. È per processo: con più worker
+    le invalidazioni di un worker non raggiungono gli altri, e il TTL
+    limita la durata di una risposta vecchia.
+
+    Anche le generazioni sono un LRU di max_entries chiavi. I valori
+    vengono da una sequenza unica del processo: quando una generazione esce
+    dall'LRU, il valore di default delle chiavi assenti sale oltre tutti
+    quelli già assegnati, così nessuna risposta salvata sotto una
+    generazione dimenticata torna raggiungibile.
+    """
+
+    blocking = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._counters: "OrderedDict[str, int]" = OrderedDict()
+        self._sequence = 0
+        self._floor = 0  # Generazione delle chiavi assenti
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_int(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, self._floor)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._sequence += 1
+            self._counters[key] = self._sequence
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_entries:
+                self._counters.popitem(last=False)
+                self._floor = self._sequence
+            return self._sequence
+
+    def clear(self, prefix: str = "") -> None:
+        with self._lock:
+            for store in (self._entries, self._counters):
+                for key in [k for k in store if k.startswith(prefix)]:
+                    del store[key]
+
+
+class RedisError(Exception):
+    """Risposta di errore del server Redis"""
+
+
+class RedisCacheBackend:
+    """
+    Client minimo del protocollo Redis (RESP2) su socket, senza dipendenze:
+    servono solo GET, SET EX, INCR e SCAN/DEL. Funziona con Redis, Azure
+    Cache for Redis (rediss:// sulla porta 6380) e qualunque server compatibile.
+    Le connessioni sono riusate da un piccolo pool. I comandi fanno I/O
+    bloccante: dagli handler async passano dai metodi *_async di ResponseCache.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str, timeout: float = 0.5, pool_size: int = 8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.tls = parsed.scheme == "rediss"
+        self.timeout = timeout
+        self.evictions = 0  # Gestite dal server (maxmemory-policy)
+        self._pool: "queue.LifoQueue" = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        conn = (sock, sock.makefile("rb"))
+        if self.password:
+            auth = ("AUTH", self.username, self.password) if self.username else ("AUTH", self.password)
+            self._roundtrip(conn, auth)
+        if self.db:
+            self._roundtrip(conn, ("SELECT", self.db))
+        return conn
+
+    @staticmethod
+    def _encode(args: Iterable) -> bytes:
+        parts = []
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"*%d\r\n" % len(parts) + b"".join(parts)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connessione Redis chiusa")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode("utf-8")
+        if prefix == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise RedisError(f"Risposta non valida: {line!r}")
+
+    def _roundtrip(self, conn, args):
+        sock, reader = conn
+        sock.sendall(self._encode(args))
+        return self._read(reader)
+
+    def command(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            reply = self._roundtrip(conn, args)
+        except RedisError:
+            self._release(conn)
+            raise
+        except Exception:
+            # Stato del socket sconosciuto: non torna nel pool
+            conn[0].close()
+            raise
+        self._release(conn)
+        return reply
+
+    def _release(self, conn) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: int) -> None:
+        self.command("SET", key, value, "EX", ttl)
+
+    def get_int(self, key: str) -> int:
+        value = self.command("GET", key)
+        return int(value) if value is not None else 0
+
+    def incr(self, key: str) -> int:
+        return self.command("INCR", key)
+
+    def clear(self, prefix: str = "") -> None:
+        cursor = "0"
+        while True:
+            cursor, keys = self.command("SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 500)
+            if keys:
+                self.command("DEL", *keys)
+            cursor = cursor.decode("ascii") if isinstance(cursor, bytes) else str(cursor)
+            if cursor == "0":
+                break
+
+
+class ResponseCache:
+    """
+    Cache delle risposte JSON dei contatti. Ogni chiave include la
+    generazione del proprietario: una scrittura la incrementa e tutte le
+    risposte precedenti diventano irraggiungibili in O(1), poi escono
+    dall'LRU o scadono. La generazione va letta prima della query: una
+    risposta calcolata su dati vecchi finisce sotto una generazione già superata.
+    Gli errori del backend non bloccano le richieste: valgono come miss.
+    """
+
+    def __init__(self, backend, ttl_seconds: int, prefix: str = "rubrica"):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _generation_key(self, owner_id: int) -> str:
+        return f"{self.prefix}:gen:{owner_id}"
+
+    def lookup(self, owner_id: int, scope: str, params: Iterable) -> Tuple[Optional[str], Optional[CachedResponse]]:
+        """
+        :return: (chiave da passare a store, risposta in cache o None).
+        La chiave è None se la cache è disattivata o non raggiungibile.
+        """
+        if self.backend is None:
+            return None, None
+        digest = hashlib.blake2b(repr(sorted(params)).encode("utf-8"), digest_size=12).hexdigest()
+        try:
+            generation = self.backend.get_int(self._generation_key(owner_id))
+            key = f"{self.prefix}:r:{owner_id}:{generation}:{scope}:{digest}"
+            raw = self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache lookup failed: {str(e)}")
+            return None, None
+        if raw is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        etag, _, body = raw.partition(b"\n")
+        return key, CachedResponse(etag.decode("ascii") or None, body)
+
+    def store(self, key: Optional[str], body: bytes, etag: Optional[str] = None) -> None:
+        if key is None:
+            return
+        try:
+            self.backend.set(key, (etag or "").encode("ascii") + b"\n" + body, self.ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Response cache store failed: {str(e)}")
+
+    def invalidate(self, owner_id: int) -> None:
+        """Da chiamare dopo il commit di ogni scrittura sui contatti del proprietario"""
+        if self.backend is None:
+            return
+        try:
+            self.backend.incr(self._generation_key(owner_id))
+        except Exception as e:
+            # Le risposte vecchie restano valide al più per il TTL
+            self.errors += 1
+            logger.error(f"Response cache invalidation failed for owner {owner_id}: {str(e)}")
+
+    async def _offload(self, fn, *args):
+        # Un round trip di rete sull'event loop fermerebbe tutte le richieste in corso
+        if self.backend is not None and self.backend.blocking:
+            return await run_in_threadpool(fn, *args)
+        return fn(*args)
+
+    async def lookup_async(self, owner_id: int, scope: str,
+                           params: Iterable) -> Tuple[Optional[str], Optional[CachedResponse]]:
+        return await self._offload(self.lookup, owner_id, scope, params)
+
+    async def store_async(self, key: Optional[str], body: bytes, etag: Optional[str] = None) -> None:
+        if key is not None:
+            await self._offload(self.store, key, body, etag)
+
+    async def invalidate_async(self, owner_id: int) -> None:
+        await self._offload(self.invalidate, owner_id)
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear(f"{self.prefix}:")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "evictions": getattr(self.backend, "evictions", 0),
+        }
+
+
+def create_backend():
+    """Backend scelto da RESPONSE_CACHE_BACKEND: memory, redis o none"""
+    kind = settings.RESPONSE_CACHE_BACKEND.lower()
+    if kind == "none":
+        return None
+    if kind == "redis":
+        if not settings.REDIS_URL:
+            raise ValueError("RESPONSE_CACHE_BACKEND=redis richiede REDIS_URL")
+        return RedisCacheBackend(settings.REDIS_URL)
+    return MemoryCacheBackend(max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES)
+
+
+# Istanza condivisa dal processo
+response_cache = ResponseCache(create_backend(), ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS)
@@ -0,0 +1,201 @@
+# app/services/revocation.py
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.models.base import SessionLocal
+from app.models.models import TokenRevocation
+
+logger = logging.getLogger(__name__)
+
+# iat è troncato al millisecondo e revoked_at passa da una colonna DateTime
+# (su Azure SQL DATETIME arrotonda a ~3 ms): i token emessi in questo
+# margine dopo la revoca sono trattati come precedenti, mai il contrario
+IAT_TOLERANCE_SECONDS = 0.005
+
+
+def _epoch(value: datetime) -> float:
+    # Le colonne DateTime sono in UTC senza fuso
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class BloomFilter:
+    """
+    Filtro di Bloom su bytearray: nessun falso negativo, falsi positivi
+    intorno a error_rate finché gli elementi restano entro capacity.
+    Non supporta rimozioni: si ricostruisce quando le revoche scadono.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> Iterator[int]:
+        # Doppio hashing (Kirsch-Mitzenmacher) da un solo digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    """
+    Revoche dei token in memoria, allineate tra worker e istanze dalla
+    tabella token_revocations:
+    - logout: il jti del token, fino alla sua scadenza
+    - revoca di tutte le sessioni: i token dell'utente emessi prima di un
+      certo istante, per ACCESS_TOKEN_EXPIRE_MINUTES
+    La verifica di una richiesta non fa I/O: il filtro di Bloom esclude
+    subito i jti mai revocati e solo i suoi positivi passano dall'insieme
+    esatto. Un task di background legge le righe nuove ogni
+    REVOCATION_SYNC_SECONDS e dimentica quelle scadute.
+    """
+
+    def __init__(self, capacity: int, error_rate: float,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.session_factory = session_factory
+        self.checks = 0
+        self.bloom_positives = 0
+        self._tokens: Dict[str, float] = {}  # jti -> exp
+        self._users: Dict[str, Tuple[float, float]] = {}  # sub -> (revocati gli iat precedenti, scadenza della regola)
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, claims: dict) -> bool:
+        self.checks += 1
+        if self._users:
+            rule = self._users.get(claims.get("sub"))
+            if rule is not None and claims.get("iat", 0) <= rule[0] + IAT_TOLERANCE_SECONDS:
+                return True
+        jti = claims.get("jti")
+        if jti is None or jti not in self._bloom:
+            return False
+        self.bloom_positives += 1
+        exp = self._tokens.get(jti)
+        return exp is not None and exp > time.time()
+
+    def add_token(self, jti: str, exp: float) -> None:
+        with self._lock:
+            self._tokens[jti] = exp
+            if len(self._tokens) > self._bloom.capacity:
+                self._rebuild(capacity=2 * len(self._tokens))
+            else:
+                self._bloom.add(jti)
+
+    def add_user(self, sub: str, revoked_before: float, expires: float) -> None:
+        with self._lock:
+            previous = self._users.get(sub)
+            if previous is None or revoked_before > previous[0]:
+                self._users[sub] = (revoked_before, expires)
+
+    def _rebuild(self, capacity: Optional[int] = None) -> None:
+        bloom = BloomFilter(max(self.capacity, capacity or 0), self.error_rate)
+        for jti in self._tokens:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def _purge_expired(self, now: float) -> int:
+        with self._lock:
+            tokens = {jti: exp for jti, exp in self._tokens.items() if exp > now}
+            users = {sub: rule for sub, rule in self._users.items() if rule[1] > now}
+            purged = len(self._tokens) - len(tokens) + len(self._users) - len(users)
+            if purged:
+                self._tokens, self._users = tokens, users
+                self._rebuild(capacity=2 * len(tokens))
+        return purged
+
+    def sync(self) -> int:
+        """Legge le revoche nuove (bloccante: avvio o threadpool); restituisce le righe lette"""
+        now = time.time()
+        with self.session_factory() as db:
+            rows = db.query(TokenRevocation).filter(
+                TokenRevocation.id > self._last_id,
+                TokenRevocation.expires_at > datetime.now(timezone.utc).replace(tzinfo=None)
+            ).order_by(TokenRevocation.id).all()
+            for row in rows:
+                if row.jti is not None:
+                    self.add_token(row.jti, _epoch(row.expires_at))
+                else:
+                    self.add_user(str(row.user_id), _epoch(row.revoked_at), _epoch(row.expires_at))
+            if rows:
+                self._last_id = rows[-1].id
+            purged = self._purge_expired(now)
+            if purged:
+                # Le righe scadute non servono più a nessun worker
+                db.query(TokenRevocation).filter(
+                    TokenRevocation.expires_at <= datetime.now(timezone.utc).replace(tzinfo=None)
+                ).delete(synchronize_session=False)
+                db.commit()
+        return len(rows)
+
+    async def sync_periodically(self, interval_seconds: int) -> None:
+        """Task di background avviato con l'applicazione"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await run_in_threadpool(self.sync)
+            except Exception as e:
+                logger.error(f"Error syncing token revocations: {str(e)}", exc_info=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "tokens": len(self._tokens),
+            "users": len(self._users),
+            "checks": self.checks,
+            "bloom_positives": self.bloom_positives,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+            self._last_id = 0
+            self._rebuild()
+
+
+revocation_list = RevocationList(
+    capacity=settings.REVOCATION_BLOOM_CAPACITY,
+    error_rate=settings.REVOCATION_BLOOM_ERROR_RATE
+)
+
+
+def revoke_token(db: Session, claims: dict) -> None:
+    """Logout: revoca il token delle claim fino alla sua scadenza"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expires_at = datetime.fromtimestamp(claims["exp"], tz=timezone.utc).replace(tzinfo=None)
+    db.add(TokenRevocation(jti=claims["jti"], user_id=int(claims["sub"]), revoked_at=now, expires_at=expires_at))
+    db.commit()
+    revocation_list.add_token(claims["jti"], float(claims["exp"]))
+
+
+def revoke_user_sessions(db: Session, user_id: int) -> None:
+    """
+    Revoca tutti i token emessi finora per l'utente. Azione amministrativa
+    (anche da shell o script), usata da /auth/logout-all per l'utente corrente.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expires_at = now + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    db.add(TokenRevocation(jti=None, user_id=user_id, revoked_at=now, expires_at=expires_at))
+    db.commit()
+    revocation_list.add_user(str(user_id), _epoch(now), _epoch(expires_at))
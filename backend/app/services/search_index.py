@@ -0,0 +1,328 @@
+# app/services/search_index.py
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Contact
+
+logger = logging.getLogger(__name__)
+
+NGRAM = 3
+
+# Campi su cui lavora la ricerca, gli stessi dei filtri LIKE
+SEARCH_FIELDS = ("first_name", "last_name", "email", "phone")
+
+# I campi di un contatto sono memorizzati in un'unica stringa separata da
+# FIELD_SEPARATOR: un termine di ricerca non lo contiene mai, quindi
+# `term in text` non può trovare corrispondenze a cavallo di due campi.
+FIELD_SEPARATOR = "\x00"
+
+# Stima dell'occupazione in memoria, usata solo per il budget LRU
+# (tarata con tracemalloc su CPython 3.11): voce di dizionario + stringa
+# per contatto, 4 byte per voce di posting, array + chiave per trigramma.
+DOC_OVERHEAD_BYTES = 180
+POSTING_ENTRY_BYTES = 4
+GRAM_OVERHEAD_BYTES = 150
+
+
+def normalize(value: Optional[str]) -> str:
+    """Normalizzazione coerente con ILIKE / lower() LIKE"""
+    return value.lower() if value else ""
+
+
+def ngrams(text: str) -> Set[str]:
+    """Trigrammi di una stringa (vuoto se più corta di NGRAM)"""
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class OwnerIndex:
+    """
+    Indice invertito dei contatti di un singolo proprietario.
+
+    Le posting list sono array compatti di id in sola aggiunta: modifiche
+    ed eliminazioni lasciano voci obsolete, scartate in ricerca dalla
+    verifica sul testo corrente e rimosse da compact() quando diventano
+    troppe. Non è thread-safe: ContactSearchIndex lo usa sotto `lock`,
+    il lock del singolo proprietario.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings: Dict[str, array] = {}
+        self.docs: Dict[int, str] = {}
+        self.entries = 0
+        self.stale_entries = 0
+        self.text_bytes = 0
+        self.built_at = time.monotonic()
+
+    @property
+    def size_bytes(self) -> int:
+        return (
+            len(self.docs) * DOC_OVERHEAD_BYTES + self.text_bytes
+            + self.entries * POSTING_ENTRY_BYTES
+            + len(self.postings) * GRAM_OVERHEAD_BYTES
+        )
+
+    @staticmethod
+    def _grams_of(text: str) -> Set[str]:
+        grams: Set[str] = set()
+        for field in text.split(FIELD_SEPARATOR):
+            grams |= ngrams(field)
+        return grams
+
+    def _index(self, contact_id: int, text: str) -> None:
+        grams = self._grams_of(text)
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array("i")
+            posting.append(contact_id)
+        self.entries += len(grams)
+
+    def add(self, contact_id: int, values: Iterable[Optional[str]]) -> None:
+        text = FIELD_SEPARATOR.join(normalize(v) for v in values)
+        old = self.docs.get(contact_id)
+        if old == text:
+            return
+        if old is not None:
+            self.stale_entries += len(self._grams_of(old))
+            self.text_bytes -= len(old)
+        self.docs[contact_id] = text
+        self.text_bytes += len(text)
+        self._index(contact_id, text)
+        self._maybe_compact()
+
+    def remove(self, contact_id: int) -> None:
+        old = self.docs.pop(contact_id, None)
+        if old is not None:
+            self.stale_entries += len(self._grams_of(old))
+            self.text_bytes -= len(old)
+            self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if self.stale_entries > self.entries // 2 and self.stale_entries > 1000:
+            self.compact()
+
+    def compact(self) -> None:
+        """Ricostruisce le posting list dai testi correnti"""
+        self.postings = {}
+        self.entries = 0
+        self.stale_entries = 0
+        for contact_id, text in self.docs.items():
+            self._index(contact_id, text)
+
+    def search(self, term: str, limit: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Restituisce gli id che contengono `term` in almeno un campo,
+        oppure None se le corrispondenze superano `limit`.
+        """
+        term = normalize(term)
+        grams = ngrams(term)
+        docs = self.docs
+
+        if grams:
+            # Basta scorrere la posting list più corta: la verifica sul
+            # testo scarta i falsi positivi e le voci obsolete
+            postings = [self.postings.get(g) for g in grams]
+            if any(p is None for p in postings):
+                return []
+            candidates = min(postings, key=len)
+        else:
+            # Termini più corti di un trigramma: scansione in memoria
+            candidates = docs.keys()
+
+        matches = []
+        seen = set()
+        for contact_id in candidates:
+            text = docs.get(contact_id)
+            if text is not None and term in text and contact_id not in seen:
+                seen.add(contact_id)
+                matches.append(contact_id)
+                if limit is not None and len(matches) > limit:
+                    return None
+        return matches
+
+
+class ContactSearchIndex:
+    """
+    Indici di ricerca per proprietario, costruiti alla prima ricerca
+    e tenuti entro un budget di memoria con politica LRU.
+    Un proprietario il cui indice da solo supera il budget non viene
+    tenuto in memoria e usa il LIKE fino alla scadenza del TTL.
+
+    La costruzione (una query sui contatti) avviene fuori dal lock
+    globale, sotto un lock per proprietario: le ricerche degli altri
+    proprietari non aspettano. Le modifiche arrivate durante la
+    costruzione sono accodate e riapplicate all'indice prima di
+    pubblicarlo; un invalidate() nel frattempo ne impedisce la pubblicazione.
+
+    Il lock globale protegge solo il dizionario dei proprietari: ricerche
+    e modifiche di un indice prendono il lock del proprietario dopo averlo
+    rilasciato, così la scansione di un termine corto non blocca le
+    scritture degli altri proprietari.
+    """
+
+    def __init__(self, memory_budget_bytes: int, ttl_seconds: int):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self._owners: "OrderedDict[int, OwnerIndex]" = OrderedDict()
+        self._oversized: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[int, threading.Lock] = {}
+        # Proprietari in costruzione -> modifiche da riapplicare (None: invalidato)
+        self._pending: Dict[int, Optional[List[Tuple[int, Optional[tuple]]]]] = {}
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(index.size_bytes for index in self._owners.values())
+
+    def _build(self, db: Session, owner_id: int) -> OwnerIndex:
+        start = time.perf_counter()
+        index = OwnerIndex()
+        rows = db.query(Contact.id, *(getattr(Contact, f) for f in SEARCH_FIELDS))\
+                 .filter(Contact.owner_id == owner_id)\
+                 .yield_per(5000)
+        for row in rows:
+            index.add(row[0], row[1:])
+        logger.info(
+            f"Search index built for owner {owner_id}: {len(index.docs)} contacts, "
+            f"~{index.size_bytes // 1024} KiB in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return index
+
+    def _evict(self) -> None:
+        total = self.size_bytes
+        while total > self.memory_budget_bytes and self._owners:
+            owner_id, index = self._owners.popitem(last=False)
+            total -= index.size_bytes
+            logger.debug(f"Search index evicted for owner {owner_id}")
+
+    def _cached(self, owner_id: int) -> Optional[OwnerIndex]:
+        """Da chiamare con il lock: indice caricato e non scaduto"""
+        index = self._owners.get(owner_id)
+        if index is not None and time.monotonic() - index.built_at < self.ttl_seconds:
+            self._owners.move_to_end(owner_id)
+            return index
+        return None
+
+    def get(self, db: Session, owner_id: int) -> OwnerIndex:
+        """Indice del proprietario, costruito o ricostruito se assente o scaduto"""
+        with self._lock:
+            index = self._cached(owner_id)
+            if index is not None:
+                return index
+            build_lock = self._build_locks.setdefault(owner_id, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                # Costruito da un'altra richiesta mentre si attendeva
+                index = self._cached(owner_id)
+                if index is not None:
+                    return index
+                self._pending[owner_id] = []
+            try:
+                index = self._build(db, owner_id)
+            except Exception:
+                with self._lock:
+                    self._pending.pop(owner_id, None)
+                    self._build_locks.pop(owner_id, None)
+                raise
+
+            # Un solo passaggio sotto il lock: nessuna modifica cade tra coda e pubblicazione
+            with self._lock:
+                pending = self._pending.pop(owner_id)
+                self._build_locks.pop(owner_id, None)
+                if pending is None:
+                    return index
+                for contact_id, values in pending:
+                    if values is None:
+                        index.remove(contact_id)
+                    else:
+                        index.add(contact_id, values)
+
+                if index.size_bytes > self.memory_budget_bytes:
+                    logger.warning(f"Search index for owner {owner_id} exceeds the memory budget, using LIKE")
+                    self._owners.pop(owner_id, None)
+                    self._oversized[owner_id] = time.monotonic()
+                    return index
+
+                self._owners[owner_id] = index
+                self._owners.move_to_end(owner_id)
+                self._evict()
+                return index
+
+    def _is_oversized(self, owner_id: int) -> bool:
+        marked_at = self._oversized.get(owner_id)
+        if marked_at is None:
+            return False
+        if time.monotonic() - marked_at < self.ttl_seconds:
+            return True
+        del self._oversized[owner_id]
+        return False
+
+    def search(self, db: Session, owner_id: int, term: str) -> Optional[List[int]]:
+        """
+        Id dei contatti che corrispondono a `term`.
+        None significa "usa il LIKE": indice disabilitato, termine con
+        caratteri jolly SQL o risultato troppo ampio per un IN (...).
+        """
+        if not settings.SEARCH_INDEX_ENABLED or "%" in term or "_" in term:
+            return None
+        with self._lock:
+            if self._is_oversized(owner_id):
+                return None
+        index = self.get(db, owner_id)
+        with index.lock:
+            return index.search(term, limit=settings.SEARCH_INDEX_MAX_IDS)
+
+    def _defer(self, owner_id: int, contact_id: int, values: Optional[tuple]) -> None:
+        """Da chiamare con il lock: accoda la modifica se l'indice è in costruzione"""
+        pending = self._pending.get(owner_id)
+        if pending is not None:
+            pending.append((contact_id, values))
+
+    def upsert(self, contact: Contact) -> None:
+        """Aggiorna l'indice dopo create/update; ignorato se il proprietario non è caricato"""
+        values = tuple(getattr(contact, f) for f in SEARCH_FIELDS)
+        with self._lock:
+            self._defer(contact.owner_id, contact.id, values)
+            index = self._owners.get(contact.owner_id)
+        if index is not None:
+            with index.lock:
+                index.add(contact.id, values)
+
+    def remove(self, owner_id: int, contact_id: int) -> None:
+        """Rimuove un contatto eliminato"""
+        with self._lock:
+            self._defer(owner_id, contact_id, None)
+            index = self._owners.get(owner_id)
+        if index is not None:
+            with index.lock:
+                index.remove(contact_id)
+
+    def invalidate(self, owner_id: Optional[int] = None) -> None:
+        """Scarta l'indice di un proprietario (o tutti): verrà ricostruito alla prossima ricerca"""
+        with self._lock:
+            if owner_id is None:
+                self._owners.clear()
+                self._oversized.clear()
+                for building in self._pending:
+                    self._pending[building] = None
+            else:
+                self._owners.pop(owner_id, None)
+                self._oversized.pop(owner_id, None)
+                if owner_id in self._pending:
+                    self._pending[owner_id] = None
+
+
+# Istanza condivisa dal processo
+contact_index = ContactSearchIndex(
+    memory_budget_bytes=settings.SEARCH_INDEX_MEMORY_MB * 1024 * 1024,
+    ttl_seconds=settings.SEARCH_INDEX_TTL_SECONDS
+)
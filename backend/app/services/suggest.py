@@ -0,0 +1,269 @@
+# app/services/suggest.py
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Contact
+
+logger = logging.getLogger(__name__)
+
+# Campi completabili; "full_name" permette di digitare "mario ro"
+SUGGEST_FIELDS = ("first_name", "last_name", "full_name", "email")
+
+
+def normalize(value: Optional[str]) -> str:
+    """Minuscolo e senza accenti: "José" e "jose" devono completarsi a vicenda"""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).strip()
+
+
+class OwnerSuggestions:
+    """
+    Chiavi normalizzate dei contatti di un proprietario in un array ordinato:
+    il completamento è una bisect sul prefisso seguita da una scansione
+    delle chiavi che lo condividono. Non è thread-safe: la sincronizzazione
+    è a carico di SuggestIndex.
+    """
+
+    def __init__(self):
+        # Liste parallele: keys per bisect, entries[i] = (contact_id, campo)
+        self.keys: List[str] = []
+        self.entries: List[Tuple[int, str]] = []
+        self.contacts: Dict[int, Tuple[str, str, Optional[str]]] = {}
+        self.built_at = time.monotonic()
+        self.last_access = self.built_at
+
+    @staticmethod
+    def _keys_of(first_name: str, last_name: str, email: Optional[str]) -> List[Tuple[str, str]]:
+        values = {
+            "first_name": first_name,
+            "last_name": last_name,
+            "full_name": f"{first_name} {last_name}",
+            "email": email,
+        }
+        return [(normalize(values[f]), f) for f in SUGGEST_FIELDS if normalize(values[f])]
+
+    def _position(self, key: str, entry: Tuple[int, str]) -> int:
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.entries[i] == entry:
+                return i
+            i += 1
+        return -1
+
+    def add(self, contact_id: int, first_name: str, last_name: str, email: Optional[str]) -> None:
+        if contact_id in self.contacts:
+            self.remove(contact_id)
+        for key, field in self._keys_of(first_name, last_name, email):
+            i = bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.entries.insert(i, (contact_id, field))
+        self.contacts[contact_id] = (first_name, last_name, email)
+
+    def bulk_load(self, rows) -> None:
+        """Caricamento iniziale: un solo sort invece di n inserimenti ordinati"""
+        pairs = []
+        for contact_id, first_name, last_name, email in rows:
+            self.contacts[contact_id] = (first_name, last_name, email)
+            for key, field in self._keys_of(first_name, last_name, email):
+                pairs.append((key, contact_id, field))
+        pairs.sort()
+        self.keys = [p[0] for p in pairs]
+        self.entries = [(p[1], p[2]) for p in pairs]
+
+    def remove(self, contact_id: int) -> None:
+        values = self.contacts.pop(contact_id, None)
+        if values is None:
+            return
+        for key, field in self._keys_of(*values):
+            i = self._position(key, (contact_id, field))
+            if i >= 0:
+                del self.keys[i]
+                del self.entries[i]
+
+    def complete(self, prefix: str, limit: int) -> List[dict]:
+        """Primi `limit` contatti distinti con una chiave che inizia per `prefix`"""
+        prefix = normalize(prefix)
+        results = []
+        seen = set()
+        if not prefix:
+            return results
+
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit:
+            key = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            contact_id, field = self.entries[i]
+            if contact_id not in seen:
+                seen.add(contact_id)
+                first_name, last_name, email = self.contacts[contact_id]
+                results.append({
+                    "id": contact_id,
+                    "full_name": f"{first_name} {last_name}",
+                    "email": email,
+                    "field": field,
+                })
+            i += 1
+        return results
+
+
+class SuggestIndex:
+    """
+    Indici di completamento per proprietario: costruiti al primo uso,
+    aggiornati dalle scritture del router e rimossi quando il proprietario
+    resta inattivo per più di idle_seconds.
+
+    Come ContactSearchIndex, la costruzione avviene fuori dal lock globale
+    sotto un lock per proprietario; le modifiche arrivate nel frattempo
+    sono accodate e riapplicate prima della pubblicazione.
+    """
+
+    def __init__(self, max_owners: int, idle_seconds: int, ttl_seconds: int):
+        self.max_owners = max_owners
+        self.idle_seconds = idle_seconds
+        self.ttl_seconds = ttl_seconds
+        self._owners: "OrderedDict[int, OwnerSuggestions]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._build_locks: Dict[int, threading.Lock] = {}
+        # Proprietari in costruzione -> modifiche da riapplicare (None: invalidato)
+        self._pending: Dict[int, Optional[List[Tuple[int, Optional[tuple]]]]] = {}
+
+    def _build(self, db: Session, owner_id: int) -> OwnerSuggestions:
+        start = time.perf_counter()
+        index = OwnerSuggestions()
+        rows = db.query(Contact.id, Contact.first_name, Contact.last_name, Contact.email)\
+                 .filter(Contact.owner_id == owner_id)\
+                 .yield_per(5000)
+        index.bulk_load(rows)
+        logger.info(
+            f"Suggest index built for owner {owner_id}: {len(index.contacts)} contacts "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+        return index
+
+    def _sweep(self, now: float) -> None:
+        """Rimuove i proprietari inattivi (l'OrderedDict è in ordine di ultimo accesso)"""
+        if now - self._last_sweep < min(self.idle_seconds, 60):
+            return
+        self._last_sweep = now
+        while self._owners:
+            owner_id, index = next(iter(self._owners.items()))
+            if now - index.last_access < self.idle_seconds:
+                break
+            del self._owners[owner_id]
+            logger.debug(f"Suggest index evicted for idle owner {owner_id}")
+
+    def _cached(self, owner_id: int, now: float) -> Optional[OwnerSuggestions]:
+        """Da chiamare con il lock: indice caricato e non scaduto"""
+        index = self._owners.get(owner_id)
+        if index is not None and now - index.built_at < self.ttl_seconds:
+            return index
+        return None
+
+    def _publish(self, owner_id: int, index: OwnerSuggestions, now: float) -> None:
+        """Da chiamare con il lock"""
+        index.last_access = now
+        self._owners[owner_id] = index
+        self._owners.move_to_end(owner_id)
+        while len(self._owners) > self.max_owners:
+            self._owners.popitem(last=False)
+
+    def _get(self, db: Session, owner_id: int, now: float) -> Tuple[OwnerSuggestions, bool]:
+        """Indice del proprietario e se è pubblicato (altrimenti va letto senza lock)"""
+        with self._lock:
+            self._sweep(now)
+            index = self._cached(owner_id, now)
+            if index is not None:
+                self._publish(owner_id, index, now)
+                return index, True
+            build_lock = self._build_locks.setdefault(owner_id, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                # Costruito da un'altra richiesta mentre si attendeva
+                index = self._cached(owner_id, now)
+                if index is not None:
+                    self._publish(owner_id, index, now)
+                    return index, True
+                self._pending[owner_id] = []
+            try:
+                index = self._build(db, owner_id)
+            except Exception:
+                with self._lock:
+                    self._pending.pop(owner_id, None)
+                    self._build_locks.pop(owner_id, None)
+                raise
+
+            # Un solo passaggio sotto il lock: nessuna modifica cade tra coda e pubblicazione
+            with self._lock:
+                pending = self._pending.pop(owner_id)
+                self._build_locks.pop(owner_id, None)
+                if pending is None:
+                    return index, False
+                for contact_id, values in pending:
+                    if values is None:
+                        index.remove(contact_id)
+                    else:
+                        index.add(contact_id, *values)
+                self._publish(owner_id, index, now)
+                return index, True
+
+    def suggest(self, db: Session, owner_id: int, prefix: str, limit: int) -> List[dict]:
+        index, published = self._get(db, owner_id, time.monotonic())
+        if not published:
+            # Invalidato durante la costruzione: nessun altro lo modifica
+            return index.complete(prefix, limit)
+        with self._lock:
+            return index.complete(prefix, limit)
+
+    def _defer(self, owner_id: int, contact_id: int, values: Optional[tuple]) -> None:
+        """Da chiamare con il lock: accoda la modifica se l'indice è in costruzione"""
+        pending = self._pending.get(owner_id)
+        if pending is not None:
+            pending.append((contact_id, values))
+
+    def upsert(self, contact: Contact) -> None:
+        """Aggiorna l'indice dopo create/update; ignorato se il proprietario non è caricato"""
+        values = (contact.first_name, contact.last_name, contact.email)
+        with self._lock:
+            self._defer(contact.owner_id, contact.id, values)
+            index = self._owners.get(contact.owner_id)
+            if index is not None:
+                index.add(contact.id, *values)
+
+    def remove(self, owner_id: int, contact_id: int) -> None:
+        with self._lock:
+            self._defer(owner_id, contact_id, None)
+            index = self._owners.get(owner_id)
+            if index is not None:
+                index.remove(contact_id)
+
+    def invalidate(self, owner_id: Optional[int] = None) -> None:
+        with self._lock:
+            if owner_id is None:
+                self._owners.clear()
+                for building in self._pending:
+                    self._pending[building] = None
+            else:
+                self._owners.pop(owner_id, None)
+                if owner_id in self._pending:
+                    self._pending[owner_id] = None
+
+
+# Istanza condivisa dal processo
+suggest_index = SuggestIndex(
+    max_owners=settings.SUGGEST_MAX_OWNERS,
+    idle_seconds=settings.SUGGEST_IDLE_SECONDS,
+    ttl_seconds=settings.SEARCH_INDEX_TTL_SECONDS
+)
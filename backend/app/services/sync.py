@@ -0,0 +1,160 @@
+# app/services/sync.py
+import asyncio
+import base64
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.pagination import keyset_filter
+from app.models.base import SessionLocal
+from app.models.models import Contact, ContactTombstone
+
+logger = logging.getLogger(__name__)
+
+# Posizione in uno dei due flussi: (timestamp, id della riga)
+Position = Tuple[datetime, int]
+
+
+class InvalidSyncTokenError(ValueError):
+    """Token di sincronizzazione non decodificabile"""
+
+
+class SyncTokenExpiredError(ValueError):
+    """Token più vecchio delle tombstone conservate: serve una sincronizzazione completa"""
+
+
+def _utcnow() -> datetime:
+    # Le colonne DateTime sono senza fuso: i timestamp dell'app sono in UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def encode_sync_token(upserts: Optional[Position], deletes: Position) -> str:
+    payload = {
+        "u": [upserts[0].isoformat(), upserts[1]] if upserts else None,
+        "d": [deletes[0].isoformat(), deletes[1]],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: str) -> Tuple[Optional[Position], Position]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        upserts = payload["u"]
+        if upserts is not None:
+            upserts = (datetime.fromisoformat(upserts[0]), int(upserts[1]))
+        deletes = (datetime.fromisoformat(payload["d"][0]), int(payload["d"][1]))
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        raise InvalidSyncTokenError(f"Token di sincronizzazione non valido: {str(e)}")
+    return upserts, deletes
+
+
+def record_deletions(db: Session, owner_id: int, contact_ids: Iterable[int]) -> None:
+    """Scrive le tombstone nella transazione della delete"""
+    now = _utcnow()
+    rows = [{"owner_id": owner_id, "contact_id": contact_id, "deleted_at": now} for contact_id in contact_ids]
+    if rows:
+        db.execute(insert(ContactTombstone), rows)
+
+
+def _read(db: Session, query, columns, position: Optional[Position], limit: int):
+    if position is not None:
+        query = query.where(keyset_filter(columns, position))
+    rows = db.execute(query.order_by(*columns).limit(limit + 1)).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _advance(last: Optional[Position], current: Optional[Position], has_more: bool, watermark: Position):
+    """
+    Nuova posizione di un flusso. A flusso esaurito non si supera
+    now - SYNC_CLOCK_SKEW_SECONDS: una transazione iniziata prima ma
+    non ancora confermata scriverebbe righe con timestamp già superati.
+    Le righe della finestra vengono rinviate, e il client le riapplica
+    senza effetti (upsert e delete sono idempotenti).
+    """
+    position = last or current
+    if has_more:
+        return position
+    if position is None or position > watermark:
+        return watermark
+    return position
+
+
+def get_changes(db: Session, owner_id: int, token: Optional[str], limit: int) -> dict:
+    """
+    Contatti creati o modificati e id eliminati dopo `token`.
+    Senza token restituisce l'intera rubrica (le delete precedenti non servono).
+    Entrambi i flussi sono letti in seek su (owner_id, timestamp), quindi il
+    costo dipende dal numero di modifiche e non dalla dimensione della rubrica.
+    """
+    now = _utcnow()
+    watermark = (now - timedelta(seconds=settings.SYNC_CLOCK_SKEW_SECONDS), 0)
+
+    if token:
+        upserts_pos, deletes_pos = decode_sync_token(token)
+        horizon = now - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        if deletes_pos[0] < horizon:
+            raise SyncTokenExpiredError("Token scaduto: è necessaria una sincronizzazione completa")
+    else:
+        upserts_pos, deletes_pos = None, watermark
+
+    contacts, more_upserts = _read(
+        db,
+        select(Contact).where(Contact.owner_id == owner_id),
+        (Contact.updated_at, Contact.id),
+        upserts_pos,
+        limit
+    )
+    contacts = [row[0] for row in contacts]
+    tombstones, more_deletes = _read(
+        db,
+        select(ContactTombstone.deleted_at, ContactTombstone.id, ContactTombstone.contact_id)
+            .where(ContactTombstone.owner_id == owner_id),
+        (ContactTombstone.deleted_at, ContactTombstone.id),
+        deletes_pos,
+        limit
+    )
+
+    last_upsert = (contacts[-1].updated_at, contacts[-1].id) if contacts else None
+    last_delete = (tombstones[-1][0], tombstones[-1][1]) if tombstones else None
+    next_token = encode_sync_token(
+        _advance(last_upsert, upserts_pos, more_upserts, watermark),
+        _advance(last_delete, deletes_pos, more_deletes, watermark)
+    )
+    return {
+        "upserts": contacts,
+        "deleted": [row[2] for row in tombstones],
+        "next_token": next_token,
+        "has_more": more_upserts or more_deletes,
+    }
+
+
+def compact_tombstones(db: Session) -> int:
+    """Elimina le tombstone più vecchie di SYNC_TOMBSTONE_RETENTION_DAYS"""
+    horizon = _utcnow() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    deleted = db.execute(delete(ContactTombstone).where(ContactTombstone.deleted_at < horizon)).rowcount
+    db.commit()
+    if deleted:
+        logger.info(f"Compacted {deleted} contact tombstones older than {horizon.isoformat()}")
+    return deleted
+
+
+def _compact_with_new_session() -> int:
+    with SessionLocal() as db:
+        return compact_tombstones(db)
+
+
+async def compact_periodically(interval_seconds: int) -> None:
+    """Task di background avviato con l'applicazione: niente DELETE nelle richieste di sync"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_threadpool(_compact_with_new_session)
+        except Exception as e:
+            logger.error(f"Error compacting contact tombstones: {str(e)}", exc_info=True)
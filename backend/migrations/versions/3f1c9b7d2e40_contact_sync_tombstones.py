@@ -0,0 +1,38 @@
+"""Contact sync: tombstones and (owner_id, updated_at) index
+
+Revision ID: 3f1c9b7d2e40
+Revises: a54dca557a6b
+Create Date: 2026-10-17 11:40:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9b7d2e40'
+down_revision: Union[str, None] = 'a54dca557a6b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('contact_tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], name=op.f('fk_contact_tombstones_owner_id_users'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_contact_tombstones'))
+    )
+    op.create_index('ix_contact_tombstones_owner_deleted', 'contact_tombstones', ['owner_id', 'deleted_at'], unique=False)
+    op.create_index('ix_contact_tombstones_deleted', 'contact_tombstones', ['deleted_at'], unique=False)
+    op.create_index('ix_contacts_owner_updated', 'contacts', ['owner_id', 'updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_owner_updated', table_name='contacts')
+    op.drop_index('ix_contact_tombstones_deleted', table_name='contact_tombstones')
+    op.drop_index('ix_contact_tombstones_owner_deleted', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
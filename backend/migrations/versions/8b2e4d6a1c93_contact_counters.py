@@ -0,0 +1,49 @@
+"""Per-owner contact counters
+
+Revision ID: 8b2e4d6a1c93
+Revises: 3f1c9b7d2e40
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d6a1c93'
+down_revision: Union[str, None] = '3f1c9b7d2e40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('contact_counters',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('favorites', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], name=op.f('fk_contact_counters_owner_id_users'), ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], name=op.f('fk_contact_counters_tenant_id_tenants')),
+    sa.PrimaryKeyConstraint('owner_id', name=op.f('pk_contact_counters'))
+    )
+    op.create_index('ix_contact_counters_tenant', 'contact_counters', ['tenant_id'], unique=False)
+
+    # Valori iniziali per tutti gli utenti, anche senza contatti
+    users = sa.table('users', sa.column('id'), sa.column('tenant_id'))
+    contacts = sa.table('contacts', sa.column('id'), sa.column('owner_id'), sa.column('favorite', sa.Boolean()))
+    counters = sa.table('contact_counters', sa.column('owner_id'), sa.column('tenant_id'),
+                        sa.column('total'), sa.column('favorites'))
+    favorites = sa.func.coalesce(sa.func.sum(sa.case((contacts.c.favorite == sa.true(), 1), else_=0)), 0)
+    op.execute(counters.insert().from_select(
+        ['owner_id', 'tenant_id', 'total', 'favorites'],
+        sa.select(users.c.id, users.c.tenant_id, sa.func.count(contacts.c.id), favorites)
+          .select_from(users.outerjoin(contacts, contacts.c.owner_id == users.c.id))
+          .group_by(users.c.id, users.c.tenant_id)
+    ))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_counters_tenant', table_name='contact_counters')
+    op.drop_table('contact_counters')
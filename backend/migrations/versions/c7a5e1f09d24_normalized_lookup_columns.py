@@ -0,0 +1,59 @@
+"""Normalized lookup columns for users and tenants
+
+Revision ID: c7a5e1f09d24
+Revises: 8b2e4d6a1c93
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a5e1f09d24'
+down_revision: Union[str, None] = '8b2e4d6a1c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Colonne nullable, backfill, poi NOT NULL: le righe esistenti non hanno un valore di default
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('email_norm', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('username_norm', sa.String(length=50), nullable=True))
+    with op.batch_alter_table('tenants') as batch_op:
+        batch_op.add_column(sa.Column('name_norm', sa.String(length=100), nullable=True))
+
+    # Stessa normalizzazione di models.normalize_key; la registrazione già
+    # rifiutava duplicati che differiscono solo per maiuscole, quindi gli
+    # indici univoci non trovano conflitti
+    users = sa.table('users', sa.column('email'), sa.column('username'),
+                     sa.column('email_norm'), sa.column('username_norm'))
+    tenants = sa.table('tenants', sa.column('name'), sa.column('name_norm'))
+    op.execute(users.update().values(
+        email_norm=sa.func.lower(users.c.email),
+        username_norm=sa.func.lower(users.c.username)
+    ))
+    op.execute(tenants.update().values(name_norm=sa.func.lower(tenants.c.name)))
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('email_norm', existing_type=sa.String(length=255), nullable=False)
+        batch_op.alter_column('username_norm', existing_type=sa.String(length=50), nullable=False)
+    with op.batch_alter_table('tenants') as batch_op:
+        batch_op.alter_column('name_norm', existing_type=sa.String(length=100), nullable=False)
+
+    op.create_index('ix_users_email_norm', 'users', ['email_norm'], unique=True)
+    op.create_index('ix_users_username_norm', 'users', ['username_norm'], unique=True)
+    op.create_index('ix_tenants_name_norm', 'tenants', ['name_norm'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tenants_name_norm', table_name='tenants')
+    op.drop_index('ix_users_username_norm', table_name='users')
+    op.drop_index('ix_users_email_norm', table_name='users')
+    with op.batch_alter_table('tenants') as batch_op:
+        batch_op.drop_column('name_norm')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('username_norm')
+        batch_op.drop_column('email_norm')
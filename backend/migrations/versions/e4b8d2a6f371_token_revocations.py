@@ -0,0 +1,35 @@
+"""Token revocations
+
+Revision ID: e4b8d2a6f371
+Revises: c7a5e1f09d24
+Create Date: 2026-10-17 13:30:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8d2a6f371'
+down_revision: Union[str, None] = 'c7a5e1f09d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('token_revocations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('jti', sa.String(length=64), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_token_revocations_user_id_users'), ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_token_revocations'))
+    )
+    op.create_index('ix_token_revocations_expires', 'token_revocations', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_token_revocations_expires', table_name='token_revocations')
+    op.drop_table('token_revocations')
@@ -15,5 +15,6 @@ setup(
         "pytest",
         "pytest-asyncio",
         "httpx",
+        "aiosqlite",
     ],
 )
\ No newline at end of file
@@ -4,6 +4,7 @@ import {
   ContactCreate,
   ContactUpdate,
   ContactSearch,
+  ContactSuggestion,
   ContactListResponse
 } from '../types/contacts';
 
@@ -27,6 +28,12 @@ export const contactsApi = {
     return response.data;
   },
 
+  // GET /contacts/suggest - Autocompletamento per prefisso (leggero, adatto a ogni tasto)
+  suggestContacts: async (q: string, limit: number = 8): Promise<ContactSuggestion[]> => {
+    const response = await axiosInstance.get(`${CONTACTS_URL}/suggest`, { params: { q, limit } });
+    return response.data;
+  },
+
   // POST /contacts - Crea nuovo contatto
   createContact: async (contact: ContactCreate): Promise<Contact> => {
     const response = await axiosInstance.post(CONTACTS_URL, contact);
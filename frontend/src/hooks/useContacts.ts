@@ -35,7 +35,6 @@ export const useContacts = (options: UseContactsOptions = {}) => {
     onSuccess: () => {
       queryClient.invalidateQueries({ queryKey: ['contacts'] });
       showToast('Contatto creato con successo', 'success');
-      refetch();
     },
     onError: (error) => {
       showToast('Errore durante la creazione del contatto', 'error');
@@ -50,7 +49,6 @@ export const useContacts = (options: UseContactsOptions = {}) => {
     onSuccess: () => {
       queryClient.invalidateQueries({ queryKey: ['contacts'] });
       showToast('Contatto aggiornato con successo', 'success');
-      refetch();
     },
     onError: (error) => {
       showToast('Errore durante l\'aggiornamento del contatto', 'error');
@@ -65,7 +63,6 @@ export const useContacts = (options: UseContactsOptions = {}) => {
       queryClient.invalidateQueries({ queryKey: ['contacts'] });
       setSelectedContact(null);
       showToast('Contatto eliminato con successo', 'success');
-      refetch();
     },
     onError: (error) => {
       showToast('Errore durante l\'eliminazione del contatto', 'error');
@@ -42,6 +42,16 @@ export interface Contact {
     page: number;
     size: number;
     pages: number;
+    next_cursor?: string | null;  // Solo in modalità cursore
+    prev_cursor?: string | null;
+  }
+  
+  // Interfaccia per un completamento di GET /contacts/suggest
+  export interface ContactSuggestion {
+    id: number;
+    full_name: string;
+    email?: string | null;
+    field: 'first_name' | 'last_name' | 'full_name' | 'email';
   }
   
   // Enum per le modalità del form contatto
@@ -9,7 +9,7 @@ from dotenv import load_dotenv
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import StaticPool
 
 # Configura i percorsi base
@@ -25,7 +25,14 @@ sys.path.insert(0, str(BACKEND_DIR))
 from backend.app.main import app
 from backend.app.models.base import Base, get_db
 from backend.app.models.models import User, Tenant
-from backend.app.core.security import create_access_token, get_password_hash
+from backend.app.core.security import create_access_token, get_password_hash, token_cache
+from backend.app.services.search_index import contact_index
+from backend.app.services.suggest import suggest_index
+from backend.app.services.response_cache import response_cache
+from backend.app.core.rate_limit import rate_limiter
+from backend.app.services.last_login import last_login_buffer
+from backend.app.services.revocation import revocation_list
+from backend.app.services.principals import principal_cache
 
 def setup_test_logging() -> logging.Logger:
     """Configura il logging per i test"""
@@ -159,6 +166,21 @@ def client(clean_db) -> Generator:
     
     logger.info("Setting up test client")
     app.dependency_overrides[get_db] = override_get_db
+    # Gli id si ripetono tra un test e l'altro: niente stato in memoria residuo
+    contact_index.invalidate()
+    suggest_index.invalidate()
+    response_cache.clear()
+    token_cache.clear()
+    # Buffer di last_login, revoche e principal usano la transazione del test invece di SessionLocal
+    last_login_buffer.clear()
+    last_login_buffer.session_factory = lambda: Session(bind=clean_db.connection())
+    revocation_list.clear()
+    revocation_list.session_factory = lambda: Session(bind=clean_db.connection())
+    principal_cache.clear()
+    principal_cache.session_factory = lambda: Session(bind=clean_db.connection())
+    # I test fanno molte richieste con lo stesso utente: il limitatore ha un test dedicato
+    rate_limiter.enabled = False
+    rate_limiter.reset()
     
     with TestClient(app) as test_client:
         yield test_client
\ No newline at end of file
@@ -1,6 +1,7 @@
 import pytest
 import logging
 from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
 
 logger = logging.getLogger("api_tests")
 
@@ -77,4 +78,449 @@ def test_invalid_login(client):
     )
     
     assert response.status_code == 401, "Invalid login should fail"
-    logger.info("Invalid login test passed")
\ No newline at end of file
+    logger.info("Invalid login test passed")
+
+
+def test_login_hashing_saturated(client, test_user):
+    """Test login con il pool di hash saturo: 503 immediato"""
+    from backend.app.core.hashing import password_hasher
+
+    logger.info("Testing login with saturated password hashing")
+    max_pending, rejected = password_hasher.max_pending, password_hasher.rejected
+    password_hasher.max_pending = 0
+    try:
+        response = client.post(
+            "/api/v1/auth/login",
+            json={
+                "username": "testuser",
+                "password": test_user["password"]
+            }
+        )
+    finally:
+        password_hasher.max_pending = max_pending
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert password_hasher.rejected == rejected + 1
+    logger.info("Saturated password hashing test passed")
+
+def test_login_rehashes_outdated_hash(client, test_user, clean_db):
+    """Test aggiornamento trasparente dell'hash al login"""
+    from passlib.hash import bcrypt
+    from backend.app.core.hash_policy import active_policy
+    from backend.app.core.security import pwd_context
+
+    logger.info("Testing password rehash on login")
+    user = test_user["user"]
+    user.hashed_password = bcrypt.using(rounds=4).hash(test_user["password"])
+    clean_db.commit()
+    assert pwd_context.needs_update(user.hashed_password)
+
+    response = client.post(
+        "/api/v1/auth/login",
+        json={
+            "username": "testuser",
+            "password": test_user["password"]
+        }
+    )
+    assert response.status_code == 200
+
+    clean_db.refresh(user)
+    assert not pwd_context.needs_update(user.hashed_password)
+    assert bcrypt.from_string(user.hashed_password).rounds >= active_policy().bcrypt_rounds
+    assert pwd_context.verify(test_user["password"], user.hashed_password)
+    logger.info("Password rehash test passed")
+
+
+def test_hash_policy_never_downgrades(monkeypatch):
+    """Test politica calibrata più bassa: gli hash più costosi non vengono riscritti"""
+    from passlib.context import CryptContext
+    from passlib.hash import bcrypt
+    from backend.app.core import hash_policy
+    from backend.app.core.config import settings
+
+    logger.info("Testing hash policy without downgrades")
+    context = CryptContext(**hash_policy.HashPolicy(["bcrypt"], 11, 2, 0).context_options())
+    stronger = bcrypt.using(rounds=12).hash("segreta")
+    assert context.verify_and_update("segreta", stronger) == (True, None)
+    weaker = bcrypt.using(rounds=10).hash("segreta")
+    valid, upgraded = context.verify_and_update("segreta", weaker)
+    assert valid and bcrypt.from_string(upgraded).rounds == 11
+
+    # Host lento: la calibrazione non scende sotto PASSWORD_BCRYPT_ROUNDS
+    monkeypatch.setattr(hash_policy, "time_verify", lambda *args, **kwargs: 1000.0)
+    monkeypatch.setattr(settings, "PASSWORD_HASH_SCHEMES", "bcrypt")
+    assert hash_policy.build_policy(target_ms=250).bcrypt_rounds == settings.PASSWORD_BCRYPT_ROUNDS
+    logger.info("Hash policy downgrade test passed")
+
+
+def test_login_rate_limit(client, monkeypatch):
+    """Test budget separato per /auth/login"""
+    from backend.app.core.rate_limit import rate_limiter
+
+    logger.info("Testing login rate limit")
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setitem(rate_limiter.auth_rules, "/api/v1/auth/login", ("login", 2))
+    statuses = [
+        client.post("/api/v1/auth/login", json={"username": "wronguser", "password": "wrongpass"}).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [401, 401, 429]
+    # Il budget delle altre rotte è separato
+    assert client.post("/api/v1/auth/password-reset", json={"email": "a@example.com"}).status_code == 202
+    logger.info("Login rate limit test passed")
+
+def test_token_cache(client, test_user):
+    """Test cache dei token verificati e rifiuto dei token revocati"""
+    from backend.app.core.security import token_cache
+
+    logger.info("Testing verified token cache")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+    hits = token_cache.hits
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+    assert token_cache.hits == hits + 1
+
+    # Un token revocato viene rifiutato anche se già in cache
+    assert client.post("/api/v1/auth/logout", headers=headers).status_code == 204
+    response = client.get("/api/v1/auth/me", headers=headers)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token non valido"
+    logger.info("Token cache test passed")
+
+def test_signing_key_rotation(client, test_user, tmp_path, monkeypatch):
+    """Test rotazione delle chiavi di firma con kid"""
+    import json
+    from jose import jwt
+    from backend.app.core.secret_provider import EnvSecretBackend, secret_provider
+    from backend.app.core.security import create_access_token
+
+    logger.info("Testing signing key rotation")
+    old_token = test_user["token"]
+    old_kid = jwt.get_unverified_header(old_token)["kid"]
+    old_key = secret_provider.signing_keys().current_key
+    secrets_file = tmp_path / "secrets.json"
+
+    def rotate(keys, current):
+        secrets_file.write_text(json.dumps({"jwt-signing-keys": {"current": current, "keys": keys}}))
+        secret_provider.load()
+
+    monkeypatch.setattr(secret_provider, "backend", EnvSecretBackend(str(secrets_file)))
+    try:
+        # Nuova chiave corrente, la vecchia resta valida per i token già emessi
+        rotate({old_kid: old_key, "k2": "nuova-chiave-di-firma"}, "k2")
+        new_token = create_access_token({"sub": test_user["user"].id})
+        assert jwt.get_unverified_header(new_token)["kid"] == "k2"
+        for token in (old_token, new_token):
+            response = client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 200
+
+        # Vecchia chiave ritirata: i suoi token vengono rifiutati anche se già in cache
+        rotate({"k2": "nuova-chiave-di-firma"}, "k2")
+        response = client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {old_token}"})
+        assert response.status_code == 401
+        response = client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {new_token}"})
+        assert response.status_code == 200
+    finally:
+        monkeypatch.undo()
+        secret_provider.load()
+    logger.info("Signing key rotation test passed")
+
+@pytest.mark.parametrize("algorithm", ["EdDSA", "ES256"])
+def test_asymmetric_tokens_and_jwks(client, test_user, tmp_path, monkeypatch, algorithm):
+    """Test firma asimmetrica e verifica con le chiavi pubbliche del JWKS"""
+    import json
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+    from backend.app.core.config import settings
+    from backend.app.core.jwt_codec import AsymmetricCodec, b64decode
+    from backend.app.core.secret_provider import EnvSecretBackend, SigningKeys, secret_provider
+
+    logger.info(f"Testing {algorithm} tokens and JWKS")
+    private_key = ed25519.Ed25519PrivateKey.generate() if algorithm == "EdDSA" else ec.generate_private_key(ec.SECP256R1())
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    secrets_file = tmp_path / "secrets.json"
+    secrets_file.write_text(json.dumps({"jwt-signing-keys": {"current": "a1", "keys": {"a1": pem}}}))
+
+    monkeypatch.setattr(settings, "ALGORITHM", algorithm)
+    monkeypatch.setattr(secret_provider, "backend", EnvSecretBackend(str(secrets_file)))
+    try:
+        secret_provider.load()
+        response = client.post(
+            "/api/v1/auth/login",
+            json={"username": test_user["user"].username, "password": test_user["password"]}
+        )
+        assert response.status_code == 200
+        token = response.json()["access_token"]
+        header = json.loads(b64decode(token.split(".")[0].encode()))
+        assert header == {"alg": algorithm, "typ": "JWT", "kid": "a1"}
+        assert client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+        jwks = client.get("/.well-known/jwks.json").json()
+        assert [key["kid"] for key in jwks["keys"]] == ["a1"]
+        assert "d" not in jwks["keys"][0]
+
+        # Un token firmato con un'altra chiave con lo stesso kid viene rifiutato
+        other = ed25519.Ed25519PrivateKey.generate() if algorithm == "EdDSA" else ec.generate_private_key(ec.SECP256R1())
+        other_pem = other.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ).decode()
+        forged = AsymmetricCodec(algorithm, SigningKeys("a1", {"a1": other_pem})).encode(
+            {"sub": str(test_user["user"].id), "env": settings.ENVIRONMENT, "exp": 9999999999}
+        )
+        assert client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {forged}"}).status_code == 401
+    finally:
+        monkeypatch.undo()
+        secret_provider.load()
+    logger.info(f"{algorithm} tokens test passed")
+
+def test_case_insensitive_lookup(client, clean_db):
+    """Test ricerche case-insensitive sulle colonne normalizzate"""
+    from backend.app.models.models import User
+
+    logger.info("Testing case-insensitive lookups")
+    response = client.post("/api/v1/auth/register", json={
+        "email": "Mixed.Case@Example.com", "username": "MixedCase", "password": "Test123!", "tenant_name": "Acme"
+    })
+    assert response.status_code == 201
+    user = clean_db.get(User, response.json()["user"]["id"])
+    assert (user.username, user.username_norm, user.email_norm) == ("MixedCase", "mixedcase", "mixed.case@example.com")
+
+    response = client.post("/api/v1/auth/login", json={"username": "MIXEDCASE", "password": "Test123!"})
+    assert response.status_code == 200
+
+    response = client.post("/api/v1/auth/register", json={
+        "email": "other@example.com", "username": "mixedcase", "password": "Test123!"
+    })
+    assert response.status_code == 400
+
+    # Stesso tenant a prescindere dalle maiuscole
+    response = client.post("/api/v1/auth/register", json={
+        "email": "second@example.com", "username": "second", "password": "Test123!", "tenant_name": "ACME"
+    })
+    assert response.status_code == 201
+    assert response.json()["user"]["tenant_id"] == user.tenant_id
+    logger.info("Case-insensitive lookup test passed")
+
+def test_last_login_write_behind(client, test_user, clean_db, monkeypatch):
+    """Test scrittura differita e in batch di last_login"""
+    from datetime import datetime, timezone
+    from backend.app.models.models import User
+    from backend.app.services.last_login import AT_LEAST_ONCE, AT_MOST_ONCE, last_login_buffer
+
+    logger.info("Testing last_login write-behind buffer")
+    user = test_user["user"]
+    response = client.post(
+        "/api/v1/auth/login", json={"username": user.username, "password": test_user["password"]}
+    )
+    assert response.status_code == 200
+    assert response.json()["user"]["last_login"] is not None
+    # Il login non ha scritto: l'orario è nel buffer
+    clean_db.refresh(user)
+    assert user.last_login is None
+    assert last_login_buffer.pending() == 1
+
+    # Scrittura fallita: at-least-once rimette il batch nel buffer, at-most-once lo scarta
+    working_factory = last_login_buffer.session_factory
+
+    def broken_factory():
+        raise RuntimeError("database non raggiungibile")
+
+    monkeypatch.setattr(last_login_buffer, "session_factory", broken_factory)
+    assert last_login_buffer.flush() == 0
+    assert last_login_buffer.pending() == 1
+
+    monkeypatch.setattr(last_login_buffer, "session_factory", working_factory)
+    assert last_login_buffer.flush() == 1
+    clean_db.refresh(user)
+    assert user.last_login is not None
+
+    last_login_buffer.record(user.id, user.last_login)
+    monkeypatch.setattr(last_login_buffer, "session_factory", broken_factory)
+    monkeypatch.setattr(last_login_buffer, "delivery", AT_MOST_ONCE)
+    assert last_login_buffer.flush() == 0
+    assert last_login_buffer.pending() == 0
+
+    # Un utente cancellato dopo il login non blocca la scrittura degli altri
+    monkeypatch.setattr(last_login_buffer, "session_factory", working_factory)
+    monkeypatch.setattr(last_login_buffer, "delivery", AT_LEAST_ONCE)
+    response = client.post("/api/v1/auth/register", json={
+        "email": "gone@example.com", "username": "gone", "password": "Test123!"
+    })
+    assert response.status_code == 201
+    gone = clean_db.get(User, response.json()["user"]["id"])
+    clean_db.delete(gone)
+    clean_db.commit()
+    when = datetime.now(timezone.utc).replace(tzinfo=None)
+    last_login_buffer.record(gone.id, when)
+    last_login_buffer.record(user.id, when)
+    last_login_buffer.flush()
+    assert last_login_buffer.pending() == 0
+    clean_db.refresh(user)
+    assert user.last_login == when
+    logger.info("last_login write-behind test passed")
+
+def test_token_revocation(client, test_user):
+    """Test logout, revoca di tutte le sessioni e allineamento tra worker"""
+    import time
+    from jose import jwt
+    from backend.app.services.revocation import RevocationList, revocation_list
+
+    logger.info("Testing token revocation")
+    user = test_user["user"]
+
+    def login():
+        response = client.post(
+            "/api/v1/auth/login", json={"username": user.username, "password": test_user["password"]}
+        )
+        assert response.status_code == 200
+        return response.json()["access_token"]
+
+    def me(token):
+        return client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {token}"}).status_code
+
+    first, second = login(), login()
+    assert client.post("/api/v1/auth/logout", headers={"Authorization": f"Bearer {first}"}).status_code == 204
+    assert (me(first), me(second)) == (401, 200)
+
+    # Un altro worker vede la revoca alla prima sincronizzazione dalla tabella
+    other_worker = RevocationList(capacity=100, error_rate=0.001, session_factory=revocation_list.session_factory)
+    assert other_worker.sync() == 1
+    assert other_worker.is_revoked(jwt.get_unverified_claims(first))
+    assert not other_worker.is_revoked(jwt.get_unverified_claims(second))
+
+    assert client.post("/api/v1/auth/logout-all", headers={"Authorization": f"Bearer {second}"}).status_code == 204
+    assert me(second) == 401
+    assert other_worker.sync() == 1
+    assert other_worker.is_revoked(jwt.get_unverified_claims(second))
+    # I token emessi dopo la revoca restano validi
+    assert me(login()) == 200
+
+    # Stesso millisecondo della revoca o entro il margine di precisione: revocato
+    rules = RevocationList(capacity=100, error_rate=0.001)
+    rules.add_user("7", revoked_before=1000.0, expires=time.time() + 60)
+    assert rules.is_revoked({"sub": "7", "iat": 1000.0})
+    assert rules.is_revoked({"sub": "7", "iat": 1000.004})
+    assert not rules.is_revoked({"sub": "7", "iat": 1000.01})
+    logger.info("Token revocation test passed")
+
+def test_principal_cache(client, tmp_path):
+    """Test autenticazione senza checkout dal pool con il principal in cache, invalidato solo al commit"""
+    from datetime import datetime, timezone
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import QueuePool
+    from backend.app.main import app
+    from backend.app.core.security import create_access_token
+    from backend.app.models.base import Base, get_db
+    from backend.app.models.models import Tenant, User
+    from backend.app.services.principals import principal_cache
+
+    logger.info("Testing cached principal")
+    # Database su file con un pool vero: lo StaticPool dei test non farebbe checkout separati
+    engine = create_engine(f"sqlite:///{tmp_path / 'principals.db'}", poolclass=QueuePool,
+                           connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        tenant = Tenant(name="pool_tenant", active=True, created_at=datetime.now(timezone.utc))
+        db.add(tenant)
+        db.flush()
+        user = User(email="pool@example.com", username="pooluser", hashed_password="x",
+                    tenant_id=tenant.id, is_active=True, created_at=datetime.now(timezone.utc))
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    checkouts = []
+    event.listen(engine, "checkout", lambda *args: checkouts.append(1))
+
+    def engine_get_db():
+        with Session(engine) as db:
+            yield db
+
+    override = app.dependency_overrides[get_db]
+    factory = principal_cache.session_factory
+    app.dependency_overrides[get_db] = engine_get_db
+    principal_cache.session_factory = lambda: Session(engine)
+    headers = {"Authorization": f"Bearer {create_access_token(data={'sub': str(user_id)})}"}
+    try:
+        response = client.get("/api/v1/auth/me", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["user"]["username"] == "pooluser"
+        assert len(checkouts) == 1  # Caricamento del principal
+
+        checkouts.clear()
+        for _ in range(5):
+            assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+        assert checkouts == []
+        assert principal_cache.hits >= 5
+
+        # Disattivazione: flush senza commit e rollback non toccano la cache, il commit la invalida
+        with Session(engine) as db:
+            db.get(User, user_id).is_active = False
+            db.flush()
+            assert principal_cache.get(user_id) is not None
+            db.rollback()
+            assert principal_cache.get(user_id) is not None
+            db.get(User, user_id).is_active = False
+            db.commit()
+            assert principal_cache.get(user_id) is None
+        assert client.get("/api/v1/auth/me", headers=headers).status_code == 401
+    finally:
+        app.dependency_overrides[get_db] = override
+        principal_cache.session_factory = factory
+        engine.dispose()
+    logger.info("Principal cache test passed")
+
+
+def test_metrics_endpoint(client, test_user, monkeypatch):
+    """Test endpoint Prometheus: istogrammi per template della route e metriche delle cache"""
+    from backend.app.core.config import settings
+    from backend.app.core.metrics import metrics
+
+    logger.info("Testing metrics endpoint")
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+    metrics.clear()
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    for _ in range(3):
+        assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+    assert client.get("/api/v1/contacts/999999", headers=headers).status_code == 404
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'rubrica_http_request_duration_seconds_count{method="GET",route="/api/v1/auth/me",status="200"} 3' in body
+    # Il template, non il path con l'id
+    assert 'route="/api/v1/contacts/{contact_id}",status="404"' in body
+    assert 'rubrica_http_request_duration_seconds_bucket{method="GET",route="/api/v1/auth/me",status="200",le="+Inf"} 3' in body
+    assert 'rubrica_cache_hit_ratio{cache="principal"}' in body
+    assert "rubrica_password_hash_pending 0" in body
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
+    logger.info("Metrics endpoint test passed")
+
+
+def test_metrics_dead_thread_shards():
+    """Test shard dei thread terminati: sommate allo scrape e rimosse"""
+    import threading
+    from backend.app.core.metrics import Histogram
+
+    logger.info("Testing metrics shard reaping")
+    histogram = Histogram("test_seconds", "Test", ("kind",))
+    for _ in range(20):
+        worker = threading.Thread(target=histogram.observe, args=(0.01, "a"))
+        worker.start()
+        worker.join()
+    histogram.observe(0.01, "a")
+
+    assert histogram.count("a") == 21
+    assert histogram.shard_count() == 1  # Solo il thread corrente
+    histogram.observe(0.01, "a")
+    assert histogram.count("a") == 22
+    logger.info("Metrics shard reaping test passed")
@@ -1,3 +1,4 @@
+import json
 import pytest
 import logging
 from fastapi.testclient import TestClient
@@ -229,4 +230,947 @@ def test_error_cases(client, test_user):
         }
     )
     assert response.status_code == 422, "Invalid email validation test failed"
-    logger.info("All error cases tests passed")
\ No newline at end of file
+    logger.info("All error cases tests passed")
+
+
+def test_cursor_pagination(client, test_user):
+    """Test paginazione a cursore (keyset)"""
+    logger.info("Testing cursor pagination")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    for i in range(5):
+        response = client.post(
+            "/api/v1/contacts",
+            headers=headers,
+            json={"first_name": f"Name{i}", "last_name": "Cursor", "email": f"cursor{i}@example.com"}
+        )
+        assert response.status_code == 201, "Failed to create test contact"
+
+    # Prima pagina: nessun totale se non richiesto
+    response = client.get("/api/v1/contacts", headers=headers, params={"paginate": "cursor", "size": 2})
+    assert response.status_code == 200, f"Cursor pagination failed: {response.json()}"
+    data = response.json()
+    assert data["total"] is None
+    assert data["prev_cursor"] is None
+    assert [c["first_name"] for c in data["items"]] == ["Name0", "Name1"]
+
+    # Avanti fino all'ultima pagina
+    seen = [c["first_name"] for c in data["items"]]
+    while data["next_cursor"]:
+        data = client.get(
+            "/api/v1/contacts", headers=headers, params={"cursor": data["next_cursor"], "size": 2}
+        ).json()
+        seen.extend(c["first_name"] for c in data["items"])
+    assert seen == [f"Name{i}" for i in range(5)]
+
+    # Indietro dall'ultima pagina
+    data = client.get(
+        "/api/v1/contacts",
+        headers=headers,
+        params={"cursor": data["prev_cursor"], "size": 2, "include_total": True}
+    ).json()
+    assert [c["first_name"] for c in data["items"]] == ["Name2", "Name3"]
+    assert data["total"] == 5
+
+    # Cursore manomesso
+    response = client.get("/api/v1/contacts", headers=headers, params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400, "Invalid cursor should be rejected"
+    # Ben formati ma con valori del tipo sbagliato: 400, non un errore SQL
+    from backend.app.core.pagination import encode_cursor
+    for keys in (["Test", "Name1", "1"], ["Test", ["Name1"], 1], ["Test", "Name1", True], ["Test", "Name1"]):
+        response = client.get("/api/v1/contacts", headers=headers, params={"cursor": encode_cursor(keys)})
+        assert response.status_code == 400, f"Cursor {keys} should be rejected"
+    logger.info("Cursor pagination test passed")
+
+def test_search_index_follows_writes(client, test_user):
+    """Test ricerca tramite indice in memoria dopo create/update/delete"""
+    logger.info("Testing search index maintenance")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    contact_id = client.post(
+        "/api/v1/contacts",
+        headers=headers,
+        json={"first_name": "Trigram", "last_name": "Indexed", "email": "tg@example.com"}
+    ).json()["id"]
+
+    # La prima ricerca costruisce l'indice
+    response = client.get("/api/v1/contacts", headers=headers, params={"search": "rigr"})
+    assert response.status_code == 200, f"Search failed: {response.json()}"
+    assert [c["id"] for c in response.json()["items"]] == [contact_id]
+
+    # L'aggiornamento deve riflettersi sull'indice già costruito
+    client.put(f"/api/v1/contacts/{contact_id}", headers=headers, json={"first_name": "Renamed"})
+    assert client.get("/api/v1/contacts", headers=headers, params={"search": "rigr"}).json()["total"] == 0
+    response = client.post("/api/v1/contacts/search", headers=headers, json={"query": "RENAM"})
+    assert [c["id"] for c in response.json()] == [contact_id]
+
+    # Termine più corto di un trigramma
+    assert client.get("/api/v1/contacts", headers=headers, params={"search": "re"}).json()["total"] == 1
+
+    client.delete(f"/api/v1/contacts/{contact_id}", headers=headers)
+    response = client.post("/api/v1/contacts/search", headers=headers, json={"query": "renam"})
+    assert response.json() == []
+    logger.info("Search index maintenance test passed")
+
+
+def test_search_index_build_outside_lock():
+    """Test costruzione dell'indice fuori dal lock globale, con le modifiche arrivate nel frattempo"""
+    import threading
+    from types import SimpleNamespace
+    from backend.app.services.search_index import ContactSearchIndex, OwnerIndex
+
+    logger.info("Testing search index build outside the global lock")
+    started, release = threading.Event(), threading.Event()
+
+    class SlowIndex(ContactSearchIndex):
+        def _build(self, db, owner_id):
+            started.set()
+            assert release.wait(5)
+            index = OwnerIndex()
+            index.add(1, ("Vecchio", "Contatto", None, None))
+            return index
+
+    index = SlowIndex(memory_budget_bytes=1024 * 1024, ttl_seconds=60)
+    index._owners[2] = OwnerIndex()
+    builder = threading.Thread(target=index.get, args=(None, 1))
+    builder.start()
+    assert started.wait(5)
+
+    # Gli altri proprietari non aspettano la costruzione
+    assert index.get(None, 2) is index._owners[2]
+    index.upsert(SimpleNamespace(owner_id=1, id=2, first_name="Nuovo", last_name="Arrivato", email=None, phone=None))
+    index.remove(1, 1)
+    release.set()
+    builder.join(5)
+
+    assert index.get(None, 1).search("nuovo") == [2]
+    assert index.get(None, 1).search("vecchio") == []
+
+    # Una ricerca lunga sul proprietario 1 (lock del proprietario) non ferma le scritture del 2
+    with index._owners[1].lock:
+        writer = threading.Thread(target=index.upsert, args=(
+            SimpleNamespace(owner_id=2, id=3, first_name="Scrittura", last_name="Libera", email=None, phone=None),
+        ))
+        writer.start()
+        writer.join(5)
+        assert not writer.is_alive()
+    assert index.search(None, 2, "scrittura") == [3]
+    logger.info("Search index build outside lock test passed")
+
+
+def test_suggest_contacts(client, test_user):
+    """Test autocompletamento per prefisso"""
+    logger.info("Testing contact suggestions")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    for first, last, email in [
+        ("José", "Álvarez", "jose@example.com"),
+        ("Joanna", "Smith", "jo.smith@example.com"),
+        ("Mark", "Jones", None),
+    ]:
+        client.post(
+            "/api/v1/contacts",
+            headers=headers,
+            json={"first_name": first, "last_name": last, "email": email}
+        )
+
+    response = client.get("/api/v1/contacts/suggest", headers=headers, params={"q": "jo"})
+    assert response.status_code == 200, f"Suggest failed: {response.json()}"
+    names = [s["full_name"] for s in response.json()]
+    assert names == ["Joanna Smith", "Mark Jones", "José Álvarez"]
+
+    # Accenti ignorati, nome completo completabile
+    response = client.get("/api/v1/contacts/suggest", headers=headers, params={"q": "jose al"})
+    assert [s["field"] for s in response.json()] == ["full_name"]
+
+    # Aggiornamento incrementale dopo una scrittura
+    client.post("/api/v1/contacts", headers=headers, json={"first_name": "Jolanda", "last_name": "Neri"})
+    response = client.get("/api/v1/contacts/suggest", headers=headers, params={"q": "jol", "limit": 1})
+    assert [s["full_name"] for s in response.json()] == ["Jolanda Neri"]
+    logger.info("Contact suggestions test passed")
+
+
+def test_suggest_build_outside_lock():
+    """Test costruzione dell'indice di completamento fuori dal lock globale"""
+    import threading
+    from types import SimpleNamespace
+    from backend.app.services.suggest import OwnerSuggestions, SuggestIndex
+
+    logger.info("Testing suggest index build outside the global lock")
+    started, release = threading.Event(), threading.Event()
+
+    class SlowSuggestIndex(SuggestIndex):
+        def _build(self, db, owner_id):
+            started.set()
+            assert release.wait(5)
+            index = OwnerSuggestions()
+            index.bulk_load([(1, "Vecchio", "Contatto", None)])
+            return index
+
+    index = SlowSuggestIndex(max_owners=10, idle_seconds=60, ttl_seconds=60)
+    other = OwnerSuggestions()
+    other.add(5, "Altro", "Proprietario", None)
+    index._owners[2] = other
+    builder = threading.Thread(target=index.suggest, args=(None, 1, "v", 5))
+    builder.start()
+    assert started.wait(5)
+
+    # Gli altri proprietari e le scritture non aspettano la costruzione
+    assert [s["id"] for s in index.suggest(None, 2, "alt", 5)] == [5]
+    index.upsert(SimpleNamespace(owner_id=1, id=2, first_name="Nuovo", last_name="Arrivato", email=None))
+    index.remove(1, 1)
+    release.set()
+    builder.join(5)
+
+    assert [s["id"] for s in index.suggest(None, 1, "nuo", 5)] == [2]
+    assert index.suggest(None, 1, "vec", 5) == []
+    logger.info("Suggest index build outside lock test passed")
+
+
+def test_bulk_contacts(client, test_user):
+    """Test operazioni massive in una sola richiesta"""
+    logger.info("Testing bulk contacts operations")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    existing_id = client.post(
+        "/api/v1/contacts",
+        headers=headers,
+        json={"first_name": "Bulk", "last_name": "Existing", "email": "bulk.existing@example.com"}
+    ).json()["id"]
+    to_delete_id = client.post(
+        "/api/v1/contacts",
+        headers=headers,
+        json={"first_name": "Bulk", "last_name": "Delete", "email": "bulk.delete@example.com"}
+    ).json()["id"]
+
+    response = client.post(
+        "/api/v1/contacts/bulk",
+        headers=headers,
+        json=[
+            {"op": "create", "data": {"first_name": "Bulk1", "last_name": "New", "phone": "+39 333-1234"}},
+            {"op": "create", "data": {"first_name": "", "last_name": "Invalid"}},
+            {"op": "update", "id": existing_id, "data": {"favorite": True}},
+            {"op": "delete", "id": to_delete_id},
+            {"op": "delete", "id": 99999},
+            {"op": "unknown"},
+        ]
+    )
+    assert response.status_code == 200, f"Bulk operation failed: {response.json()}"
+    data = response.json()
+    assert [r["status"] for r in data["results"]] == [201, 422, 200, 204, 404, 422]
+    assert (data["created"], data["updated"], data["deleted"], data["failed"]) == (1, 1, 1, 3)
+
+    # Validatori di ContactCreate applicati anche in blocco
+    created = client.get(f"/api/v1/contacts/{data['results'][0]['id']}", headers=headers).json()
+    assert created["phone"] == "+39333-1234"
+    assert client.get(f"/api/v1/contacts/{existing_id}", headers=headers).json()["favorite"] is True
+    assert client.get(f"/api/v1/contacts/{to_delete_id}", headers=headers).status_code == 404
+    logger.info("Bulk contacts test passed")
+
+
+def test_bulk_row_rejected(client, test_user, monkeypatch):
+    """Test riga rifiutata dal database (eliminata nel frattempo): esito 409 per la riga, le altre applicate"""
+    from backend.app.services import contacts_bulk
+
+    logger.info("Testing bulk row rejected by the database")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    existing_id = client.post(
+        "/api/v1/contacts", headers=headers, json={"first_name": "Bulk", "last_name": "Stale"}
+    ).json()["id"]
+    gone_id = existing_id + 1000
+    existing = contacts_bulk._existing
+    # Il contatto gone_id esisteva alla verifica ed è stato eliminato prima dell'UPDATE
+    monkeypatch.setattr(
+        contacts_bulk, "_existing", lambda db, owner_id, ids: {**existing(db, owner_id, ids), gone_id: False}
+    )
+
+    response = client.post(
+        "/api/v1/contacts/bulk",
+        headers=headers,
+        json=[
+            {"op": "update", "id": existing_id, "data": {"favorite": True}},
+            {"op": "update", "id": gone_id, "data": {"favorite": True}},
+            {"op": "create", "data": {"first_name": "Bulk", "last_name": "Nuovo"}},
+        ]
+    )
+    assert response.status_code == 200, f"Bulk operation failed: {response.text}"
+    data = response.json()
+    assert [r["status"] for r in data["results"]] == [200, 409, 201]
+    assert data["results"][1]["error"] == "Contatto modificato o eliminato nel frattempo"
+    assert (data["created"], data["updated"], data["failed"]) == (1, 1, 1)
+    assert client.get(f"/api/v1/contacts/{existing_id}", headers=headers).json()["favorite"] is True
+    # I contatori contano solo le righe applicate
+    listing = client.get("/api/v1/contacts", headers=headers, params={"favorite": True}).json()
+    assert listing["total"] == 1
+    logger.info("Bulk row rejected test passed")
+
+
+def test_export_contacts(client, test_user):
+    """Test export in streaming (CSV, NDJSON, vCard)"""
+    logger.info("Testing contacts export")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    for first, favorite in [("Export1", True), ("Export2", False)]:
+        client.post(
+            "/api/v1/contacts",
+            headers=headers,
+            json={"first_name": first, "last_name": "Test, Jr.", "email": f"{first.lower()}@example.com", "favorite": favorite}
+        )
+
+    response = client.get("/api/v1/contacts/export", headers=headers, params={"format": "csv"})
+    assert response.status_code == 200, f"CSV export failed: {response.text}"
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,first_name,last_name")
+    assert len(lines) == 3
+
+    response = client.get(
+        "/api/v1/contacts/export", headers=headers, params={"format": "ndjson", "favorite": True}
+    )
+    assert [json.loads(line)["first_name"] for line in response.text.splitlines()] == ["Export1"]
+
+    # gzip: httpx decomprime in base a Content-Encoding
+    response = client.get(
+        "/api/v1/contacts/export", headers=headers, params={"format": "vcf", "search": "export2", "gzip": True}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text.count("BEGIN:VCARD") == 1
+    assert "N:Test\\, Jr.;Export2;;;" in response.text
+    logger.info("Contacts export test passed")
+
+def test_import_contacts(client, test_user):
+    """Test import in background con errori per riga"""
+    logger.info("Testing contacts import")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    csv_data = (
+        "first_name,last_name,email,phone,favorite\n"
+        "Import1,Test,import1@example.com,+39 333 1234567,true\n"
+        ",SenzaNome,,,\n"
+        "Import2,Test,not-an-email,,\n"
+        "Import3,Test,,,no\n"
+    )
+    # Upload multipart; TestClient esegue il job prima di restituire la risposta
+    response = client.post(
+        "/api/v1/contacts/import",
+        headers=headers,
+        params={"format": "csv"},
+        files={"file": ("contacts.csv", csv_data, "text/csv")}
+    )
+    assert response.status_code == 202, f"Import failed: {response.text}"
+    job_id = response.json()["id"]
+    assert response.headers["location"].endswith(f"/imports/{job_id}")
+
+    response = client.get(f"/api/v1/contacts/imports/{job_id}", headers=headers)
+    job = response.json()
+    assert job["status"] == "completed"
+    assert (job["processed"], job["inserted"], job["failed"]) == (4, 2, 2)
+    assert [e["row"] for e in job["errors"]] == [2, 3]
+
+    # Corpo grezzo: vCard prodotta dall'export
+    vcf = client.get("/api/v1/contacts/export", headers=headers, params={"format": "vcf"}).text
+    response = client.post(
+        "/api/v1/contacts/import", headers=headers, params={"format": "vcf"}, content=vcf.encode("utf-8")
+    )
+    job = client.get(f"/api/v1/contacts/imports/{response.json()['id']}", headers=headers).json()
+    assert (job["inserted"], job["failed"]) == (2, 0)
+
+    response = client.get("/api/v1/contacts", headers=headers, params={"search": "import1"})
+    assert response.json()["total"] == 2
+
+    response = client.get("/api/v1/contacts/imports/sconosciuto", headers=headers)
+    assert response.status_code == 404
+    logger.info("Contacts import test passed")
+
+
+def test_import_invalidates_per_batch(test_user, clean_db, monkeypatch):
+    """Test invalidazione di cache e indici dopo ogni lotto confermato, non solo a fine import"""
+    import io
+    from sqlalchemy.orm import Session
+    from backend.app.core.config import settings
+    from backend.app.services import contacts_import
+
+    logger.info("Testing import invalidation per batch")
+    monkeypatch.setattr(settings, "IMPORT_BATCH_SIZE", 2)
+    job = contacts_import.ImportJob(test_user["user"].id, "csv")
+    calls = []
+    monkeypatch.setattr(contacts_import, "_invalidate_owner", lambda owner_id: calls.append(job.inserted))
+    csv_data = (
+        "first_name,last_name,email,phone,favorite\n"
+        "Lotto1,Test,,,\n"
+        "Lotto2,Test,,,\n"
+        ",SenzaNome,,,\n"
+        ",SenzaNome,,,\n"
+        "Lotto3,Test,,,\n"
+    )
+    contacts_import.run_import(job, Session(bind=clean_db.connection()), io.BytesIO(csv_data.encode("utf-8")))
+
+    assert job.status == "completed"
+    # Il lotto senza righe valide non invalida
+    assert calls == [2, 3]
+    logger.info("Import invalidation per batch test passed")
+
+
+def test_import_fallback_visible_to_sync(client, test_user, clean_db, monkeypatch):
+    """Test righe dell'import riga per riga: updated_at al commit, quindi visibili alla sync incrementale"""
+    import io
+    import time
+    from datetime import datetime, timezone
+    from sqlalchemy.orm import Session
+    from backend.app.core.config import settings
+    from backend.app.services import contacts_import
+    from backend.app.services.sync import encode_sync_token
+
+    logger.info("Testing import fallback against delta sync")
+    monkeypatch.setattr(settings, "SYNC_CLOCK_SKEW_SECONDS", 0)
+    adjust_counters = contacts_import.adjust_counters
+    watermark = []
+
+    def flaky_adjust(db, owner_id, total, favorites):
+        if total > 1:
+            raise RuntimeError("lotto rifiutato")  # Forza il percorso riga per riga
+        adjust_counters(db, owner_id, total=total, favorites=favorites)
+        if not watermark:
+            # Un client sincronizza mentre le righe successive non sono ancora confermate
+            time.sleep(0.01)
+            watermark.append(datetime.now(timezone.utc).replace(tzinfo=None))
+            time.sleep(0.01)
+
+    monkeypatch.setattr(contacts_import, "adjust_counters", flaky_adjust)
+    job = contacts_import.ImportJob(test_user["user"].id, "csv")
+    csv_data = "first_name,last_name\nRiga1,Fallback\nRiga2,Fallback\nRiga3,Fallback\n"
+    # Savepoint: il rollback del lotto non deve annullare la transazione esterna del test
+    db = Session(bind=clean_db.connection(), join_transaction_mode="create_savepoint")
+    contacts_import.run_import(job, db, io.BytesIO(csv_data.encode("utf-8")))
+    assert (job.status, job.inserted) == ("completed", 3)
+
+    token = encode_sync_token((watermark[0], 0), (watermark[0], 0))
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    data = client.get("/api/v1/contacts/changes", headers=headers, params={"since": token}).json()
+    assert {c["first_name"] for c in data["upserts"]} == {"Riga2", "Riga3"}
+    logger.info("Import fallback delta sync test passed")
+
+
+def test_import_row_error_hides_driver_text(test_user, clean_db, monkeypatch):
+    """Test errori per riga dell'import: messaggio fisso, il testo del database resta nel log"""
+    import io
+    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy.orm import Session
+    from backend.app.services import contacts_import
+
+    logger.info("Testing import row errors without driver details")
+    adjust_counters = contacts_import.adjust_counters
+    rows = []
+
+    def failing_adjust(db, owner_id, total, favorites):
+        if total > 1:
+            raise RuntimeError("lotto rifiutato")
+        rows.append(owner_id)
+        if len(rows) == 2:
+            # La seconda riga viola un vincolo: il messaggio del driver non deve arrivare al client
+            raise IntegrityError("INSERT INTO contacts ...", {}, Exception("[ODBC] UQ_contacts_email violated"))
+        adjust_counters(db, owner_id, total=total, favorites=favorites)
+
+    monkeypatch.setattr(contacts_import, "adjust_counters", failing_adjust)
+    job = contacts_import.ImportJob(test_user["user"].id, "csv")
+    db = Session(bind=clean_db.connection(), join_transaction_mode="create_savepoint")
+    csv_data = "first_name,last_name\nRiga1,Errore\nRiga2,Errore\nRiga3,Errore\n"
+    contacts_import.run_import(job, db, io.BytesIO(csv_data.encode("utf-8")))
+
+    assert (job.inserted, job.failed) == (2, 1)
+    assert job.errors == [{"row": 2, "error": "Riga in conflitto con i dati esistenti"}]
+    logger.info("Import row error test passed")
+
+
+def test_conditional_requests(client, test_user):
+    """Test ETag, If-None-Match e If-Match"""
+    logger.info("Testing conditional requests")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    contact = client.post(
+        "/api/v1/contacts", headers=headers, json={"first_name": "Etag", "last_name": "Test"}
+    ).json()
+    url = f"/api/v1/contacts/{contact['id']}"
+
+    response = client.get(url, headers=headers)
+    etag = response.headers["etag"]
+    response = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    list_etag = client.get("/api/v1/contacts", headers=headers).headers["etag"]
+    response = client.get("/api/v1/contacts", headers={**headers, "If-None-Match": list_etag})
+    assert response.status_code == 304
+    # Parametri diversi, ETag diverso
+    response = client.get("/api/v1/contacts", headers={**headers, "If-None-Match": list_etag}, params={"size": 5})
+    assert response.status_code == 200
+
+    # If-Match con una versione vecchia: 412 e nessuna modifica
+    response = client.put(url, headers={**headers, "If-Match": etag}, json={"first_name": "Nuovo"})
+    assert response.status_code == 200, f"Conditional update failed: {response.text}"
+    new_etag = response.headers["etag"]
+    assert new_etag != etag
+    response = client.put(url, headers={**headers, "If-Match": etag}, json={"first_name": "Vecchio"})
+    assert response.status_code == 412
+    response = client.delete(url, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+
+    # La lista è cambiata, quindi niente 304
+    response = client.get("/api/v1/contacts", headers={**headers, "If-None-Match": list_etag})
+    assert response.status_code == 200
+
+    response = client.delete(url, headers={**headers, "If-Match": new_etag})
+    assert response.status_code == 204
+    logger.info("Conditional requests test passed")
+
+def test_contact_changes(client, test_user, clean_db):
+    """Test sincronizzazione incrementale con tombstone"""
+    logger.info("Testing contact changes sync")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    ids = [
+        client.post("/api/v1/contacts", headers=headers, json={"first_name": f"Sync{i}", "last_name": "Test"}).json()["id"]
+        for i in range(3)
+    ]
+
+    # Sincronizzazione completa a pagine da 2
+    seen, token, has_more = [], None, True
+    while has_more:
+        params = {"limit": 2, **({"since": token} if token else {})}
+        response = client.get("/api/v1/contacts/changes", headers=headers, params=params)
+        assert response.status_code == 200, f"Changes failed: {response.text}"
+        data = response.json()
+        seen += [c["id"] for c in data["upserts"]]
+        token, has_more = data["next_token"], data["has_more"]
+    assert set(ids) <= set(seen)
+
+    client.put(f"/api/v1/contacts/{ids[0]}", headers=headers, json={"favorite": True})
+    client.delete(f"/api/v1/contacts/{ids[1]}", headers=headers)
+    client.post("/api/v1/contacts/bulk", headers=headers, json=[{"op": "delete", "id": ids[2]}])
+
+    data = client.get("/api/v1/contacts/changes", headers=headers, params={"since": token}).json()
+    upserts = {c["id"]: c for c in data["upserts"]}
+    assert upserts[ids[0]]["favorite"] is True
+    assert ids[1] not in upserts and ids[2] not in upserts
+    assert set(data["deleted"]) == {ids[1], ids[2]}
+
+    response = client.get("/api/v1/contacts/changes", headers=headers, params={"since": "non-valido"})
+    assert response.status_code == 400
+
+    # Compattazione (task di background): solo le tombstone oltre la retention
+    from datetime import datetime, timedelta, timezone
+    from backend.app.core.config import settings
+    from backend.app.models.models import ContactTombstone
+    from backend.app.services.sync import compact_tombstones
+    old = datetime.now(timezone.utc) - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS + 1)
+    clean_db.query(ContactTombstone).filter(ContactTombstone.contact_id == ids[1]).update({"deleted_at": old})
+    clean_db.commit()
+    assert compact_tombstones(clean_db) == 1
+    assert clean_db.query(ContactTombstone).count() == 1
+    logger.info("Contact changes sync test passed")
+
+def test_contact_counters(client, test_user, clean_db):
+    """Test totali dai contatori e riconciliazione"""
+    from backend.app.models.models import ContactCounter
+    from backend.app.services.counters import reconcile_counters
+    from backend.app.services.response_cache import response_cache
+
+    logger.info("Testing contact counters")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    # La riga nasce con l'utente, non alla prima lettura
+    assert clean_db.get(ContactCounter, test_user["user"].id) is not None
+
+    def totals():
+        return [
+            client.get("/api/v1/contacts", headers=headers, params=params).json()["total"]
+            for params in ({}, {"favorite": True}, {"favorite": False})
+        ]
+
+    assert totals() == [0, 0, 0]
+    ids = [
+        client.post(
+            "/api/v1/contacts", headers=headers, json={"first_name": f"Count{i}", "last_name": "Test", "favorite": i == 0}
+        ).json()["id"]
+        for i in range(3)
+    ]
+    assert totals() == [3, 1, 2]
+
+    client.put(f"/api/v1/contacts/{ids[1]}", headers=headers, json={"favorite": True})
+    client.delete(f"/api/v1/contacts/{ids[0]}", headers=headers)
+    client.post("/api/v1/contacts/bulk", headers=headers, json=[
+        {"op": "create", "data": {"first_name": "Count3", "last_name": "Test", "favorite": True}},
+        {"op": "delete", "id": ids[2]}
+    ])
+    assert totals() == [2, 2, 0]
+
+    # Ricerca: COUNT limitato e segnalato come esatto sotto la soglia
+    data = client.get("/api/v1/contacts", headers=headers, params={"search": "count3"}).json()
+    assert (data["total"], data["total_exact"]) == (1, True)
+
+    # Una deriva viene corretta dalla riconciliazione
+    clean_db.query(ContactCounter).update({"total": 99})
+    clean_db.commit()
+    response_cache.clear()
+    assert totals()[0] == 99
+    assert reconcile_counters(clean_db) == 1
+    assert totals() == [2, 2, 0]
+
+    # Senza riga la lettura usa il COUNT e non scrive; la riconciliazione la ricrea
+    clean_db.query(ContactCounter).delete()
+    clean_db.commit()
+    response_cache.clear()
+    assert totals()[0] == 2
+    assert clean_db.query(ContactCounter).count() == 0
+    assert reconcile_counters(clean_db) == 1
+    assert clean_db.get(ContactCounter, test_user["user"].id).total == 2
+    logger.info("Contact counters test passed")
+
+def test_response_cache(client, test_user):
+    """Test cache delle risposte: hit, invalidazione dopo le scritture, 304"""
+    logger.info("Testing response cache")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+
+    contact_id = client.post(
+        "/api/v1/contacts", headers=headers, json={"first_name": "Cache", "last_name": "Test"}
+    ).json()["id"]
+
+    first = client.get("/api/v1/contacts", headers=headers)
+    second = client.get("/api/v1/contacts", headers=headers)
+    assert first.headers["X-Cache"] == "MISS" and second.headers["X-Cache"] == "HIT"
+    assert first.json() == second.json() and first.headers["ETag"] == second.headers["ETag"]
+
+    response = client.get("/api/v1/contacts", headers={**headers, "If-None-Match": second.headers["ETag"]})
+    assert response.status_code == 304
+
+    assert client.get(f"/api/v1/contacts/{contact_id}", headers=headers).headers["X-Cache"] == "MISS"
+    assert client.get(f"/api/v1/contacts/{contact_id}", headers=headers).headers["X-Cache"] == "HIT"
+    search = {"query": "cache"}
+    assert client.post("/api/v1/contacts/search", headers=headers, json=search).headers["X-Cache"] == "MISS"
+    assert client.post("/api/v1/contacts/search", headers=headers, json=search).headers["X-Cache"] == "HIT"
+
+    # Ogni scrittura rende irraggiungibili tutte le risposte del proprietario
+    client.put(f"/api/v1/contacts/{contact_id}", headers=headers, json={"first_name": "Cached"})
+    response = client.get(f"/api/v1/contacts/{contact_id}", headers=headers)
+    assert response.headers["X-Cache"] == "MISS" and response.json()["first_name"] == "Cached"
+    assert client.post("/api/v1/contacts/search", headers=headers, json=search).json()[0]["first_name"] == "Cached"
+
+    client.post("/api/v1/contacts", headers=headers, json={"first_name": "Cache2", "last_name": "Test"})
+    response = client.get("/api/v1/contacts", headers=headers)
+    assert response.headers["X-Cache"] == "MISS" and response.json()["total"] == 2
+
+    client.delete(f"/api/v1/contacts/{contact_id}", headers=headers)
+    assert client.get(f"/api/v1/contacts/{contact_id}", headers=headers).status_code == 404
+    assert client.get("/api/v1/contacts", headers=headers).json()["total"] == 1
+
+    # Generazioni limitate: una generazione dimenticata non rende raggiungibili risposte vecchie
+    from backend.app.services.response_cache import MemoryCacheBackend
+    backend = MemoryCacheBackend(max_entries=2)
+    old = backend.get_int("gen:1")
+    for owner in (1, 2, 3):
+        backend.incr(f"gen:{owner}")
+    assert len(backend._counters) == 2
+    assert backend.get_int("gen:1") not in (old, 1)
+    logger.info("Response cache test passed")
+
+def test_redis_cache_backend():
+    """Test del backend Redis contro un server RESP minimo in locale"""
+    import socketserver
+    import threading
+    from backend.app.services.response_cache import RedisCacheBackend, ResponseCache
+
+    logger.info("Testing Redis response cache backend")
+    data = {}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, value):
+            if value is None:
+                self.wfile.write(b"$-1\r\n")
+            elif isinstance(value, int):
+                self.wfile.write(b":%d\r\n" % value)
+            elif isinstance(value, list):
+                self.wfile.write(b"*%d\r\n" % len(value))
+                for item in value:
+                    self.reply(item)
+            else:
+                self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+        def handle(self):
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                name = args[0].upper()
+                if name in (b"AUTH", b"SELECT", b"SET"):
+                    if name == b"SET":
+                        data[args[1]] = args[2]
+                    self.wfile.write(b"+OK\r\n")
+                elif name == b"GET":
+                    self.reply(data.get(args[1]))
+                elif name == b"INCR":
+                    data[args[1]] = b"%d" % (int(data.get(args[1], 0)) + 1)
+                    self.reply(int(data[args[1]]))
+                elif name == b"SCAN":
+                    prefix = args[3].rstrip(b"*")
+                    self.reply([b"0", [k for k in data if k.startswith(prefix)]])
+                elif name == b"DEL":
+                    self.reply(sum(data.pop(k, None) is not None for k in args[1:]))
+                else:
+                    self.wfile.write(b"-ERR unknown command\r\n")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        host, port = server.server_address
+        cache = ResponseCache(RedisCacheBackend(f"redis://:secret@{host}:{port}/1"), ttl_seconds=30)
+
+        key, cached = cache.lookup(1, "list", [("page", 1)])
+        assert cached is None
+        cache.store(key, b'{"items": []}', '"abc"')
+        assert cache.lookup(1, "list", [("page", 1)])[1] == ('"abc"', b'{"items": []}')
+
+        cache.invalidate(1)
+        assert cache.lookup(1, "list", [("page", 1)])[1] is None
+
+        # Dagli handler async i comandi girano fuori dall'event loop
+        import asyncio
+        threads = []
+        command = cache.backend.command
+
+        def recording_command(*args):
+            threads.append(threading.current_thread())
+            return command(*args)
+
+        cache.backend.command = recording_command
+
+        async def lookup_from_loop():
+            await cache.invalidate_async(1)
+            return await cache.lookup_async(1, "list", [("page", 1)])
+
+        assert asyncio.run(lookup_from_loop())[1] is None
+        assert threads and threading.main_thread() not in threads
+        cache.backend.command = command
+        cache.clear()
+        assert data == {}
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Server non raggiungibile: la cache si comporta come un miss
+    cache = ResponseCache(RedisCacheBackend(f"redis://{host}:{port}", timeout=0.1), ttl_seconds=30)
+    assert cache.lookup(1, "list", [("page", 1)]) == (None, None)
+    assert cache.stats()["errors"] == 1
+    logger.info("Redis response cache backend test passed")
+
+def test_async_session_path(client, test_user):
+    """Test dei router su AsyncSession (driver aiosqlite)"""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+    from backend.app.main import app
+    from backend.app.models.base import Base, get_db_session
+
+    logger.info("Testing async session path")
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def override_get_db_session():
+        async with session_factory() as session:
+            yield session
+
+    # Tabelle create nell'event loop dell'app, dove girano le richieste
+    client.portal.call(create_tables)
+    app.dependency_overrides[get_db_session] = override_get_db_session
+    try:
+        headers = {"Authorization": f"Bearer {test_user['token']}"}
+        response = client.post(
+            "/api/v1/contacts", headers=headers, json={"first_name": "Async", "last_name": "Test", "favorite": True}
+        )
+        assert response.status_code == 201
+        contact_id = response.json()["id"]
+
+        data = client.get("/api/v1/contacts", headers=headers, params={"search": "async"}).json()
+        assert data["total"] == 1 and data["items"][0]["id"] == contact_id
+        data = client.get("/api/v1/contacts", headers=headers, params={"paginate": "cursor", "include_total": True}).json()
+        assert [c["id"] for c in data["items"]] == [contact_id]
+
+        response = client.put(f"/api/v1/contacts/{contact_id}", headers=headers, json={"first_name": "Asyncio"})
+        assert response.json()["first_name"] == "Asyncio"
+        assert client.get(f"/api/v1/contacts/{contact_id}", headers=headers).json()["first_name"] == "Asyncio"
+        assert len(client.post("/api/v1/contacts/search", headers=headers, json={"query": "asyncio"}).json()) == 1
+
+        assert client.delete(f"/api/v1/contacts/{contact_id}", headers=headers).status_code == 204
+        assert client.get(f"/api/v1/contacts/{contact_id}", headers=headers).status_code == 404
+        assert client.get("/api/v1/contacts/changes", headers=headers).json()["upserts"] == []
+    finally:
+        del app.dependency_overrides[get_db_session]
+        client.portal.call(engine.dispose)
+    logger.info("Async session path test passed")
+
+def test_threadpool_session_path(client, test_user, clean_db):
+    """Test della modalità threadpool: query nel pool dedicato e metriche della coda"""
+    import threading
+    from sqlalchemy import event
+    from backend.app.main import app
+    from backend.app.core.executor import BlockingExecutor
+    from backend.app.models.base import SyncSessionAdapter, get_db_session
+
+    logger.info("Testing threadpool session path")
+    executor = BlockingExecutor(max_workers=2)
+    threads = set()
+
+    def record_thread(conn, cursor, statement, params, context, executemany):
+        threads.add(threading.current_thread().name)
+
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    # Il principal si carica con run_blocking, che segue DB_THREADPOOL_ENABLED: qui si misura solo la sessione
+    assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+    engine = clean_db.get_bind().engine
+    event.listen(engine, "before_cursor_execute", record_thread)
+    app.dependency_overrides[get_db_session] = lambda: SyncSessionAdapter(clean_db, executor=executor)
+    try:
+        contact_id = client.post(
+            "/api/v1/contacts", headers=headers, json={"first_name": "Pool", "last_name": "Test"}
+        ).json()["id"]
+        data = client.get("/api/v1/contacts", headers=headers, params={"search": "pool"}).json()
+        assert [c["id"] for c in data["items"]] == [contact_id]
+        response = client.put(f"/api/v1/contacts/{contact_id}", headers=headers, json={"favorite": True})
+        assert response.json()["favorite"] is True
+        assert client.delete(f"/api/v1/contacts/{contact_id}", headers=headers).status_code == 204
+    finally:
+        del app.dependency_overrides[get_db_session]
+        event.remove(engine, "before_cursor_execute", record_thread)
+        executor.shutdown()
+
+    # Nessuna query sul thread dell'event loop
+    assert threads and all(name.startswith("blocking") for name in threads)
+    stats = executor.stats()
+    assert stats["completed"] > 0 and stats["queued"] == 0 and not stats["saturated"]
+    logger.info("Threadpool session path test passed")
+
+
+def test_threadpool_saturated_pool(tmp_path):
+    """Test pool di connessioni esaurito: chi ha già la connessione non resta in coda dietro ai checkout"""
+    import asyncio
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+    from sqlalchemy.pool import QueuePool
+    from backend.app.core.executor import BlockingExecutor
+    from backend.app.models.base import SyncSessionAdapter
+
+    logger.info("Testing threadpool with a saturated connection pool")
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=10
+    )
+    executor = BlockingExecutor(max_workers=1, reserved_workers=1)
+
+    async def scenario():
+        holder = SyncSessionAdapter(Session(engine), executor=executor)
+        await holder.execute(text("SELECT 1"))  # Prende l'unica connessione e la tiene tra gli await
+        waiting = [SyncSessionAdapter(Session(engine), executor=executor) for _ in range(3)]
+        # Occupano l'unico thread principale fermi nel checkout
+        queued = [asyncio.ensure_future(session.scalar(text("SELECT 1"))) for session in waiting]
+        await asyncio.sleep(0.1)
+        # Senza la corsia riservata: in coda dietro ai checkout fino al pool_timeout
+        assert await asyncio.wait_for(holder.scalar(text("SELECT 2")), 2) == 2
+        await asyncio.wait_for(holder.close(), 2)
+        for session in waiting:
+            assert await asyncio.wait_for(queued.pop(0), 5) == 1
+            await session.close()
+
+    try:
+        asyncio.run(scenario())
+        assert executor.stats()["reserved_workers"] == 1
+    finally:
+        executor.shutdown()
+        engine.dispose()
+    logger.info("Threadpool saturated pool test passed")
+
+
+def test_rate_limit(client, test_user, monkeypatch):
+    """Test token bucket per utente e header X-RateLimit-*"""
+    from backend.app.core.rate_limit import rate_limiter
+
+    logger.info("Testing rate limit")
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setattr(rate_limiter, "user_per_minute", 3)
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+
+    responses = [client.get("/api/v1/contacts", headers=headers) for _ in range(4)]
+    assert [r.status_code for r in responses] == [200, 200, 200, 429]
+    assert responses[0].headers["X-RateLimit-Limit"] == "3"
+    assert responses[0].headers["X-RateLimit-Remaining"] == "2"
+    assert int(responses[-1].headers["Retry-After"]) >= 1
+    assert client.get("/health").status_code == 200
+
+    # Un token con firma non valida non consuma il budget dell'utente del suo sub
+    header, payload, _ = test_user["token"].split(".")
+    forged = {"Authorization": f"Bearer {header}.{payload}.AAAA"}
+    assert client.get("/api/v1/contacts", headers=forged).status_code == 401
+    logger.info("Rate limit test passed")
+
+def test_query_stats(client, test_user, clean_db, monkeypatch, caplog):
+    """Test conteggio delle query per richiesta, log delle query lente e rilevamento N+1"""
+    from sqlalchemy import select
+    from backend.app.core.config import settings
+    from backend.app.core.query_stats import begin_request, normalize_sql, report_repeated
+    from backend.app.models.models import Contact
+
+    logger.info("Testing query instrumentation")
+    headers = {"Authorization": f"Bearer {test_user['token']}"}
+    monkeypatch.setattr(settings, "DB_QUERY_STATS_ENABLED", False)
+    response = client.get("/api/v1/contacts", headers=headers, params={"favorite": True})
+    assert "X-DB-Queries" not in response.headers
+    monkeypatch.setattr(settings, "DB_QUERY_STATS_ENABLED", True)
+    response = client.get("/api/v1/contacts", headers=headers)
+    assert response.status_code == 200
+    assert int(response.headers["X-DB-Queries"]) >= 1
+    assert float(response.headers["X-DB-Time"]) >= 0
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+    # Query lenta: loggata con l'SQL normalizzato, senza valori
+    monkeypatch.setattr(settings, "DB_SLOW_QUERY_MS", 0.000001)
+    with caplog.at_level(logging.WARNING, logger="app.core.query_stats"):
+        clean_db.execute(select(Contact.id).where(Contact.email == "secret@example.com")).all()
+    slow = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Slow query")]
+    assert slow and "secret@example.com" not in slow[0]
+    monkeypatch.setattr(settings, "DB_SLOW_QUERY_MS", 0)
+
+    assert normalize_sql("SELECT * FROM c WHERE id IN (?, ?, ?) AND name = 'x'  LIMIT 10") == \
+        "SELECT * FROM c WHERE id IN (?...) AND name = ? LIMIT ?"
+
+    # Stesso statement ripetuto (una query per riga): segnalato come N+1
+    monkeypatch.setattr(settings, "DB_N_PLUS_ONE_THRESHOLD", 3)
+    stats = begin_request()
+    for contact_id in range(3):
+        clean_db.execute(select(Contact).where(Contact.id == contact_id)).all()
+    assert stats.count == 3 and len(stats.repeated(3)) == 1
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="app.core.query_stats"):
+        report_repeated(stats, "GET", "/api/v1/contacts")
+    assert any("Possible N+1" in r.getMessage() for r in caplog.records)
+    logger.info("Query instrumentation test passed")
+
+
+def test_rate_limit_blocking_backend():
+    """Test backend del limitatore con I/O bloccante (Redis): chiamato fuori dall'event loop"""
+    import asyncio
+    import threading
+    from backend.app.core.rate_limit import BucketState, RateLimiter
+
+    logger.info("Testing blocking rate limit backend")
+    threads = []
+
+    class RecordingBackend:
+        blocking = True
+
+        def consume(self, key, capacity, rate):
+            threads.append(threading.current_thread())
+            return BucketState(True, capacity - 1, 0.0, 1.0)
+
+    limiter = RateLimiter(RecordingBackend(), user_per_minute=5, ip_per_minute=10,
+                          login_per_minute=2, register_per_minute=2)
+    state, limit = asyncio.run(limiter.check_async("/api/v1/contacts", "127.0.0.1", "1"))
+    assert state.allowed and limit == 5
+    assert len(threads) == 2 and threading.main_thread() not in threads
+    logger.info("Blocking rate limit backend test passed")
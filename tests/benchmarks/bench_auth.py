@@ -0,0 +1,101 @@
+# tests/benchmarks/bench_auth.py
+"""
+Costo per richiesta della dipendenza di autenticazione: decodifica JWT con
+python-jose a ogni chiamata, require_auth con il token già in cache e
+require_auth su token sempre nuovi (miss). Misura anche GET /auth/me
+end-to-end con il cache attivo e svuotato prima di ogni richiesta.
+"""
+import asyncio
+import statistics
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from common import base_parser, make_engine, print_table, seed_owner
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.main import app
+from app.core.config import settings
+from app.core.rate_limit import rate_limiter
+from app.core.secret_provider import secret_provider
+from app.core.security import create_access_token, get_token_claims, require_auth, token_cache
+from app.models.base import get_db
+
+
+def per_call_us(fn, calls: int, repeat: int) -> float:
+    """Mediana in microsecondi per chiamata"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        samples.append((time.perf_counter() - start) / calls * 1e6)
+    return statistics.median(samples)
+
+
+async def resolve(token: str) -> int:
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return await require_auth(await get_token_claims(credentials))
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--calls", type=int, default=2000, help="Chiamate per ripetizione")
+    parser.add_argument("--requests", type=int, default=300, help="Richieste HTTP per ripetizione")
+    args = parser.parse_args()
+    repeat = min(args.repeat, 10)
+
+    token = create_access_token({"sub": "1"})
+    fresh = [create_access_token({"sub": str(i)}) for i in range(args.calls * repeat)]
+    fresh_iter = iter(fresh)
+    loop = asyncio.new_event_loop()
+
+    rows = [(
+        "jwt.decode (python-jose)",
+        per_call_us(lambda: jwt.decode(token, secret_provider.signing_keys().current_key, algorithms=[settings.ALGORITHM]),
+                    args.calls, repeat),
+    )]
+    token_cache.clear()
+    loop.run_until_complete(resolve(token))
+    rows.append(("require_auth, hit", per_call_us(lambda: loop.run_until_complete(resolve(token)),
+                                                  args.calls, repeat)))
+    token_cache.clear()
+    rows.append(("require_auth, miss", per_call_us(lambda: loop.run_until_complete(resolve(next(fresh_iter))),
+                                                   args.calls, repeat)))
+    loop.close()
+
+    engine = make_engine(args.url)
+    SessionBench = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    _, owner_token = seed_owner(engine, 0)
+
+    def override_get_db():
+        db = SessionBench()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    rate_limiter.enabled = False
+    headers = {"Authorization": f"Bearer {owner_token}"}
+    with TestClient(app) as client:
+        def me():
+            assert client.get("/api/v1/auth/me", headers=headers).status_code == 200
+
+        token_cache.clear()
+        rows.append(("GET /auth/me, cache", per_call_us(me, args.requests, repeat)))
+
+        def me_uncached():
+            token_cache.clear()
+            me()
+
+        rows.append(("GET /auth/me, senza cache", per_call_us(me_uncached, args.requests, repeat)))
+
+    print_table(("percorso", "µs/chiamata"), rows)
+    print(f"Cache: {token_cache.hits} hit, {token_cache.misses} miss")
+
+
+if __name__ == "__main__":
+    main()
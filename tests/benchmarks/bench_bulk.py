@@ -0,0 +1,77 @@
+# tests/benchmarks/bench_bulk.py
+"""
+Righe al secondo scritte con gli endpoint singoli (una richiesta e un
+commit per contatto) e con POST /api/v1/contacts/bulk (un lotto per
+richiesta, una transazione).
+"""
+import time
+
+from common import base_parser, make_engine, make_client, seed_owner, contact_rows, print_table
+from app.models.base import chunks
+
+FIELDS = ("first_name", "last_name", "email", "phone", "favorite")
+
+
+def rate(n: int, fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--rows", type=int, default=2000, help="Righe per operazione")
+    parser.add_argument("--batch", type=int, default=1000, help="Operazioni per richiesta bulk")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    client = make_client(engine)
+    results = {}
+
+    for mode in ("singolo", "bulk"):
+        owner_id, token = seed_owner(engine, 0, username=f"bench_{mode}")
+        headers = {"Authorization": f"Bearer {token}"}
+        payloads = [
+            {k: row[k] for k in FIELDS}
+            for row in contact_rows(owner_id, args.rows, seed=len(mode))
+        ]
+        ids = []
+
+        if mode == "singolo":
+            def create():
+                for payload in payloads:
+                    ids.append(client.post("/api/v1/contacts", headers=headers, json=payload).json()["id"])
+
+            def update():
+                for contact_id in ids:
+                    client.put(f"/api/v1/contacts/{contact_id}", headers=headers, json={"favorite": True})
+
+            def remove():
+                for contact_id in ids:
+                    client.delete(f"/api/v1/contacts/{contact_id}", headers=headers)
+        else:
+            def send(ops):
+                for batch in chunks(ops, args.batch):
+                    yield from client.post("/api/v1/contacts/bulk", headers=headers, json=batch).json()["results"]
+
+            def create():
+                ids.extend(r["id"] for r in send([{"op": "create", "data": p} for p in payloads]))
+
+            def update():
+                list(send([{"op": "update", "id": i, "data": {"favorite": True}} for i in ids]))
+
+            def remove():
+                list(send([{"op": "delete", "id": i} for i in ids]))
+
+        results[mode] = [rate(args.rows, create), rate(args.rows, update), rate(args.rows, remove)]
+
+    rows = [
+        (op, results["singolo"][n], results["bulk"][n], results["bulk"][n] / results["singolo"][n])
+        for n, op in enumerate(("create", "update", "delete"))
+    ]
+    print(f"\nScritture - {args.rows} righe, lotti da {args.batch}, {engine.dialect.name} (righe/s)")
+    print_table(("operazione", "singolo", "bulk", "speedup"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# tests/benchmarks/bench_concurrency.py
+"""
+Throughput di GET /api/v1/contacts/{id} con N richieste concorrenti su un
+solo event loop (come uvicorn con workers=1), con la Session sincrona, con
+la Session sincrona nel pool dedicato (threadpool) e con AsyncSession.
+Ogni statement SQL attende --latency-ms per simulare un database remoto
+lento: con la Session sincrona l'attesa blocca l'event loop, negli altri
+due casi le altre richieste proseguono.
+Richiede aiosqlite per la modalità async.
+"""
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import await_only
+
+from common import base_parser, make_engine, seed_owner, print_table
+from app.main import app
+from app.core.executor import BlockingExecutor
+from app.models.base import SyncSessionAdapter, get_db_session
+from app.services.response_cache import response_cache
+
+
+def add_latency(engine, seconds: float, blocking: bool) -> None:
+    """Ritardo prima di ogni statement: time.sleep (driver sincrono) o asyncio.sleep (driver async)"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def slow_down(conn, cursor, statement, params, context, executemany):
+        if blocking:
+            time.sleep(seconds)
+        else:
+            await_only(asyncio.sleep(seconds))
+
+
+def override_session(mode: str, engine, latency: float, workers: int):
+    """Restituisce le risorse da chiudere a fine misura"""
+    if mode in ("sync", "threadpool"):
+        executor = None
+        if mode == "threadpool":
+            # Una connessione per thread: la StaticPool dell'engine di seed non è condivisibile
+            engine = create_engine(engine.url, pool_size=workers, connect_args={"check_same_thread": False})
+            executor = BlockingExecutor(max_workers=workers)
+        add_latency(engine, latency, blocking=True)
+        SessionBench = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+        def sync_session():
+            db = SessionBench()
+            try:
+                yield SyncSessionAdapter(db, executor=executor)
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db_session] = sync_session
+        return executor
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{engine.url.database}")
+    add_latency(async_engine.sync_engine, latency, blocking=False)
+    SessionBench = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def async_session():
+        async with SessionBench() as db:
+            yield db
+
+    app.dependency_overrides[get_db_session] = async_session
+    return async_engine
+
+
+async def run_load(headers: dict, ids: list, concurrency: int, requests: int):
+    """Throughput (req/s) e latenze p50/p95 in ms con `concurrency` richieste in volo"""
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(n: int):
+            for i in range(n, requests, concurrency):
+                start = time.perf_counter()
+                response = await client.get(f"/api/v1/contacts/{ids[i % len(ids)]}", headers=headers)
+                assert response.status_code == 200, response.text
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200, help="Richieste per livello di concorrenza")
+    parser.add_argument("--concurrency", default="1,8,32", help="Livelli di concorrenza separati da virgola")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Attesa simulata per statement")
+    parser.add_argument("--modes", default="sync,threadpool,async")
+    parser.add_argument("--workers", type=int, default=15, help="Thread del pool (DB_POOL_SIZE + DB_MAX_OVERFLOW)")
+    args = parser.parse_args()
+
+    # Ogni richiesta deve arrivare al database
+    response_cache.backend = None
+
+    rows = []
+    for mode in args.modes.split(","):
+        engine = make_engine(args.url)
+        owner_id, token = seed_owner(engine, args.contacts, username=f"bench_{mode}")
+        with engine.connect() as conn:
+            ids = [row[0] for row in conn.exec_driver_sql("SELECT id FROM contacts")]
+        resource = override_session(mode, engine, args.latency_ms / 1000, args.workers)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            throughput, p50, p95 = asyncio.run(run_load(headers, ids, concurrency, args.requests))
+            queued = resource.stats()["max_queued"] if isinstance(resource, BlockingExecutor) else "-"
+            rows.append((mode, concurrency, throughput, p50, p95, queued))
+        if isinstance(resource, BlockingExecutor):
+            resource.shutdown()
+        elif resource is not None:
+            asyncio.run(resource.dispose())
+
+    print_table(("modalità", "concorrenza", "req/s", "p50 ms", "p95 ms", "coda max"), rows)
+
+
+if __name__ == "__main__":
+    main()
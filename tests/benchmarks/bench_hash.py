@@ -0,0 +1,84 @@
+# tests/benchmarks/bench_hash.py
+"""
+Latenza di verifica e throughput degli schemi di hash delle password su
+questo host, per ogni costo, e costo che la calibrazione sceglierebbe per
+--target-ms. Serve a scegliere PASSWORD_HASH_SCHEMES e
+PASSWORD_HASH_TARGET_MS per un piano App Service.
+"""
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import base_parser, print_table
+from app.core.hash_policy import (
+    HANDLERS,
+    available_schemes,
+    calibrate_argon2,
+    calibrate_bcrypt,
+)
+
+PASSWORD = "Bench123!"
+
+
+def handler_for(scheme: str, cost: int, memory_kib: int):
+    if scheme == "bcrypt":
+        return HANDLERS["bcrypt"].using(rounds=cost)
+    return HANDLERS["argon2"].using(rounds=cost, memory_cost=memory_kib, parallelism=1)
+
+
+def verify_many(scheme: str, cost: int, memory_kib: int, hashed: str, n: int) -> int:
+    handler = handler_for(scheme, cost, memory_kib)
+    for _ in range(n):
+        handler.verify(PASSWORD, hashed)
+    return n
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--schemes", default="bcrypt,argon2")
+    parser.add_argument("--bcrypt-costs", default="10,11,12,13")
+    parser.add_argument("--argon2-costs", default="2,3,4,6")
+    parser.add_argument("--argon2-memory-kib", type=int, default=19456)
+    parser.add_argument("--processes", type=int, default=0, help="Processi per il throughput (default: core)")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    args = parser.parse_args()
+    repeat = min(args.repeat, 10)
+
+    schemes = available_schemes(args.schemes.split(","))
+    costs = {"bcrypt": args.bcrypt_costs, "argon2": args.argon2_costs}
+    rows = []
+    processes = args.processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for scheme in schemes:
+            for cost in (int(c) for c in costs[scheme].split(",")):
+                handler = handler_for(scheme, cost, args.argon2_memory_kib)
+                hashed = handler.hash(PASSWORD)
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    handler.verify(PASSWORD, hashed)
+                    samples.append((time.perf_counter() - start) * 1000)
+                samples.sort()
+
+                per_process = max(1, repeat // 2)
+                start = time.perf_counter()
+                done = sum(pool.map(
+                    verify_many,
+                    *zip(*[(scheme, cost, args.argon2_memory_kib, hashed, per_process)] * processes)
+                ))
+                throughput = done / (time.perf_counter() - start)
+                rows.append((scheme, cost, statistics.median(samples), samples[-1], 1000 / statistics.median(samples), throughput))
+
+    print_table(("schema", "costo", "p50 ms", "max ms", "verifiche/s (1 core)", f"verifiche/s ({processes} proc)"), rows)
+
+    print(f"Costo calibrato per {args.target_ms:.0f} ms:")
+    if "bcrypt" in schemes:
+        print(f"  bcrypt rounds = {calibrate_bcrypt(args.target_ms)}")
+    if "argon2" in schemes:
+        print(f"  argon2 time_cost = {calibrate_argon2(args.target_ms, args.argon2_memory_kib)} "
+              f"(memory {args.argon2_memory_kib} KiB)")
+
+
+if __name__ == "__main__":
+    main()
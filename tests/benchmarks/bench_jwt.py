@@ -0,0 +1,63 @@
+# tests/benchmarks/bench_jwt.py
+"""
+Codifiche e verifiche JWT al secondo per ogni codec (JWT_BACKEND e
+ALGORITHM): python-jose HS256 come riferimento, codec nativo HS256 con
+chiave pre-caricata, EdDSA ed ES256 con oggetti chiave cryptography.
+"""
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+from common import base_parser, print_table
+from app.core.jwt_codec import create_codec
+from app.core.secret_provider import SigningKeys
+
+CLAIMS = {"sub": "42", "env": "bench", "exp": 9999999999, "iat": 1700000000}
+
+
+def pem(private_key) -> str:
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+def ops_per_second(fn, calls: int, repeat: int) -> float:
+    """Migliore di `repeat` misure da `calls` chiamate"""
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = max(best, calls / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--calls", type=int, default=5000, help="Chiamate per misura")
+    args = parser.parse_args()
+    repeat = min(args.repeat, 5)
+
+    hmac_keys = SigningKeys("k1", {"k1": "chiave-di-benchmark-di-almeno-32-byte"})
+    backends = [
+        ("jose", "HS256", hmac_keys),
+        ("native", "HS256", hmac_keys),
+        ("native", "EdDSA", SigningKeys("k1", {"k1": pem(ed25519.Ed25519PrivateKey.generate())})),
+        ("native", "ES256", SigningKeys("k1", {"k1": pem(ec.generate_private_key(ec.SECP256R1()))})),
+    ]
+
+    rows = []
+    for backend, algorithm, keys in backends:
+        codec = create_codec(backend, algorithm, keys)
+        token = codec.encode(CLAIMS)
+        assert codec.decode(token)["sub"] == "42"
+        encode = ops_per_second(lambda: codec.encode(CLAIMS), args.calls, repeat)
+        decode = ops_per_second(lambda: codec.decode(token), args.calls, repeat)
+        rows.append((backend, algorithm, encode, decode, 1e6 / decode, len(token)))
+
+    print_table(("backend", "algoritmo", "encode/s", "decode/s", "µs/decode", "byte token"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# tests/benchmarks/bench_logging.py
+"""
+Costo del logging per chiamata e per richiesta: f-string contro argomenti
+%-style con DEBUG disattivo, scrittura sincrona su stream contro coda con
+QueueListener, campionamento. La parte end-to-end misura GET
+/api/v1/contacts con ciascuna configurazione del root logger.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import time
+
+from common import base_parser, make_client, make_engine, measure, print_table, seed_owner
+from app.core.logging_config import TEXT_FORMAT, DeferredQueueHandler, JsonFormatter, SamplingFilter
+from app.core.rate_limit import rate_limiter
+
+PAYLOAD = {"sub": "42", "env": "development", "exp": 1700000000, "iat": 1699998200}
+
+
+def per_call_us(fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def install(mode: str, path: str, formatter: logging.Formatter):
+    """Configura il root logger come prima (sync) o dopo (queue) e restituisce il listener da fermare"""
+    stream = logging.StreamHandler(open(path, "a", encoding="utf-8"))
+    stream.setFormatter(formatter)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    if mode == "sync":
+        root.handlers = [stream]
+        return None
+    log_queue = queue.SimpleQueue()
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--contacts", type=int, default=1000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="rubrica-bench-"), "app.log")
+    logger = logging.getLogger("bench.hot")
+    token = "eyJhbGciOiJIUzI1NiJ9." * 8
+
+    rows = []
+    install("sync", path, logging.Formatter(TEXT_FORMAT))
+    rows.append(("debug f-string + json.dumps (DEBUG off)", per_call_us(
+        lambda: logger.debug(f"Token payload: {json.dumps(PAYLOAD, indent=2)} token={token}"), args.calls)))
+    rows.append(("debug %-style (DEBUG off)", per_call_us(
+        lambda: logger.debug("Token payload: %s token=%s", PAYLOAD, token), args.calls)))
+    for mode in ("sync", "queue"):
+        for label, formatter in (("text", logging.Formatter(TEXT_FORMAT)), ("json", JsonFormatter())):
+            listener = install(mode, path, formatter)
+            rows.append((f"info {label}, {mode}", per_call_us(
+                lambda: logger.info("Contact updated: %s", 42, extra={"owner_id": 7}), args.calls)))
+            if listener:
+                listener.stop()
+    listener = install("queue", path, logging.Formatter(TEXT_FORMAT))
+    sampling = SamplingFilter(10)
+    logger.addFilter(sampling)
+    rows.append(("info text, queue, 1 su 10", per_call_us(lambda: logger.info("Contact updated: %s", 42), args.calls)))
+    logger.removeFilter(sampling)
+    listener.stop()
+    print_table(("chiamata", "µs"), rows)
+
+    engine = make_engine(args.url)
+    _, token = seed_owner(engine, args.contacts)
+    headers = {"Authorization": f"Bearer {token}"}
+    rate_limiter.enabled = False
+    requests = []
+    with make_client(engine) as client:
+        for mode in ("sync", "queue"):
+            listener = install(mode, path, logging.Formatter(TEXT_FORMAT))
+            stats = measure(lambda: client.get("/api/v1/contacts", headers=headers), args.repeat)
+            requests.append((mode, stats["p50"], stats["p95"]))
+            if listener:
+                listener.stop()
+    print_table(("GET /api/v1/contacts", "p50 ms", "p95 ms"), requests)
+
+
+if __name__ == "__main__":
+    main()
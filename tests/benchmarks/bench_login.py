@@ -0,0 +1,97 @@
+# tests/benchmarks/bench_login.py
+"""
+Login al secondo con POST /api/v1/auth/login al variare dei processi del
+pool di hash (PASSWORD_HASH_WORKERS). Tutte le richieste partono insieme su
+un solo event loop: con 0 processi bcrypt gira nel processo dell'API,
+con N processi scala fino al numero di core.
+"""
+import asyncio
+import os
+import time
+
+import httpx
+from sqlalchemy.orm import sessionmaker
+
+from common import base_parser, make_engine, print_table
+from app.main import app
+from app.core.hashing import password_hasher
+from app.core.security import get_password_hash
+from app.models.base import get_db
+from app.models.models import Tenant, User
+
+PASSWORD = "Bench123!"
+
+
+def seed_users(engine, n: int) -> None:
+    hashed = get_password_hash(PASSWORD)
+    SessionBench = sessionmaker(bind=engine)
+    with SessionBench() as db:
+        tenant = Tenant(name="bench_login", active=True)
+        db.add(tenant)
+        db.flush()
+        db.add_all(
+            User(email=f"login{i}@example.com", username=f"login{i}", hashed_password=hashed,
+                 tenant_id=tenant.id, is_active=True)
+            for i in range(n)
+        )
+        db.commit()
+
+
+async def run_logins(users: int, requests: int):
+    statuses = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def login(i: int):
+            response = await client.post(
+                "/api/v1/auth/login", json={"username": f"login{i % users}", "password": PASSWORD}
+            )
+            statuses.append(response.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    return statuses.count(200) / elapsed, statuses.count(503)
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=32, help="Login concorrenti per misura")
+    parser.add_argument("--workers", default=None, help="Processi da provare (default: 0,1,2,...,core)")
+    parser.add_argument("--max-pending", type=int, default=1000, help="Soglia oltre la quale si risponde 503")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    workers = [int(w) for w in args.workers.split(",")] if args.workers else [0] + [
+        n for n in (1, 2, 4, 8, 16) if n < cores
+    ] + [cores]
+
+    engine = make_engine(args.url)
+    seed_users(engine, args.users)
+    SessionBench = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    def override_get_db():
+        db = SessionBench()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    password_hasher.max_pending = args.max_pending
+
+    rows = []
+    for n in sorted(set(workers)):
+        password_hasher.shutdown()
+        password_hasher.workers = n
+        # Avvio dei processi fuori dalla misura
+        asyncio.run(run_logins(args.users, n or 1))
+        rate, rejected = asyncio.run(run_logins(args.users, args.requests))
+        rows.append((n, cores, rate, rejected))
+    password_hasher.shutdown()
+
+    print_table(("processi", "core", "login/s", "503"), rows)
+
+
+if __name__ == "__main__":
+    main()
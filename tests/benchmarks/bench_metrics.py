@@ -0,0 +1,76 @@
+# tests/benchmarks/bench_metrics.py
+"""
+Costo della raccolta delle metriche: observe dell'istogramma a shard per
+thread contro lo stesso istogramma protetto da un lock, con 1 e più
+thread, e GET /api/v1/contacts con METRICS_ENABLED spento e acceso.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import base_parser, make_client, make_engine, measure, print_table, seed_owner
+from app.core.config import settings
+from app.core.metrics import Histogram
+from app.core.rate_limit import rate_limiter
+
+
+class LockedHistogram(Histogram):
+    """Riferimento: una sola serie condivisa, aggiornata sotto lock"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._series = {}
+        self._write_lock = threading.Lock()
+
+    def _shard(self):
+        return self._series
+
+    def observe(self, value, *labels):
+        with self._write_lock:
+            super().observe(value, *labels)
+
+
+def per_observe_ns(histogram: Histogram, threads: int, observations: int) -> float:
+    labels = ("GET", "/api/v1/contacts/{contact_id}", "200")
+
+    def work():
+        for i in range(observations):
+            histogram.observe((i % 100) / 1000, *labels)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(threads):
+            pool.submit(work)
+    return (time.perf_counter() - start) / (threads * observations) * 1e9
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--observations", type=int, default=200000)
+    parser.add_argument("--contacts", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = []
+    for threads in (1, 4):
+        for name, cls in (("shard per thread", Histogram), ("lock", LockedHistogram)):
+            histogram = cls("bench", "", ("method", "route", "status"))
+            rows.append((name, threads, per_observe_ns(histogram, threads, args.observations)))
+    print_table(("istogramma", "thread", "ns/observe"), rows)
+
+    engine = make_engine(args.url)
+    _, token = seed_owner(engine, args.contacts)
+    headers = {"Authorization": f"Bearer {token}"}
+    rate_limiter.enabled = False
+    requests = []
+    with make_client(engine) as client:
+        for enabled in (False, True):
+            settings.METRICS_ENABLED = enabled
+            stats = measure(lambda: client.get("/api/v1/contacts", headers=headers), args.repeat)
+            requests.append(("on" if enabled else "off", stats["p50"], stats["p95"]))
+        scrape = measure(lambda: client.get("/metrics"), args.repeat)
+    print_table(("METRICS_ENABLED", "p50 ms", "p95 ms"), requests)
+    print(f"GET /metrics: p50 {scrape['p50']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# tests/benchmarks/bench_pagination.py
+"""
+Confronta la latenza delle pagine profonde di GET /api/v1/contacts
+tra la paginazione classica (OFFSET + COUNT) e quella a cursore (keyset).
+"""
+from sqlalchemy.orm import sessionmaker
+
+from common import base_parser, make_engine, make_client, seed_owner, measure, print_table
+from app.api.v1.contacts import CONTACT_SORT_KEY, _contact_sort_values
+from app.core.pagination import encode_cursor
+from app.models.models import Contact
+
+
+def cursor_at(engine, owner_id: int, offset: int) -> str:
+    """Cursore equivalente a una pagina che inizia dopo `offset` righe"""
+    if offset == 0:
+        return ""
+    with sessionmaker(bind=engine)() as db:
+        contact = db.query(Contact).filter(Contact.owner_id == owner_id)\
+                    .order_by(*CONTACT_SORT_KEY).offset(offset - 1).limit(1).one()
+        return encode_cursor(_contact_sort_values(contact))
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--contacts", type=int, default=50000, help="Contatti del proprietario")
+    parser.add_argument("--size", type=int, default=10, help="Elementi per pagina")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    owner_id, token = seed_owner(engine, args.contacts)
+    client = make_client(engine)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    last_page = (args.contacts + args.size - 1) // args.size
+    depths = sorted({p for p in (1, 10, 100, 1000, last_page // 2, last_page) if 1 <= p <= last_page})
+
+    rows = []
+    for page in depths:
+        page_stats = measure(
+            lambda: client.get("/api/v1/contacts", headers=headers, params={"page": page, "size": args.size}),
+            args.repeat
+        )
+        cursor = cursor_at(engine, owner_id, (page - 1) * args.size)
+        cursor_stats = measure(
+            lambda: client.get(
+                "/api/v1/contacts",
+                headers=headers,
+                params={"paginate": "cursor", "cursor": cursor, "size": args.size}
+            ),
+            args.repeat
+        )
+        rows.append((
+            page,
+            page_stats["p50"], page_stats["p95"],
+            cursor_stats["p50"], cursor_stats["p95"],
+            page_stats["p50"] / cursor_stats["p50"]
+        ))
+
+    print(f"\nGET /contacts - {args.contacts} contatti, size={args.size}, {engine.dialect.name} (ms)")
+    print_table(("page", "offset p50", "offset p95", "cursor p50", "cursor p95", "speedup"), rows)
+
+
+if __name__ == "__main__":
+    main()
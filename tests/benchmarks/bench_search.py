@@ -0,0 +1,70 @@
+# tests/benchmarks/bench_search.py
+"""
+Confronta la ricerca per sottostringa sui contatti tra il percorso LIKE
+(scansione delle righe del proprietario) e l'indice a trigrammi in memoria
+seguito dal recupero per chiave primaria.
+"""
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from common import base_parser, make_engine, seed_owner, measure, print_table
+from app.api.v1.contacts import CONTACT_SORT_KEY
+from app.core.config import settings
+from app.models.models import Contact
+from app.services.search_index import ContactSearchIndex
+
+# Termini con selettività diverse: cognome parziale, email quasi univoca, cifre del telefono, termine corto
+TERMS = ("ross", "giulia.verdi01", "33312", "ri")
+
+
+def like_page(db, owner_id: int, term: str, size: int):
+    query = db.query(Contact).filter(Contact.owner_id == owner_id, Contact.search_filter(term))
+    return query.count(), query.order_by(*CONTACT_SORT_KEY).limit(size).all()
+
+
+def index_page(db, index: ContactSearchIndex, owner_id: int, term: str, size: int):
+    ids = index.search(db, owner_id, term)
+    if ids is None:
+        return like_page(db, owner_id, term, size)
+    query = db.query(Contact).filter(Contact.owner_id == owner_id, Contact.id.in_(ids))
+    return len(ids), query.order_by(*CONTACT_SORT_KEY).limit(size).all()
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Numero di contatti, separati da virgola")
+    parser.add_argument("--size", type=int, default=10, help="Elementi per pagina")
+    args = parser.parse_args()
+
+    rows = []
+    for n in (int(x) for x in args.sizes.split(",")):
+        engine = make_engine(args.url)
+        owner_id, _ = seed_owner(engine, n)
+        # Budget illimitato: qui misuriamo la ricerca, non l'eviction
+        index = ContactSearchIndex(memory_budget_bytes=1 << 40, ttl_seconds=3600)
+
+        with sessionmaker(bind=engine)() as db:
+            start = time.perf_counter()
+            owner_index = index.get(db, owner_id)
+            build_ms = (time.perf_counter() - start) * 1000
+
+            for term in TERMS:
+                like_stats = measure(lambda: like_page(db, owner_id, term, args.size), args.repeat)
+                index_stats = measure(lambda: index_page(db, index, owner_id, term, args.size), args.repeat)
+                ids = index.search(db, owner_id, term)
+                rows.append((
+                    n, term,
+                    "like" if ids is None else len(ids),
+                    like_stats["p50"], index_stats["p50"], index_stats["p95"],
+                    like_stats["p50"] / index_stats["p50"]
+                ))
+        print(f"{n} contatti: indice costruito in {build_ms:.0f} ms, ~{owner_index.size_bytes / 2**20:.1f} MiB stimati")
+        engine.dispose()
+
+    print(f"\nRicerca per sottostringa, size={args.size}, soglia IN={settings.SEARCH_INDEX_MAX_IDS} (ms)")
+    print_table(("contatti", "termine", "match", "like p50", "index p50", "index p95", "speedup"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# tests/benchmarks/bench_suggest.py
+"""
+Latenza dell'autocompletamento: lookup nell'indice per prefisso e
+GET /contacts/suggest, confrontati con la chiamata che oggi fa la casella
+di ricerca (GET /contacts?search=...) a ogni tasto premuto.
+"""
+import random
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from common import base_parser, make_engine, make_client, seed_owner, measure, print_table, FIRST_NAMES, LAST_NAMES
+from app.services.suggest import SuggestIndex
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--contacts", type=int, default=50000, help="Contatti del proprietario")
+    parser.add_argument("--lookups", type=int, default=20000, help="Lookup misurati sull'indice")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    owner_id, token = seed_owner(engine, args.contacts)
+    client = make_client(engine)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Prefissi come li digita un utente: da 1 a 6 caratteri di nomi reali
+    rnd = random.Random(7)
+    words = [w.lower() for w in FIRST_NAMES + LAST_NAMES]
+    prefixes = [rnd.choice(words)[:rnd.randint(1, 6)] for _ in range(args.lookups)]
+
+    index = SuggestIndex(max_owners=10, idle_seconds=3600, ttl_seconds=3600)
+    with sessionmaker(bind=engine)() as db:
+        start = time.perf_counter()
+        index.suggest(db, owner_id, "a", 8)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        samples = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            index.suggest(db, owner_id, prefix, 8)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+
+    rows = [(
+        "indice (in processo)",
+        samples[len(samples) // 2],
+        samples[int(len(samples) * 0.99)],
+        samples[-1]
+    )]
+    for label, path, params in (
+        ("GET /contacts/suggest", "/api/v1/contacts/suggest", {"q": "ross", "limit": 8}),
+        ("GET /contacts?search=", "/api/v1/contacts", {"search": "ross", "size": 8}),
+    ):
+        stats = measure(lambda: client.get(path, headers=headers, params=params), args.repeat)
+        rows.append((label, stats["p50"], stats["p99"], float("nan")))
+
+    print(f"\nAutocompletamento - {args.contacts} contatti, indice costruito in {build_ms:.0f} ms (ms)")
+    print_table(("percorso", "p50", "p99", "max"), rows)
+
+
+if __name__ == "__main__":
+    main()
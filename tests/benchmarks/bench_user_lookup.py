@@ -0,0 +1,84 @@
+# tests/benchmarks/bench_user_lookup.py
+"""
+Ricerca dell'utente al login con molti utenti (default 1M): confronto tra
+lower(username) = lower(:u), che scandisce la tabella, e il seek su
+username_norm. Stampa anche il piano di esecuzione e la latenza di
+POST /auth/login con uno username inesistente, cioè tutto il login tranne
+la verifica bcrypt.
+"""
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.orm import sessionmaker
+
+from common import base_parser, batched, make_client, make_engine, measure, print_table
+from app.core.rate_limit import rate_limiter
+from app.core.security import get_password_hash
+from app.models.models import Tenant, User, normalize_key
+
+
+def user_rows(tenant_id: int, n: int, hashed: str):
+    for i in range(n):
+        username = f"User{i:07d}"
+        email = f"User{i:07d}@Example.com"
+        yield {
+            "email": email, "email_norm": normalize_key(email),
+            "username": username, "username_norm": normalize_key(username),
+            "hashed_password": hashed, "tenant_id": tenant_id, "is_active": True,
+        }
+
+
+def seed_users(engine, n: int) -> None:
+    # Insert Core: i validator del modello non girano, le colonne *_norm sono esplicite
+    hashed = get_password_hash("Bench123!")
+    with engine.begin() as conn:
+        tenant_id = conn.execute(
+            insert(Tenant).values(name="bench_users", name_norm="bench_users", active=True).returning(Tenant.id)
+        ).scalar_one()
+        for batch in batched(user_rows(tenant_id, n, hashed), 10000):
+            conn.execute(insert(User), batch)
+        conn.execute(text("ANALYZE"))
+
+
+def explain(engine, statement) -> str:
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN QUERY PLAN" if engine.dialect.name == "sqlite" else "EXPLAIN"
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"{prefix} {compiled}")).all()
+    return " / ".join(str(row[-1]) for row in rows)
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    seed_users(engine, args.users)
+    SessionBench = sessionmaker(bind=engine)
+    username = f"USER{args.users // 2:07d}"
+
+    queries = [
+        ("lower(username)", select(User).where(func.lower(User.username) == func.lower(username)).limit(1)),
+        ("username_norm", select(User).where(User.username_norm == normalize_key(username)).limit(1)),
+    ]
+    rows, plans = [], []
+    with SessionBench() as db:
+        for label, statement in queries:
+            assert db.scalar(statement) is not None
+            stats = measure(lambda: db.scalar(statement), args.repeat)
+            rows.append((label, args.users, stats["p50"], stats["p95"]))
+            plans.append((label, explain(engine, statement)))
+
+    rate_limiter.enabled = False
+    with make_client(engine) as client:
+        stats = measure(
+            lambda: client.post("/api/v1/auth/login", json={"username": "nessuno", "password": "x"}),
+            args.repeat
+        )
+    rows.append(("POST /auth/login (utente assente)", args.users, stats["p50"], stats["p95"]))
+
+    print_table(("ricerca", "utenti", "p50 ms", "p95 ms"), rows)
+    print_table(("ricerca", "piano"), plans)
+
+
+if __name__ == "__main__":
+    main()
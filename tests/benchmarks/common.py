@@ -0,0 +1,180 @@
+# tests/benchmarks/common.py
+"""
+Utility condivise dagli script di benchmark.
+Gli script non vengono raccolti da pytest: si lanciano a mano, ad esempio
+    python tests/benchmarks/bench_pagination.py --contacts 50000
+Di default usano un database SQLite temporaneo; con --url si può puntare
+a un PostgreSQL locale per numeri più vicini alla produzione.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+# Configura i percorsi base (come conftest.py)
+ROOT_DIR = Path(__file__).parent.parent.parent
+BACKEND_DIR = ROOT_DIR / "backend"
+load_dotenv(dotenv_path=BACKEND_DIR / ".env")
+sys.path.insert(0, str(BACKEND_DIR))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.main import app
+from app.models.base import Base, get_db
+from app.models.models import Tenant, User, Contact
+from app.core.security import create_access_token
+from app.services.counters import reconcile_counters
+from app.services.last_login import last_login_buffer
+from app.services.principals import principal_cache
+from app.services.revocation import revocation_list
+
+FIRST_NAMES = ["Mario", "Luigi", "Giulia", "Anna", "Marco", "Sara", "Paolo", "Elena", "Luca", "Chiara"]
+LAST_NAMES = ["Rossi", "Bianchi", "Verdi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Marino"]
+
+
+def base_parser(description: str) -> argparse.ArgumentParser:
+    """Argomenti comuni a tutti i benchmark"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--url", default=None, help="URL del database (default: SQLite temporaneo)")
+    parser.add_argument("--repeat", type=int, default=20, help="Ripetizioni per misura")
+    return parser
+
+
+def make_engine(url: Optional[str] = None):
+    """Crea l'engine del benchmark e le tabelle"""
+    if url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="rubrica-bench-"), "bench.db")
+        engine = create_engine(
+            f"sqlite:///{path}",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+
+        @event.listens_for(engine, "connect")
+        def do_connect(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+            dbapi_connection.execute("PRAGMA synchronous=OFF")
+    else:
+        engine = create_engine(url)
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def make_client(engine) -> TestClient:
+    """TestClient dell'applicazione con get_db puntato sull'engine del benchmark"""
+    SessionBench = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    def override_get_db():
+        db = SessionBench()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    # I servizi in memoria aprono sessioni proprie (avvio e task di background)
+    for service in (last_login_buffer, revocation_list, principal_cache):
+        service.session_factory = SessionBench
+    return TestClient(app)
+
+
+def contact_rows(owner_id: int, n: int, seed: int = 42) -> Iterator[dict]:
+    """Genera n contatti pseudo-casuali ma riproducibili"""
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for i in range(n):
+        first = rnd.choice(FIRST_NAMES)
+        last = f"{rnd.choice(LAST_NAMES)}{rnd.randint(0, 9999):04d}"
+        yield {
+            "first_name": first,
+            "last_name": last,
+            "email": f"{first.lower()}.{last.lower()}.{i}@example.com",
+            "phone": f"+39{rnd.randint(3000000000, 3999999999)}",
+            "owner_id": owner_id,
+            "favorite": i % 10 == 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+
+def batched(iterable: Iterable, n: int) -> Iterator[list]:
+    """Come chunks() di models/base.py, ma per iteratori di lunghezza ignota"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
+
+def seed_owner(engine, n_contacts: int, username: str = "bench") -> Tuple[int, str]:
+    """Crea tenant, utente e n_contacts contatti; restituisce (user_id, token)"""
+    SessionBench = sessionmaker(bind=engine)
+    with SessionBench() as db:
+        tenant = Tenant(name=f"{username}_tenant", active=True)
+        db.add(tenant)
+        db.flush()
+        user = User(
+            email=f"{username}@example.com",
+            username=username,
+            hashed_password="x",
+            tenant_id=tenant.id,
+            is_active=True,
+        )
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    with engine.begin() as conn:
+        for batch in batched(contact_rows(user_id, n_contacts), 5000):
+            conn.execute(insert(Contact), batch)
+        # Statistiche aggiornate come su un database in esercizio
+        conn.execute(text("ANALYZE"))
+    # Contatti inseriti fuori dai servizi: i contatori si allineano con la riconciliazione
+    with SessionBench() as db:
+        reconcile_counters(db)
+
+    return user_id, create_access_token(data={"sub": user_id})
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 2) -> Dict[str, float]:
+    """Esegue fn repeat volte e restituisce le statistiche di latenza in ms"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def print_table(headers: Sequence[str], rows: Sequence[Sequence[object]]) -> None:
+    """Stampa una tabella allineata"""
+    cells = [[str(h) for h in headers]] + [
+        [f"{c:.3f}" if isinstance(c, float) else str(c) for c in row] for row in rows
+    ]
+    widths = [max(len(r[i]) for r in cells) for i in range(len(headers))]
+    print("=" * (sum(widths) + 3 * (len(widths) - 1)))
+    for n, row in enumerate(cells):
+        print(" | ".join(c.rjust(w) for c, w in zip(row, widths)))
+        if n == 0:
+            print("-" * (sum(widths) + 3 * (len(widths) - 1)))
+    print("=" * (sum(widths) + 3 * (len(widths) - 1)))